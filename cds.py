@@ -1,252 +1,257 @@
-import datetime
-import os
-import random
-import threading
 import time
-from collections import Counter, deque
 from collections import defaultdict
+from collections import Counter
 from datetime import timedelta
-from itertools import groupby, product
+from itertools import groupby
 from logging import Logger
-from typing import Iterable, Container, List, Optional, Deque, Union, Collection
+from typing import List, Optional, Union, Collection, Dict, Tuple
 
 import cachetools.func
+import numpy as np
 import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
-from rtree import index
 
 from data_types import ArrivalInfo, UserLoc, BusStop, LongBusRouteStop, CdsBusPosition, CdsRouteBus, \
     CdsBaseDataProvider, StatsData, ArrivalBusStopInfo, ArrivalBusStopInfoFull
-from helpers import fuzzy_search_advanced, sort_routes
+from fleet import FleetColumns, FleetSnapshot, RouteSpeedWindow, to_seconds
+from fleet_health import FleetHealthSeries, HealthSample
+from helpers import sort_routes, distances_km
 from helpers import get_time, natural_sort_key, SearchResult
+from map_matching import RouteMatch, EdgePoints
+from position_store import PositionStore
+from route_index import RouteIndex
+from route_registry import RouteRegistry, RouteSet, ROUTES_REFRESH_INTERVAL
+from scheduler import AsyncScheduler
+from search_index import BusStopSearchIndex
+from snapshot_cache import generation_cache
+from speed_profiles import SpeedProfiles, time_bucket, MIN_SAMPLE_SECONDS, MAX_SAMPLE_SECONDS
+from spatial_index import SpatialIndex, build_spatial_index
 
-LOAD_TEST_DATA = False
-
-try:
-    import settings
+tz = pytz.timezone('Europe/Moscow')
 
-    LOAD_TEST_DATA = settings.LOAD_TEST_DATA
-except ImportError:
-    LOAD_TEST_DATA = os.environ.get('LOAD_TEST_DATA', False)
+REFRESH_INTERVAL = 15
+REFRESH_TIMEOUT = 60
+FOLLOWER_POLL_INTERVAL = 1
+SPEED_PROFILES_SAVE_INTERVAL = 40
 
-ttl_sec = 10 if not LOAD_TEST_DATA else 0.0001
 
-tz = pytz.timezone('Europe/Moscow')
-
-WATCHDOG_INTERVAL = 60
+def bus_key(bus_info: CdsRouteBus):
+    return bus_info.obj_id_, bus_info.proj_id_, bus_info.last_time_
 
 
 class CdsRequest:
-    rtree_lock = threading.Lock()
-
     def __init__(self, logger: Logger, data_provider: CdsBaseDataProvider):
         self.logger = logger
         self.fake_header = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                                           '(KHTML, like Gecko) Chrome/63.0.3239.132 Safari/537.36'}
         self.data_provider = data_provider
-        self.all_codd_routes = data_provider.load_codd_route_names()
-        self.codd_routes = {k:v.ID_ for k,v in self.all_codd_routes.items()  if v.ROUTE_ACTIVE_}
-        self.codd_buses = sort_routes(self.codd_routes)
+        self.load_static_data()
+        self.route_registry = RouteRegistry(logger, data_provider)
+
+        self.speed_profiles = SpeedProfiles()
+        self.speed_profiles.load()
 
-        self.codd_new_routes = data_provider.load_new_codd_route_names()
-        self.codd_new_buses = sort_routes(self.codd_new_routes.keys())
-
-        self.bs_index: index.Index = None
-        self.bs_routes_index = {}
-        self.all_bus_stops = data_provider.load_bus_stops()
-        self.bus_stops = [bs for bs in self.all_bus_stops if bs.LAT_ and bs.LON_]
-
-        self.bus_stops_dict = {bs.ID: bs for bs in self.bus_stops}
-        self.bus_stops_dict_name = {bs.NAME_: bs for bs in self.bus_stops}
-        self.bus_routes = data_provider.load_bus_stations_routes()
-        self.new_bus_routes = {}
-
-        self.build_rtree_index(self.bus_stops)
-        self.build_rtree_index_for_routes(self.bus_routes)
-
-        self.all_cds_buses = []
-        self.avg_speed = 18.0
-        self.fetching_in_progress = False
-        self.fetching_timestamp = datetime.datetime.now()
-        self.last_bus_data = defaultdict(lambda: deque(maxlen=20))
-        self.route_distances = {}
-        self.bus_speed_dict = {}
-        self.bus_last_speed_dict = {}
-        self.bus_onroute_dict = {}
-        self.speed_dict = {}
-        self.speed_deque = deque(maxlen=10)
+        self.snapshot = FleetSnapshot()
+        # Refresh-only working state, readers use self.snapshot
+        self.position_store = PositionStore()
+        self.bus_versions = {}
+        self.route_speeds = RouteSpeedWindow()
         self.wd_call_back = None
+        self.fleet_call_back = None
+        self.follower = False
 
-        self.bus_stats = []
+        self.health = FleetHealthSeries()
 
         # self.update_all_cds_buses_from_db()
-        self.scheduler = BackgroundScheduler()
-        self.run_scheduled_task()
-
-    def run_scheduled_task(self):
-        self.scheduler.remove_all_jobs()
-        self.scheduler.start()
-        self.scheduler.add_job(self.update_all_cds_buses_from_db, 'interval', seconds=15, max_instances=1)
-        self.scheduler.add_job(self.update_watch_dog, 'interval', seconds=WATCHDOG_INTERVAL)
-        self.scheduler.add_job(self.load_new_routes_bg)
-
-    def get_fetching_duration(self):
-        return (self.now() - self.fetching_timestamp).total_seconds()
-
-    def update_watch_dog(self):
-        fetching_duration = self.get_fetching_duration()
-        self.logger.debug(f'{fetching_duration=:.2f}')
-        if self.fetching_in_progress and fetching_duration > WATCHDOG_INTERVAL:
-            self.logger.error(f"SOMETHING GOES WRONG {fetching_duration=:.2f}")
-            if self.wd_call_back:
-                self.wd_call_back(f'Слишком долгое ожидание ответа от базы данных {fetching_duration:.0f} с, переподключение')
-
-            self.scheduler.shutdown(wait=False)
-            self.fetching_in_progress = False
-            self.scheduler = BackgroundScheduler()
-            self.run_scheduled_task()
-
-    def load_new_routes_bg(self):
-        self.new_bus_routes = self.data_provider.load_new_bus_stations_routes()
+        self.scheduler: Optional[AsyncScheduler] = None
+
+    def schedule(self, scheduler: AsyncScheduler):
+        self.scheduler = scheduler
+        scheduler.add_job('update_all_cds_buses_from_db', self.update_all_cds_buses_from_db, REFRESH_INTERVAL,
+                          timeout=REFRESH_TIMEOUT, on_timeout=self.on_refresh_timeout)
+        scheduler.add_job('route_registry.refresh', self.route_registry.refresh, ROUTES_REFRESH_INTERVAL)
+
+    def schedule_follower(self, scheduler: AsyncScheduler):
+        """Worker process: the snapshot is rebuilt from each fleet the leader publishes"""
+        self.scheduler = scheduler
+        self.follower = True
+        scheduler.add_job('update_all_cds_buses_from_db', self.update_from_leader, FOLLOWER_POLL_INTERVAL)
+        scheduler.add_job('update_static_from_leader', self.update_static_from_leader, FOLLOWER_POLL_INTERVAL)
+        scheduler.add_job('route_registry.refresh', self.route_registry.refresh, ROUTES_REFRESH_INTERVAL)
+
+    def load_static_data(self):
+        all_codd_routes = self.data_provider.load_codd_route_names()
+        all_bus_stops = self.data_provider.load_bus_stops()
+        bus_stops = [bs for bs in all_bus_stops if bs.LAT_ and bs.LON_]
+
+        self.all_codd_routes = all_codd_routes
+        self.codd_routes = {k:v.ID_ for k,v in all_codd_routes.items()  if v.ROUTE_ACTIVE_}
+        self.codd_buses = sort_routes(self.codd_routes)
+        self.all_bus_stops = all_bus_stops
+        self.bus_stops = bus_stops
+        self.bus_stops_dict = {bs.ID: bs for bs in bus_stops}
+        self.bus_stops_dict_name = {bs.NAME_: bs for bs in bus_stops}
+        self.search_index = BusStopSearchIndex(bus_stops)
+        self.suggest_index = BusStopSearchIndex(all_bus_stops)
+        self.bs_index: SpatialIndex = build_spatial_index(bus_stops)
+
+    def update_from_leader(self):
+        if self.data_provider.has_update():
+            self.update_all_cds_buses_from_db()
+
+    def update_static_from_leader(self):
+        """A worker started before the leader filled the static cache picks the data up here"""
+        if self.data_provider.has_static_update():
+            self.logger.info('Static data updated by the leader')
+            self.load_static_data()
+            self.route_registry.refresh()
+
+    def on_refresh_timeout(self, name, duration):
+        if self.wd_call_back:
+            self.wd_call_back(f'Слишком долгое ожидание ответа от базы данных {duration:.0f} с')
+
+    @property
+    def generation(self) -> int:
+        return self.snapshot.generation
+
+    @property
+    def is_ready(self) -> bool:
+        """A fleet has been loaded at least once"""
+        return self.snapshot.generation > 0
+
+    @property
+    def all_cds_buses(self) -> List[CdsRouteBus]:
+        return self.snapshot.buses
+
+    @property
+    def fleet(self) -> FleetColumns:
+        return self.snapshot.columns
+
+    @property
+    def arrival_boards(self):
+        return self.snapshot.arrival_boards
+
+    @property
+    def avg_speed(self) -> float:
+        return self.snapshot.avg_speed
+
+    @property
+    def speed_dict(self):
+        return self.snapshot.speed_dict
+
+    @property
+    def bus_speed_dict(self):
+        return self.snapshot.bus_speed
+
+    @property
+    def bus_last_speed_dict(self):
+        return self.snapshot.bus_last_speed
+
+    @property
+    def bus_onroute_dict(self):
+        return self.snapshot.bus_onroute
+
+    @property
+    def route_index(self) -> RouteIndex:
+        return self.route_registry.state.routes.index
+
+    @property
+    def new_route_index(self) -> RouteIndex:
+        return self.route_registry.state.new_routes.index
+
+    @property
+    def bs_routes_index(self) -> Dict[str, SpatialIndex]:
+        return self.route_registry.state.routes.spatial_indexes
+
+    @property
+    def bus_routes(self):
+        return self.route_index.bus_routes
+
+    @property
+    def new_bus_routes(self):
+        return self.new_route_index.bus_routes
+
+    @property
+    def codd_new_routes(self):
+        return self.route_registry.state.new_route_names
+
+    @property
+    def codd_new_buses(self):
+        return self.route_registry.state.new_route_list
+
+    def set_route_edges(self, edges: EdgePoints):
+        if self.route_registry.set_route_edges(edges):
+            self.logger.info(f'Map matching uses {len(edges)} route edges')
 
     def get_new_bus_routes(self):
-        self.new_bus_routes = self.data_provider.load_new_bus_stations_routes()
         return self.new_bus_routes
 
     def stats_checking(self):
         self.logger.info("Hello")
 
-    def get_last_bus_data(self, bus_name) -> Deque[CdsBusPosition]:
-        return self.last_bus_data.get(bus_name)
-
-    def add_last_bus_data(self, bus_name, bus_data: CdsBusPosition):
-        value = self.last_bus_data[bus_name]
-        if bus_data in value:
-            return
-        value.append(bus_data)
+    def get_last_bus_data(self, bus_name) -> List[CdsBusPosition]:
+        return self.position_store.positions(bus_name)
 
-    def get_nearest(self, lat, lon) -> BusStop:
-        if self.bs_index is None:
-            self.build_rtree_index(self.bus_stops)
-        ids = list(self.bs_index.nearest((lat, lon), 1))
-        return self.bus_stops_dict.get(ids[0])
+    def get_nearest(self, lat, lon) -> Optional[BusStop]:
+        return next(iter(self.bs_index.nearest(lat, lon, 1)), None)
 
     def get_k_nearest(self, lat, lon, k=3) -> List[BusStop]:
-        try:
-            if self.bs_index is None:
-                self.build_rtree_index(self.bus_stops)
-            ids = self.bs_index.nearest((lat, lon), k)
-            return [self.bus_stops_dict.get(i) for i in ids]
-        except Exception:
-            self.logger.exception(f'Error when process get_k_nearest({lat}, {lon}, {k})')
-            self.build_rtree_index(self.bus_stops)
+        return self.bs_index.nearest(lat, lon, k)
 
     def get_k_nearest_by_route(self, route_name, lat, lon, k=3) -> List[BusStop]:
-        try:
-            r_index = self.bs_routes_index.get(route_name)
-            bus_stops = self.bus_routes.get(route_name, [])
-            ids = [i for i in r_index.nearest((lat, lon), k)][:k]
-            return [next(filter(lambda x: x.ID == i, bus_stops), None) for i in ids]
-        except Exception:
-            self.logger.exception(f'Error when process get_k_nearest({lat}, {lon}, {k})')
-
-    def build_rtree_index(self, bus_stations: Iterable[BusStop]):
-        try:
-            self.logger.info("Recreate RTree index for bus stations")
-            with self.rtree_lock:
-                self.bs_index = index.Index()
-                for bs in bus_stations:
-                    self.bs_index.insert(bs.ID, (bs.LAT_, bs.LON_, bs.LAT_, bs.LON_))
-            self.logger.info("Recreate RTree index for bus stations finished")
-        except:
-            self.bs_index = None
-            self.logger.exception(f'Error when rebuild RTree index')
-
-    def build_rtree_index_for_routes(self, bus_stations_for_routes):
-        try:
-            self.logger.info("Recreate RTree index for routes")
-            with self.rtree_lock:
-                for k, v in bus_stations_for_routes.items():
-                    route_index = index.Index()
-                    for bs in v:
-                        route_index.insert(bs.ID, (bs.LAT_, bs.LON_, bs.LAT_, bs.LON_))
-                    self.bs_routes_index[k] = route_index
-            self.logger.info("Recreate RTree index for routes finished")
-        except:
-            self.bs_index = None
-            self.logger.exception(f'Error when rebuild RTree index')
+        r_index = self.bs_routes_index.get(route_name)
+        if r_index is None:
+            self.logger.error(f'No spatial index for route {route_name}')
+            return []
+        return r_index.nearest(lat, lon, k)
 
     @cachetools.func.ttl_cache()
     def matches_bus_stops(self, lat, lon, size=3):
         return self.get_k_nearest(lat, lon, size)
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
+    @generation_cache(maxsize=256)
     def bus_request_as_list(self, bus_routes):
-        def key_check(route: CdsRouteBus):
-            return route.name_ and last_two_week < route.last_time_
-
         keys = set([x for x in self.all_codd_routes.keys() for r in bus_routes if x.upper() == r.upper()])
 
-        bus_on_routes = self.load_cds_buses_from_db(tuple(keys))
-        self.logger.debug(f'Loaded {len(bus_on_routes)} buses from DB for {bus_routes} query')
-        if bus_on_routes:
-            last_two_week = self.now() - timedelta(days=14)
-            short_result = sorted([d for d in bus_on_routes if key_check(d)],
-                                  key=lambda s: natural_sort_key(s.route_name_))
-            return short_result
-        return []
+        fleet = self.fleet
+        routes_mask = fleet.routes_mask(keys) if keys else fleet.all()
+        self.logger.debug(f'Loaded {np.count_nonzero(routes_mask)} buses from DB for {bus_routes} query')
+        last_two_week = self.now() - timedelta(days=14)
+        bus_on_routes = fleet.select(routes_mask & fleet.has_name & fleet.time_mask(last_two_week, strict=True))
+        return sorted(bus_on_routes, key=lambda s: natural_sort_key(s.route_name_))
 
     def is_bus_on_the_route(self, route_name: str, bus_position: CdsBusPosition):
-        if not bus_position.is_valid_coords():
-            return False
-        route_stops = self.bus_routes.get(route_name, [])
-
-        if not route_stops or len(route_stops) < 2:
-            return False
-
-        result = self.get_k_nearest_by_route(route_name, bus_position.lat, bus_position.lon, 1)
-        return bus_position.distance_km(result[0]) < 1
-
-    def get_closest_bus_stop_checked(self, route_name: str, bus_positions: Container[CdsBusPosition]):
-        bus_stops = self.bus_routes.get(route_name, [])
-
-        if not bus_stops or len(bus_stops) < 2:
-            self.logger.error(f"Empty bus_stops for {route_name}")
-            return
+        return self.are_buses_on_the_route(route_name, [bus_position])[0]
+
+    def are_buses_on_the_route(self, route_name: str, bus_positions: List[CdsBusPosition],
+                               routes: RouteSet = None) -> List[bool]:
+        routes = routes or self.route_registry.state.routes
+        route_stops = routes.bus_routes.get(route_name, [])
+        valid_positions = [x for x in bus_positions if x.is_valid_coords()]
+        if not route_stops or len(route_stops) < 2 or not valid_positions:
+            return [False] * len(bus_positions)
+
+        lats = np.array([x.lat for x in valid_positions])
+        lons = np.array([x.lon for x in valid_positions])
+        nearest = routes.spatial_indexes[route_name].nearest_batch(lats, lons, 1)
+        distances = distances_km(lats, lons, np.array([x[0].LAT_ for x in nearest], dtype=np.float64),
+                                 np.array([x[0].LON_ for x in nearest], dtype=np.float64))
+        on_route = iter(distances < 1)
+        return [bool(next(on_route)) if x.is_valid_coords() else False for x in bus_positions]
+
+    @generation_cache(maxsize=4096, key=bus_key)
+    def get_closest_bus_stop(self, bus_info: CdsRouteBus):
+        return self.find_closest_bus_stop(bus_info, self.snapshot.bus_matches.get(bus_info.name_))
 
-        if not bus_positions:
-            self.logger.error("Empty bus_positions for {route_name}")
+    def get_closest_bus_stop_on_route(self, route_name: str, route_match: Optional[RouteMatch],
+                                      routes: RouteSet = None):
+        bus_stops = (routes or self.route_registry.state.routes).bus_routes.get(route_name)
+        if not bus_stops or not route_match or route_match.route_name != route_name or \
+                route_match.stop_index >= len(bus_stops):
             return
+        return bus_stops[route_match.stop_index]
 
-        last_position = bus_positions[-1]
-        nearest_result = self.get_k_nearest_by_route(route_name, last_position.lat, last_position.lon, 2)
-
-        (curr_1, curr_2) = nearest_result
-        if curr_1.NUMBER_ == curr_2.NUMBER_ + 1:
-            return curr_1
-        elif curr_2.NUMBER_ == curr_1.NUMBER_ + 1:
-            return curr_2
-
-        m_num = bus_stops[len(bus_stops) // 2].NUMBER_
-        curr_pos = {curr_1, curr_2}
-        bus_positions = list(bus_positions)
-        for prev_position in bus_positions[-1::-1]:
-            closest_prev = self.get_k_nearest_by_route(route_name, prev_position.lat, prev_position.lon, 2)
-            if set(closest_prev) == curr_pos:
-                continue
-
-            all_cases = product((curr_1, curr_2), closest_prev)
-            for (s1, s2) in all_cases:
-                n1, n2 = s1.NUMBER_, s2.NUMBER_
-                if n1 > n2 and ((n1 <= m_num and n2 <= m_num) or (n1 >= m_num and n2 >= m_num)):
-                    return s1
-
-            self.logger.debug(f"Bus stop for {route_name} ({last_position.lat}, {last_position.lon})")
-
-        return curr_1
-
-    @cachetools.func.ttl_cache(maxsize=4096)
-    def get_closest_bus_stop(self, bus_info: CdsRouteBus):
+    def find_closest_bus_stop(self, bus_info: CdsRouteBus, route_match: Optional[RouteMatch],
+                              routes: RouteSet = None):
         if not bus_info.is_valid_coords():
             return
         threshold = 0.5
@@ -256,10 +261,7 @@ class CdsRequest:
         elif self.now() - bus_info.last_time_ > timedelta(minutes=15):
             return self.get_nearest(bus_info.last_lat_, bus_info.last_lon_)
 
-        bus_positions = self.last_bus_data[bus_info.name_]
-        if not bus_positions:
-            bus_positions.append(bus_info.get_bus_position())
-        closest_on_route = self.get_closest_bus_stop_checked(bus_info.route_name_, bus_positions)
+        closest_on_route = self.get_closest_bus_stop_on_route(bus_info.route_name_, route_match, routes)
 
         if closest_on_route and bus_info.distance(closest_on_route) < threshold:
             return closest_on_route
@@ -275,7 +277,7 @@ class CdsRequest:
 
         return result
 
-    @cachetools.func.ttl_cache(maxsize=4096)
+    @generation_cache(maxsize=4096, key=bus_key)
     def bus_station(self, bus_info: CdsRouteBus):
         if not bus_info.is_valid_coords():
             self.logger.debug(f"Not valid coords {bus_info}")
@@ -285,14 +287,16 @@ class CdsRequest:
             self.logger.debug(f"{result} {bus_info}")
         return result
 
-    def station(self, d: CdsRouteBus, user_loc: UserLoc = None, full_info=False, show_route_name=True):
+    def station(self, d: CdsRouteBus, user_loc: UserLoc = None, full_info=False, show_route_name=True,
+                snapshot: FleetSnapshot = None):
+        snapshot = snapshot or self.snapshot
         bus_station = self.bus_station(d)
         dist = f'{(d.distance_km(bus_stop=bus_station)):.1f} км'
         route_name = f"{d.route_name_} " if show_route_name else ""
         day_info = ""
         if self.now() - d.last_time_ > timedelta(days=1):
             day_info = f'{d.last_time_:%d.%m} '
-        speed_info = f' {d.last_speed_:.1f} ~ {self.bus_speed_dict.get(d.name_, 18):.1f} км/ч'
+        speed_info = f' {d.last_speed_:.1f} ~ {snapshot.bus_speed.get(d.name_, 18):.1f} км/ч'
         result = f"{route_name}{day_info}{get_time(d.last_time_):%H:%M} {bus_station and bus_station.NAME_} {dist}"
 
         if full_info:
@@ -303,29 +307,31 @@ class CdsRequest:
             return f"{result} {'ВЫВЕДЕН ' if d.obj_output else ''}{d.name_},{speed_info} {orig_bus_stop}"
         return result + speed_info
 
-    def bus_active(self, d: CdsRouteBus, full_info):
+    def bus_active(self, d: CdsRouteBus, full_info, snapshot: FleetSnapshot = None):
         if full_info:
             return True
+        snapshot = snapshot or self.snapshot
         if d.obj_output:
             return
-        if not self.bus_onroute_dict.get(d.name_, False):
+        if not snapshot.bus_onroute.get(d.name_, False):
             return
-        if self.bus_speed_dict.get(d.name_, 18) < 1:
+        if snapshot.bus_speed.get(d.name_, 18) < 1:
             return
         now = self.now()
         delta = timedelta(minutes=15)
         return d.last_time_ and (now - d.last_time_) < delta
 
-    def filter_bus_list(self, bus_list, search_result: SearchResult):
+    def filter_bus_list(self, bus_list, search_result: SearchResult, snapshot: FleetSnapshot = None):
+        snapshot = snapshot or self.snapshot
 
         def filtered(d: CdsRouteBus):
             return d.filter_by_name(search_result.bus_filter)
 
         stations_filtered = [(d, self.get_next_bus_stop(d.route_name_, self.bus_station(d)))
-                             for d in bus_list if filtered(d) and self.bus_active(d, search_result.full_info)]
+                             for d in bus_list if filtered(d) and self.bus_active(d, search_result.full_info, snapshot)]
         return stations_filtered
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
+    @generation_cache(maxsize=1024)
     def bus_request(self, search_result: SearchResult, user_loc: UserLoc = None, short_format=False):
         if search_result.all_buses:
             keys = set(self.all_codd_routes.keys())
@@ -335,9 +341,10 @@ class CdsRequest:
 
         if not keys and not search_result.bus_filter:
             return 'Не заданы маршруты', []
+        snapshot = self.snapshot
         short_result = self.bus_request_as_list(tuple(keys))
         if short_result:
-            stations_filtered = self.filter_bus_list(short_result, search_result)
+            stations_filtered = self.filter_bus_list(short_result, search_result, snapshot)
             if stations_filtered:
                 stations_filtered.sort(key=lambda x: natural_sort_key(x[0].route_name_))
                 if short_format:
@@ -348,10 +355,10 @@ class CdsRequest:
                             cur_route = k.route_name_
                             lines.append("")
                             lines.append(cur_route)
-                        lines.append(self.station(k, user_loc, search_result.full_info, False))
+                        lines.append(self.station(k, user_loc, search_result.full_info, False, snapshot))
                     text = ' \n'.join(lines)
                 else:
-                    text = ' \n'.join((self.station(d[0], user_loc, search_result.full_info)
+                    text = ' \n'.join((self.station(d[0], user_loc, search_result.full_info, snapshot=snapshot)
                                        for d in stations_filtered))
                 return text, stations_filtered
 
@@ -363,112 +370,118 @@ class CdsRequest:
     def load_all_cds_buses_from_db(self) -> List[CdsRouteBus]:
         return self.all_cds_buses
 
-    def update_all_cds_buses_from_db(self):
-        def calc_speed(bus_positions: Iterable[CdsBusPosition]):
-            curr_pos = bus_positions[0]
-            dist = 0
-            for pos in bus_positions:
-                if not pos.is_valid_coords():
-                    continue
-                dist = dist + pos.distance_km(position=curr_pos)
-                curr_pos = pos
-            delta = bus_positions[-1].last_time - bus_positions[0].last_time
-            if delta.seconds == 0:
-                return 0.00001
-            return dist * 3600 / delta.seconds
-
-        def calc_result_speed(bus_positions: List[CdsBusPosition]):
-            if len(bus_positions) < 2:
-                return 18
-            last_speed = calc_speed(bus_positions[:3])
-            avg_speed = calc_speed(bus_positions)
-
-        def update_average_speeds():
-            for (k, bus_positions) in self.last_bus_data.items():
-                if len(bus_positions) < 2:
-                    continue
-                bus_positions = list(filter(lambda bus: bus.is_valid_coords(), bus_positions))
-                if not bus_positions:
-                    continue
+    def get_changed_buses(self, buses: List[CdsRouteBus]) -> Tuple[List[CdsRouteBus], Dict]:
+        bus_versions = {x.get_obj_key(): x for x in buses}
+        prev_versions = self.bus_versions
+        return [x for x in buses if prev_versions.get(x.get_obj_key()) != bus_versions[x.get_obj_key()]], bus_versions
 
-                bus_positions = list(sorted(bus_positions, key=lambda x: x.last_time))
-
-                last_speed = calc_speed(bus_positions[-3:])
-                avg_speed = calc_speed(bus_positions)
-                if avg_speed < 5 < last_speed:
-                    self.last_bus_data[k] = deque(bus_positions[-3:], maxlen=20)
-                    avg_speed = last_speed
-                elif last_speed > avg_speed * 2:
-                    self.last_bus_data[k] = deque(bus_positions[-10:], maxlen=20)
-                    avg_speed = last_speed = calc_speed(self.last_bus_data[k])
-
-                self.bus_last_speed_dict[k] = last_speed
-                self.bus_speed_dict[k] = avg_speed
-
-        def update_last_bus_data(buses: List[CdsRouteBus]):
-            for bus in buses:
-                bus_position = bus.get_bus_position()
-                self.add_last_bus_data(bus.name_, bus_position)
-                self.bus_onroute_dict[bus.name_] = self.is_bus_on_the_route(bus.route_name_, bus_position)
-            update_average_speeds()
-            return [x._replace(avg_speed=self.bus_speed_dict.get(x.name_, 18),
-                               avg_last_speed=self.bus_last_speed_dict.get(x.name_, 18)) for x in buses]
-
-        query_id = random.randint(0, 1000)
-        i = 0
-        while self.fetching_in_progress and i < 10:
-            self.logger.info(f"Waiting for previous DB query {query_id=}, {i=}")
-            time.sleep(5)
+    def update_all_cds_buses_from_db(self):
+        def build_snapshot(buses: List[CdsRouteBus], prev: FleetSnapshot) \
+                -> Tuple[FleetSnapshot, Dict, List, PositionStore, RouteSpeedWindow]:
+            position_store = self.position_store.copy()
+            route_speeds = self.route_speeds.copy()
+            bus_speed = dict(prev.bus_speed)
+            bus_last_speed = dict(prev.bus_last_speed)
+            bus_onroute = dict(prev.bus_onroute)
+            bus_matches = dict(prev.bus_matches)
+            routes = self.route_registry.state.routes
+
+            prev_versions = self.bus_versions
+            (changed_buses, bus_versions) = self.get_changed_buses(buses)
+            self.logger.debug(f'Changed buses: {len(changed_buses)} from {len(buses)}')
+            speed_samples = []
+            for (route_name, route_buses) in groupby(sorted(changed_buses, key=lambda x: x.route_name_ or ''),
+                                                     key=lambda x: x.route_name_ or ''):
+                route_buses = list(route_buses)
+                route_positions = [x.get_bus_position() for x in route_buses]
+                for (bus, bus_position) in zip(route_buses, route_positions):
+                    position_store.add(bus.name_, bus_position)
+                on_route = self.are_buses_on_the_route(route_name, route_positions, routes)
+                bus_onroute.update(zip((x.name_ for x in route_buses), on_route))
+                prev_matches = [bus_matches.get(x.name_) for x in route_buses]
+                route_matches = routes.map_matcher.match(route_name, route_positions, prev_matches)
+                bus_matches.update(zip((x.name_ for x in route_buses), route_matches))
+                speed_samples += self.get_speed_samples(routes, route_name, prev_matches, route_matches)
+            changed_names = {x.name_ for x in changed_buses}
+            (names, avg_speeds, last_speeds) = position_store.update_speeds(changed_names)
+            bus_speed.update(zip(names, avg_speeds.tolist()))
+            bus_last_speed.update(zip(names, last_speeds.tolist()))
+            for name in position_store.evict(to_seconds(self.now())):
+                for values in (bus_speed, bus_last_speed, bus_onroute, bus_matches):
+                    values.pop(name, None)
+
+            result = [x._replace(avg_speed=bus_speed.get(x.name_, 18),
+                                 avg_last_speed=bus_last_speed.get(x.name_, 18)) for x in buses]
+            changed_keys = {x.get_obj_key() for x in changed_buses}
+            route_speeds.update((x for x in result if x.get_obj_key() in changed_keys),
+                                prev_versions.keys() - bus_versions.keys(), self.now())
+            self.logger.debug(f'Average speed for all buses: {route_speeds.avg_speed:.1f}')
+            result.sort(key=lambda s: s.last_time_, reverse=True)
+            columns = FleetColumns(result)
+            arrival_boards = self.calc_arrival_boards(columns, bus_matches, bus_speed, routes)
+            snapshot = FleetSnapshot(prev.generation + 1, self.now(), columns, bus_speed, bus_last_speed,
+                                     bus_onroute, bus_matches, arrival_boards, route_speeds.speed_dict(),
+                                     route_speeds.avg_speed)
+            return snapshot, bus_versions, speed_samples, position_store, route_speeds
+
+        start = time.monotonic()
+        all_buses = self.data_provider.load_all_cds_buses()
+        fetch_seconds = time.monotonic() - start
+        if all_buses is None:
+            self.logger.error(f'No fleet after {fetch_seconds:.1f} s, keep the previous snapshot')
             return
-
+        # The build works on copies of the position store and the speed window. They are committed with
+        # the versions and speed samples only when the snapshot is published: a refresh that fails halfway
+        # leaves no trace and reprocesses the same buses next time
+        (snapshot, bus_versions, speed_samples, position_store, route_speeds) = \
+            build_snapshot(all_buses, self.snapshot)
+        route_counts = Counter(bus.route_name_ for bus in snapshot.buses
+                               if self.bus_active(bus, False, snapshot) == True)
+        self.health.add(HealthSample(self.now(), sum(route_counts.values()), fetch_seconds, len(all_buses),
+                                     dict(route_counts)))
+        self.snapshot = snapshot
+        self.bus_versions = bus_versions
+        self.position_store = position_store
+        self.route_speeds = route_speeds
+        if speed_samples:
+            self.speed_profiles.add(*zip(*speed_samples))
+        if self.fleet_call_back:
+            self.fleet_call_back(all_buses, self.now())
+        if snapshot.generation % SPEED_PROFILES_SAVE_INTERVAL == 0 and not self.follower:
+            self.save_speed_profiles()
+
+    def save_speed_profiles(self):
         try:
-            self.fetching_in_progress = True
-            self.fetching_timestamp = datetime.datetime.now()
-            all_buses = self.data_provider.load_all_cds_buses()
-            result = update_last_bus_data(all_buses)
-            self.bus_stats.append((self.now(), sum((self.bus_active(bus, False) == True for bus in result ))))
-            result.sort(key=lambda s: s.last_time_, reverse=True)
+            self.speed_profiles.save()
+        except Exception:
+            self.logger.exception('Cannot save speed profiles')
 
-        finally:
-            self.fetching_in_progress = False
-        self.all_cds_buses = result
+    def get_speed_samples(self, routes: RouteSet, route_name: str, prev_matches: List[Optional[RouteMatch]],
+                          route_matches: List[Optional[RouteMatch]]):
+        route = routes.bus_routes.get(route_name)
+        result = []
+        for (prev, curr) in zip(prev_matches, route_matches):
+            segments = routes.map_matcher.travelled_segments(prev, curr)
+            if not segments:
+                continue
+            seconds = (curr.last_time - prev.last_time).total_seconds()
+            if not MIN_SAMPLE_SECONDS <= seconds <= MAX_SAMPLE_SECONDS:
+                continue
+            speed = (curr.offset - prev.offset) * 3600 / seconds
+            bucket = time_bucket(curr.last_time)
+            result += [((route[i].ID, route[i + 1].ID), bucket, speed) for i in segments]
+        return result
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
     def calc_avg_speed(self):
-        def time_filter(bus: CdsRouteBus):
-            if not bus.last_station_time_ or not bus.last_time_:
-                return False
-            if bus.last_time_ < last_n_minutes:
-                return False
-            if bus.last_station_time_ < last_n_minutes:
-                return False
-            return True
+        """Average speed for all buses, precomputed with every refresh"""
+        return self.snapshot.avg_speed
 
-        bus_full_list = self.load_all_cds_buses_from_db()
-        now = self.now()
-        last_n_minutes = now - timedelta(minutes=15)
-        bus_list = list(filter(time_filter, bus_full_list))
-        self.logger.debug(f'Buses in last 15 munutes {len(bus_list)} from {len(bus_full_list)}')
-        sum_speed = sum((x.last_speed_ for x in bus_list))
-        if len(bus_list) > 0:
-            self.speed_deque.append(sum_speed * 1.0 / len(bus_list))
-            self.avg_speed = sum(self.speed_deque) / len(self.speed_deque)
-        self.logger.info(f'Average speed for all buses: {self.avg_speed:.1f}')
-        speed_dict = {}
-        curr_bus_routes = Counter((x.route_name_ for x in bus_list))
-        for (route, size) in curr_bus_routes.items():
-            speed_dict[route] = sum((
-                self.bus_speed_dict.get(x.name_, 18) for x in bus_list
-                if x.route_name_ == route and self.bus_speed_dict.get(x.name_, 18) > 1)) / size
-        self.speed_dict = speed_dict
-
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
+    @generation_cache(maxsize=256)
     def load_cds_buses_from_db(self, keys) -> Collection[CdsRouteBus]:
-        all_buses = self.load_all_cds_buses_from_db()
+        fleet = self.fleet
         if not keys:
-            return all_buses
-        result = [x for x in all_buses if x.route_name_ in keys]
-        return result
+            return fleet.buses
+        return fleet.select(fleet.routes_mask(keys))
 
     def get_bus_stop_id(self, name):
         bus_stop = self.bus_stops_dict_name.get(name)
@@ -484,9 +497,9 @@ class CdsRequest:
             return None
         return self.bus_stops[id]
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
+    @generation_cache(maxsize=1024)
     def next_bus(self, bus_stop_query, search_result) -> ArrivalInfo:
-        bus_stop_matches = [x for x in self.bus_stops if fuzzy_search_advanced(bus_stop_query, x.NAME_)]
+        bus_stop_matches = self.search_index.search(bus_stop_query, limit=21)
         if not bus_stop_matches:
             text = f'Остановки c именем "{bus_stop_query}" не найдены'
             return ArrivalInfo(text=text, header=text)
@@ -497,48 +510,93 @@ class CdsRequest:
                                bus_stops=bus_stop_matches[:20])
         return self.next_bus_for_matches(tuple(bus_stop_matches), search_result)
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec, maxsize=4096)
-    def get_bus_distance_to(self, bus_route_names, bus_stop_name, bus_filter) -> List[ArrivalBusStopInfo]:
-        def time_filter(bus_info: CdsRouteBus):
-            if not bus_info.last_time_ or bus_info.last_time_ < last_n_minutes:
-                return False
-            if bus_info.last_station_time_ and bus_info.last_station_time_ < last_n_minutes:
-                return False
-            return True
-
-        def time_to_arrive(km, last_time, avg_speed):
-            speed = avg_speed if avg_speed > 0.1 else 0.1
-            speed = speed if speed > 100 else 18.0
-            minutes = (km * 60 / speed)
+    def calc_arrival_boards(self, fleet: FleetColumns, bus_matches: Dict[str, RouteMatch], bus_speed: Dict[str, float],
+                            routes: RouteSet) -> Dict[int, Tuple[ArrivalBusStopInfo, ...]]:
+        def time_to_arrive(km, last_time, avg_speed, profiled_km=0.0, profiled_minutes=0.0):
+            speed = avg_speed if 5 <= avg_speed < 100 else 18.0
+            minutes = (km - profiled_km) * 60 / speed + profiled_minutes
             time_diff = now - last_time
             return minutes - time_diff.seconds / 60
 
+        def profiled_path(route_name, start, stop):
+            if route_name not in travel_times:
+                travel_times[route_name] = self.speed_profiles.route_travel_times(
+                    route_index.bus_routes.get(route_name), route_index.distances.get(route_name),
+                    routes.map_matcher.geometries.get(route_name), bucket)
+            positions = route_index.positions.get(route_name, {})
+            (start, stop) = (positions.get(start), positions.get(stop))
+            if not travel_times[route_name] or start is None or stop is None or stop <= start:
+                return 0.0, 0.0
+            (minutes, fallback_km) = travel_times[route_name]
+            distances = route_index.distances[route_name]
+            profiled_km = distances[stop] - distances[start] - (fallback_km[stop] - fallback_km[start])
+            return float(profiled_km), float(minutes[stop] - minutes[start])
+
+        def route_start(bus: CdsRouteBus, closest_stop: LongBusRouteStop) -> Optional[str]:
+            """The route stop the bus is counted from: the closest stop, its station or the first stop"""
+            positions = route_index.positions.get(bus.route_name_, {})
+            for name in (closest_stop.NAME_, bus.bus_station_):
+                if name in positions:
+                    return name
+            return next(iter(positions), None)
+
+        def bus_stop_names(bus: CdsRouteBus, start_name: Optional[str]):
+            positions = route_index.positions.get(bus.route_name_, {})
+            start = positions.get(start_name)
+            result = [k for (k, v) in positions.items() if start is not None and v > start]
+            if bus.bus_station_ not in result:
+                result.append(bus.bus_station_)
+            return result
+
+        def distance_to_stop(bus: CdsRouteBus, closest_stop: LongBusRouteStop, km: float):
+            route_match = bus_matches.get(bus.name_)
+            if closest_stop is not self.get_closest_bus_stop_on_route(bus.route_name_, route_match, routes):
+                return km
+            remaining_km = routes.map_matcher.remaining_km(route_match)
+            return km if remaining_km is None else remaining_km
+
+        route_index = routes.index
         now = self.now()
         last_n_minutes = now - timedelta(minutes=15)
+        bucket = time_bucket(now)
+        travel_times = {}
 
-        result = []
-        all_buses = [x for x in self.load_cds_buses_from_db(tuple(bus_route_names)) if time_filter(x)]
+        mask = fleet.time_mask(last_n_minutes) & fleet.station_time_mask(last_n_minutes, allow_empty=True)
+        all_buses = fleet.select(mask)
+        closest_stops = [self.find_closest_bus_stop(x, bus_matches.get(x.name_), routes) for x in all_buses]
+        all_buses = [(bus, stop) for (bus, stop) in zip(all_buses, closest_stops) if stop]
         if not all_buses:
-            return result
-
-        for bus in all_buses:
-            if not bus.filter_by_name(bus_filter):
-                continue
-            closest_stop = self.get_closest_bus_stop(bus)
-            if not closest_stop:
-                continue
-            bus_dist = bus.distance_km(closest_stop)
-            same_station = bus.bus_station_ == bus_stop_name
-            route_dist = self.get_dist(bus.route_name_, closest_stop.NAME_, bus_stop_name)
-            if route_dist == 0 and not same_station:
-                continue
-            if bus.bus_station_ != closest_stop.NAME_:
-                route_dist += self.get_dist(bus.route_name_, bus.bus_station_, bus_stop_name)
-            dist = bus_dist + route_dist
-            time_left = time_to_arrive(dist, bus.last_time_, self.bus_speed_dict.get(bus.name_, 18))
-            if (same_station or route_dist > 0) and dist < 20 and time_left < 30:
-                result.append(ArrivalBusStopInfo(bus, dist, time_left))
-        return result
+            return {}
+
+        boards = defaultdict(list)
+        bus_distances = distances_km([x.last_lat_ for x, _ in all_buses], [x.last_lon_ for x, _ in all_buses],
+                                     [x.LAT_ for _, x in all_buses], [x.LON_ for _, x in all_buses])
+        for ((bus, closest_stop), bus_dist) in zip(all_buses, bus_distances.tolist()):
+            bus_dist = distance_to_stop(bus, closest_stop, bus_dist)
+            start_name = route_start(bus, closest_stop)
+            for bus_stop_name in bus_stop_names(bus, start_name):
+                same_station = bus.bus_station_ == bus_stop_name
+                route_dist = route_index.get_dist(bus.route_name_, start_name, bus_stop_name)
+                if route_dist == 0 and not same_station:
+                    continue
+                if bus.bus_station_ not in (closest_stop.NAME_, start_name):
+                    route_dist += route_index.get_dist(bus.route_name_, bus.bus_station_, bus_stop_name)
+                dist = bus_dist + route_dist
+                time_left = time_to_arrive(dist, bus.last_time_, bus_speed.get(bus.name_, 18),
+                                           *profiled_path(bus.route_name_, start_name, bus_stop_name))
+                if (same_station or route_dist > 0) and dist < 20 and time_left < 30:
+                    boards[bus_stop_name].append(ArrivalBusStopInfo(bus, dist, time_left))
+
+        for arrival_buses in boards.values():
+            arrival_buses.sort(key=lambda x: x.time_left)
+        return {bs.ID: tuple(boards[bs.NAME_]) for bs in self.bus_stops if bs.NAME_ in boards}
+
+    def get_arrival_buses(self, bus_stop_id, bus_route_names, bus_filter,
+                          snapshot: FleetSnapshot = None) -> List[ArrivalBusStopInfo]:
+        bus_route_names = set(bus_route_names)
+        snapshot = snapshot or self.snapshot
+        return [x for x in snapshot.arrival_boards.get(bus_stop_id, ())
+                if x.bus_info.route_name_ in bus_route_names and x.bus_info.filter_by_name(bus_filter)]
 
     # @cachetools.func.ttl_cache(ttl=30)
     def next_bus_for_matches(self, bus_stop_matches, search_result: SearchResult) -> ArrivalInfo:
@@ -549,18 +607,19 @@ class CdsRequest:
                 info += f' {distance:.2f} км {bus.last_time_:%H:%M} {bus.name_} {self.bus_station(bus).NAME_}'
             return info
 
+        snapshot = self.snapshot
+        (avg_speed, speed_dict) = (snapshot.avg_speed, snapshot.speed_dict)
         result = [f'Время: {self.now():%H:%M:%S}']
         routes_set = set()
         routes_filter = list(set([x for x in self.codd_routes.keys()
                                   for r in search_result.bus_routes if x.upper() == r.upper()]))
-        self.calc_avg_speed()
 
         if search_result.bus_routes:
             result.append(f"Фильтр по маршрутам: {' '.join(search_result.bus_routes)};")
         if search_result.full_info:
-            result.append(f"Средняя скорость: {self.avg_speed:2.1f} км/ч")
+            result.append(f"Средняя скорость: {avg_speed:2.1f} км/ч")
             if search_result.bus_routes and routes_filter:
-                avg_speed_routes = sum((self.speed_dict.get(x, self.avg_speed)
+                avg_speed_routes = sum((speed_dict.get(x, avg_speed)
                                         for x in routes_filter)) / len(routes_filter)
 
                 result.append(f"Средняя скорость на маршрутах {avg_speed_routes:.2f} км/ч")
@@ -574,15 +633,14 @@ class CdsRequest:
             if not arrival_routes:
                 continue
             if routes_filter:
-                avg_speed_routes = sum((self.speed_dict.get(x, self.avg_speed)
+                avg_speed_routes = sum((speed_dict.get(x, avg_speed)
                                         for x in routes_filter)) / len(routes_filter)
                 self.logger.info(f'Average speed on routes {arrival_routes} {avg_speed_routes:.2f} kmh')
 
             routes_set.update(arrival_routes)
             arrival_routes = tuple(sorted(arrival_routes, key=natural_sort_key))
             result.append(f'{item.NAME_}:')
-            arrival_buses = self.get_bus_distance_to(arrival_routes, item.NAME_, search_result.bus_filter)
-            arrival_buses.sort(key=lambda x: x[2])
+            arrival_buses = self.get_arrival_buses(item.ID, arrival_routes, search_result.bus_filter, snapshot)
             bus_stop_value = '\n'.join((bus_info(*d) for d in arrival_buses))
             arrival_details.append(
                 ArrivalBusStopInfoFull(item.ID, item.NAME_, item.LAT_, item.LON_, item.AZMTH, bus_stop_value, list(arrival_routes),
@@ -595,89 +653,55 @@ class CdsRequest:
         result.append(f'Возможные маршруты: {" ".join(routes_list)}')
         return ArrivalInfo('\n'.join(result), "\n".join(headers), arrival_details, found=True)
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
+    @generation_cache(maxsize=8)
     def get_bus_statistics(self, full_info=False) -> Optional[StatsData]:
-        def time_check(bus: CdsRouteBus, last_time):
-            if not bus.last_time_ or bus.last_time_ < last_time:
-                return False
-            # if bus.last_station_time_ and bus.last_station_time_ < last_time:
-            #     return False
-            return True
-
-        def count_buses(buses: Iterable[CdsRouteBus], time_interval):
-            return sum(1 for i in buses if time_check(i, now - time_interval) and i.obj_output != 1)
+        def count_buses(time_interval):
+            return stats.active_since(now - time_interval)
 
-        cds_buses = self.load_all_cds_buses_from_db()
+        snapshot = self.snapshot
+        stats = snapshot.stats
+        cds_buses = snapshot.buses
         if not cds_buses:
             return
 
         now = self.now()
-        hour_1 = count_buses(cds_buses, timedelta(hours=1))
-        minutes_1 = count_buses(cds_buses, timedelta(minutes=1))
-        minutes_10 = count_buses(cds_buses, timedelta(minutes=10))
-        minutes_30 = count_buses(cds_buses, timedelta(minutes=30))
-        total = count_buses(cds_buses, timedelta(days=7))
+        hour_1 = count_buses(timedelta(hours=1))
+        minutes_1 = count_buses(timedelta(minutes=1))
+        minutes_10 = count_buses(timedelta(minutes=10))
+        minutes_30 = count_buses(timedelta(minutes=30))
+        total = count_buses(timedelta(days=7))
         bus_stats_text = f"1 ч. 30 мин. 10 мин.\n{hour_1:<5} {minutes_30:^5} {minutes_10:5}\nЗа минуту: {minutes_1}\nВсего: {total}"
         self.logger.info(f"{hour_1: <5} {minutes_30:5} {minutes_10:5}")
         if hour_1 > 0:
             buses_list = [f'Время: {self.now():%H:%M:%S}']
             if full_info:
-                short_result = [d for d in cds_buses if time_check(d, now - timedelta(minutes=10))]
-                sort_routes = sorted(short_result, key=lambda x: natural_sort_key(x.route_name_))
-                grouped = [(k, len(list(g))) for k, g in
-                           groupby(sort_routes, lambda x: f'{x.route_name_:5s} ({x.proj_id_:3d})')]
+                grouped = stats.route_counts_since(now - timedelta(minutes=10))
                 buses_list += (('{:10s} => {}'.format(i[0], i[1])) for i in grouped)
             buses_list.append(bus_stats_text)
             text = '\n'.join(buses_list)
-            text += f'\nНа линии: {self.bus_stats[-1][1]}'
+            text += f'\nНа линии: {self.health.last().active}'
+            if self.scheduler:
+                refresh = self.scheduler.jobs['update_all_cds_buses_from_db']
+                text += f'\nОбновление: {refresh.last_duration:.1f} с, задержка {refresh.last_lag:.1f} с'
             return StatsData(minutes_1, minutes_10, minutes_30, hour_1, len(cds_buses), text)
 
-    def get_dist_bus_stop(self, src: LongBusRouteStop, dst: LongBusRouteStop):
-        key = (src.ID, dst.ID)
-        if key in self.route_distances:
-            return self.route_distances.get(key)
-        value = src.distance_km(dst)
-        self.route_distances[key] = value
-        return value
-
     def get_dist(self, route_name, bus_stop_start, bus_stop_stop):
-        route: Iterable[LongBusRouteStop] = self.bus_routes.get(route_name, [])
-
-        dist = 0
-        prev_stop = None
-        for bus_stop in route:
-            if prev_stop:
-                dist += self.get_dist_bus_stop(prev_stop, bus_stop)
-                prev_stop = bus_stop
-            if not prev_stop and bus_stop.NAME_ == bus_stop_start:
-                prev_stop = bus_stop
-            if bus_stop.NAME_ == bus_stop_stop:
-                break
-        return dist
-
-    @cachetools.func.ttl_cache(maxsize=4096)
+        return self.route_index.get_dist(route_name, bus_stop_start, bus_stop_stop)
+
     def get_routes_on_bus_stop(self, bus_stop_id):
-        result = []
-        for (k, v) in self.bus_routes.items():
-            if next((True for x in v if x.ID == bus_stop_id), False):
-                result.append(k)
-        return result
+        return list(self.route_index.get_routes_on_bus_stop(bus_stop_id))
+
+    def get_new_routes_on_bus_stop(self, bus_stop_id):
+        return list(self.new_route_index.get_routes_on_bus_stop(bus_stop_id))
 
-    @cachetools.func.ttl_cache(maxsize=4096)
     def get_next_bus_stop(self, route_name, bus_stop: LongBusRouteStop):
         bus_stop_name = bus_stop and bus_stop.NAME_
-        route = self.bus_routes.get(route_name, [])
-        if not route:
+        if not self.bus_routes.get(route_name):
             self.logger.debug(f"Wrong params {route_name}, {bus_stop_name}. Didn't find anything")
             return bus_stop
-        size = len(route)
-        for (i, v) in enumerate(route):
-            if v.NAME_ == bus_stop_name:
-                if (i + 2) < size:
-                    return route[i + 1]
-                if i + 1 == size:
-                    return v
-                return v
+        next_bus_stop = self.route_index.get_next_bus_stop(route_name, bus_stop_name)
+        if next_bus_stop:
+            return next_bus_stop
         self.logger.debug(f"Wrong params {route_name}, {bus_stop_name}")
         bus_stop = self.bus_stops_dict_name.get(bus_stop_name)
         if bus_stop:
@@ -691,4 +715,10 @@ class CdsRequest:
             return False
         if s in self.codd_routes:
             return False
-        return any((x for x in self.bus_stops if fuzzy_search_advanced(s, x.NAME_)))
+        return self.search_index.has_matches(s)
+
+    def suggest_bus_stops(self, query) -> List[BusStop]:
+        """Stops whose name contains the query, case-insensitive, as the page autocomplete always matched them"""
+        if not query or not isinstance(query, str):
+            return []
+        return self.suggest_index.substring_search(query)
@@ -11,22 +11,24 @@ from cds import CdsRequest
 from data_types import UserLoc, ArrivalInfo, CdsRouteBus
 from db import session_scope
 from fotobus_scrapper import fb_links
-from helpers import parse_routes
+from helpers import parse_routes, CustomJsonEncoder
+from map_matching import parse_route_edges
+from scheduler import AsyncScheduler
+from snapshot_cache import generation_cache
+from static_payloads import PayloadCache, PreparedPayload, content_version, prepare_payload
 from models import RouteEdges
 from tracking import EventTracker
 
-LOAD_TEST_DATA = False
-
-try:
-    import settings
-
-    LOAD_TEST_DATA = settings.LOAD_TEST_DATA
-except ImportError:
-    LOAD_TEST_DATA = os.environ.get('LOAD_TEST_DATA', False)
-
-ttl_sec = 10 if not LOAD_TEST_DATA else 0.0001
-
 COMPLAINS_EMAIL = os.environ.get('COMPLAINS_EMAIL', 'МБУ ЦОДД <cds-vrn@mail.ru>')
+ROUTE_EDGES_REFRESH_INTERVAL = int(os.environ.get('ROUTE_EDGES_REFRESH_INTERVAL', 300))
+
+STATIC_PAYLOADS = {
+    'buslist': ('get_bus_list', {}),
+    'bus_stops': ('get_bus_stops', {'ensure_ascii': False}),
+    'bus_stops_routes': ('get_bus_stops_for_routes', {'ensure_ascii': False}),
+    'bus_stations': ('get_bus_stops_for_routes_for_apps', {'ensure_ascii': False, 'indent': 1,
+                                                          'cls': CustomJsonEncoder}),
+}
 
 
 def isnamedtupleinstance(x):
@@ -74,12 +76,30 @@ class BaseDataProcessor:
         self.logger = logger
         self.tracker = tracker
 
+    @property
+    def generation(self):
+        return self.cds.generation
+
 
 class WebDataProcessor(BaseDataProcessor):
     def __init__(self, cds: CdsRequest, logger: Logger, tracker: EventTracker):
         super().__init__(cds, logger, tracker)
+        self.payloads = PayloadCache()
+
+    def schedule(self, scheduler: AsyncScheduler):
+        scheduler.add_job('update_route_edges', self.update_route_edges, ROUTE_EDGES_REFRESH_INTERVAL)
+
+    @property
+    def static_version(self) -> str:
+        return content_version(self.get_static_payload(name) for name in STATIC_PAYLOADS)
+
+    def get_static_payload(self, name) -> PreparedPayload:
+        (method, dumps_kwargs) = STATIC_PAYLOADS[name]
+        version = self.cds.route_registry.version
+        return self.payloads.get(name, version,
+                                 lambda: prepare_payload(getattr(self, method)(), version, **dumps_kwargs))
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec, maxsize=4096)
+    @generation_cache(maxsize=4096)
     def get_bus_info(self, query, lat, lon, full_info, hide_text=True):
         user_loc = None
         if lat and lon:
@@ -95,7 +115,7 @@ class WebDataProcessor(BaseDataProcessor):
                            x[1]._asdict() if x[1] and not is_fraud else {}) for x
                           in result[1]]}
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec, maxsize=4096)
+    @generation_cache(maxsize=1024)
     def get_email_complain(self, query):
         routes_info = parse_routes(" pro \ " + query, )
         result = self.cds.bus_request(routes_info)
@@ -124,6 +144,7 @@ class WebDataProcessor(BaseDataProcessor):
 
         return email_complains
 
+    @generation_cache(maxsize=4096)
     def get_arrival(self, query, lat, lon):
         matches = self.cds.matches_bus_stops(lat, lon)
         self.logger.info(f'{lat};{lon} {";".join([str(i) for i in matches])}')
@@ -134,7 +155,7 @@ class WebDataProcessor(BaseDataProcessor):
                     'bus_stops': {v.bus_stop_name: v.text for v in result_tuple.arrival_details}}
         return response
 
-    @cachetools.func.ttl_cache(ttl=ttl_sec)
+    @generation_cache(maxsize=1024)
     def get_arrival_by_name(self, query, station_query):
         result_tuple = self.cds.next_bus(station_query, parse_routes(query))
         if result_tuple.found:
@@ -156,6 +177,7 @@ class WebDataProcessor(BaseDataProcessor):
         next_bus_text = '\n'.join([text_for_bus_stop(v) for v in arrival_info.arrival_details])
         return f'{arrival_info.header}\n{next_bus_text}'
 
+    @generation_cache(maxsize=1024)
     def get_arrival_by_id(self, query, busstop_id):
         bus_stop = self.cds.get_bus_stop_from_id(busstop_id)
         if bus_stop:
@@ -170,11 +192,15 @@ class WebDataProcessor(BaseDataProcessor):
         response = {'result': self.cds.codd_buses}
         return response
 
-    @cachetools.func.ttl_cache(ttl=36000)
     def get_bus_stops(self):
         response = {'result': [x._asdict() for x in self.cds.all_bus_stops]}
         return response
 
+    @cachetools.func.ttl_cache(ttl=36000, maxsize=4096)
+    def get_bus_stop_suggest(self, query):
+        response = {'q': query, 'result': [x._asdict() for x in self.cds.suggest_bus_stops(query)]}
+        return response
+
     @cachetools.func.ttl_cache(ttl=36000)
     def get_fotobus_url(self, name):
         links = fb_links(name)
@@ -182,6 +208,9 @@ class WebDataProcessor(BaseDataProcessor):
 
     @cachetools.func.ttl_cache(ttl=15)
     def get_route_edges(self):
+        return self.load_route_edges()
+
+    def load_route_edges(self) -> List[dict]:
         with session_scope(f'Return all RouteEdges') as session:
             edges: List[RouteEdges] = session.query(RouteEdges).all()
             return [{"edge_key":  json.loads(x.edge_key),
@@ -195,14 +224,21 @@ class WebDataProcessor(BaseDataProcessor):
                 session.add(edge)
             edge.points = points
             session.commit()
+        self.update_route_edges()
+
+    def update_route_edges(self):
+        try:
+            edges = self.load_route_edges()
+        except Exception as ex:
+            self.logger.error(f'Cannot load route edges for map matching: {ex}')
+            return
+        self.cds.set_route_edges(parse_route_edges(edges))
 
-    @cachetools.func.ttl_cache(ttl=36000)
     def get_bus_stops_for_routes(self):
         response = {route_name: [x._asdict() for x in bus_stops] for (route_name, bus_stops) in
                                self.cds.bus_routes.items()}
         return response
 
-    @cachetools.func.ttl_cache(ttl=36000)
     def get_bus_stops_for_routes_for_apps(self):
         response = self.cds.bus_routes
         return response
@@ -213,6 +249,13 @@ class WebDataProcessor(BaseDataProcessor):
         bus_stats = self.cds.get_bus_statistics()
         return str(datetime.datetime.now()) + '\n\n' + user_stats + '\n\n' + bus_stats.text
 
+    @generation_cache(maxsize=64)
+    def get_stats_history(self, resolution='raw', hours=None):
+        since = self.cds.now() - datetime.timedelta(hours=hours) if hours else None
+        return {'resolution': resolution,
+                'result': [x.as_dict() for x in self.cds.health.query(resolution, since)],
+                'jobs': self.cds.scheduler.stats() if self.cds.scheduler else {}}
+
     @cachetools.func.ttl_cache(ttl=36000)
     def get_new_routes(self):
         response = {'result': self.cds.codd_new_buses}
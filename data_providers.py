@@ -1,21 +1,33 @@
 import json
 import logging
 import os
-import pathlib
+import queue
 import random
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Type, Callable, Tuple
 
 import fdb
-from firebird.driver import connect, driver_config, transaction, Cursor
+from firebird.driver import connect, driver_config, transaction, Cursor, Statement
 
 import firebird.driver
 
 from data_types import CdsRouteBus, CdsBaseDataProvider, CoddBus, LongBusRouteStop, BusStop
+from fetcher import FetcherProcess, CDS_FETCHER_PROCESS
+from shared_fleet import SharedFleetFile
+from row_decoding import RowDecoder, decode_cursor, parse_iso_time, TEST_DATA_COLUMNS
+from static_cache import StaticCache
 
 LOAD_TEST_DATA = False
+CDS_DELTA_FETCH = os.environ.get('CDS_DELTA_FETCH', '1') == '1'
+CDS_DELTA_OVERLAP = int(os.environ.get('CDS_DELTA_OVERLAP', 120))
+CDS_FULL_RESYNC_INTERVAL = int(os.environ.get('CDS_FULL_RESYNC_INTERVAL', 600))
+CDS_POOL_SIZE = int(os.environ.get('CDS_POOL_SIZE', 2))
+STATIC_REFRESH_INTERVAL = int(os.environ.get('STATIC_REFRESH_INTERVAL', 600))
+LEADER_WAIT_TIMEOUT = int(os.environ.get('LEADER_WAIT_TIMEOUT', 300))
 
 logger = logging.getLogger(__name__)
 
@@ -47,133 +59,224 @@ except ImportError:
 
 driver_config.server_defaults.host.value = CDS_HOST
 
+OBJECTS_QUERY = '''SELECT bs.NAME_ AS BUS_STATION_, rt.NAME_ AS ROUTE_NAME_,  o.NAME_, o.OBJ_ID_, o.LAST_TIME_,
+                    o.LAST_LON_, o.LAST_LAT_, o.LAST_SPEED_, o.LAST_STATION_TIME_, o.PROJ_ID_,
+                     coalesce(o.lowfloor, 0) as low_floor, coalesce(o.VEHICLE_TYPE_, 0) as bus_type,
+                      coalesce(obj_output_, 0) as obj_output,
+                      coalesce(azmth_, 0) as azimuth,
+                      coalesce(o."BortName", '') as bort_name
+                    FROM OBJECTS O LEFT JOIN BUS_STATIONS bs
+                    ON o.LAST_ROUT_ = bs.ROUT_ AND o.LAST_STATION_ = bs.NUMBER_
+                    LEFT JOIN ROUTS rt ON o.LAST_ROUT_ = rt.ID_'''
+OBJECTS_DELTA_QUERY = OBJECTS_QUERY + ' WHERE o.LAST_TIME_ > ?'
+DB_NOW_QUERY = 'SELECT CAST(CURRENT_TIMESTAMP AS TIMESTAMP) FROM RDB$DATABASE'
+OBL_OBJECTS_QUERY = '''SELECT bs.NAME AS BUS_STATION_, rt.NAME_ AS ROUTE_NAME_,  o.block_number as OBJ_ID_,  
+                        CAST(o.block_number as VARCHAR(10)) as NAME_, o.LAST_TIME as LAST_TIME_,
+                        o.LON as LAST_LON_, o.LAT as LAST_LAT_, 0 as LAST_SPEED_, NULL as LAST_STATION_TIME_, NULL as PROJ_ID_,
+                         0 as low_floor,
+                            0 as bus_type,
+                          0 as obj_output,
+                          coalesce(o.azimuth, 0) as azimuth,
+                          coalesce(o."BortName", '') as bort_name
+                        FROM OBL_OBJECTS O LEFT JOIN BS
+                        ON o.bs_id = bs.ID
+                        LEFT JOIN ROUTS rt ON o.route_id = rt.ID_'''
 
-def fetch_cursor_map(cur: Cursor):
-    cursor_mapping = [x[0] for x in cur.description]
-    all_rows = cur.fetchall()
+BUS_INTERNED = ('route_name_', 'bus_station_', 'bort_name')
 
-    return [{k: v for k, v in zip(cursor_mapping, row)} for row in all_rows]
+DB_ERRORS = (AssertionError, firebird.driver.types.DatabaseError, firebird.driver.DatabaseError)
 
 
-def dump_data(data, resource):
-    fname = pathlib.Path(f'dumps/{resource}.json')
-    dump_info = json.dumps(data, default=str)
-    file_content = dump_info.encode('utf-8')
-    with open(fname, 'wb+') as f:
-        f.write(file_content)
-    logger.info(f'new_dump_file {fname}')
+def merge_sources(objects: List[CdsRouteBus], obl_objects: List[CdsRouteBus]) -> List[CdsRouteBus]:
+    """OBJECTS rows with the OBL_OBJECTS rows of other vehicles. OBL rows have no PROJ_ID_,
+    so an OBL row with the OBJ_ID_ of an OBJECTS row is a duplicate"""
+    obj_ids = {x.obj_id_ for x in objects}
+    return objects + [x for x in obl_objects if x.obj_id_ not in obj_ids]
 
 
-def load_data(resource):
-    fname = pathlib.Path(f'dumps/{resource}.json')
-    if not fname.exists():
-        return None
-    mtime = datetime.fromtimestamp(fname.stat().st_mtime)
-    mdelta = (datetime.now()-mtime).seconds
-    if mdelta > 600:
-        return None
-    with open(fname, 'rb') as f:
-        return json.load(f)
+class DeltaObjects:
+    """Objects kept between delta fetches, merged by vehicle key. The watermark never passes the database time
+    of the query, so a tracker with a clock in the future cannot hide the updates of other vehicles"""
 
+    def __init__(self):
+        self.objects: Dict[Tuple[int, int], CdsRouteBus] = {}
+        self.watermark: Optional[datetime] = None
+        self.last_full_sync = 0.0
 
-class CdsDBDataProvider(CdsBaseDataProvider):
-    CACHE_TIMEOUT = 30
+    def is_full_sync(self) -> bool:
+        return not CDS_DELTA_FETCH or self.watermark is None or \
+               time.time() - self.last_full_sync > CDS_FULL_RESYNC_INTERVAL
 
-    def __init__(self, logger):
-        self.logger = logger
-        self.cds_db_project = connect(database=CDS_DB_PROJECTS_PATH, user=CDS_USER,
-                                          password=CDS_PASS, charset='WIN1251')
-        self.cds_db_data = connect(database=CDS_DB_DATA_PATH, user=CDS_USER,
-                                       password=CDS_PASS, charset='WIN1251')
-        self.cds_db_project.default_tpb = fdb.ISOLATION_LEVEL_READ_COMMITED_RO
-        self.cds_db_data.default_tpb = fdb.ISOLATION_LEVEL_READ_COMMITED_RO
-        self.load_obl_objects = False
+    def since(self) -> datetime:
+        return self.watermark - timedelta(seconds=CDS_DELTA_OVERLAP)
+
+    def merge(self, rows: List[CdsRouteBus], full_sync: bool, query_now: datetime) -> List[CdsRouteBus]:
+        if full_sync:
+            self.objects = {}
+            self.last_full_sync = time.time()
+        self.objects.update((x.get_obj_key(), x) for x in rows)
+        last_times = [x.last_time_ for x in rows if x.last_time_]
+        if last_times:
+            self.watermark = min(max(last_times + ([self.watermark] if self.watermark else [])), query_now)
+        return list(self.objects.values())
 
-    def try_reconnect(self):
-        try:
-            self.cds_db_project.close()
-            self.cds_db_project = connect(database=CDS_DB_PROJECTS_PATH, user=CDS_USER,
-                                              password=CDS_PASS, charset='WIN1251')
-            self.cds_db_project.default_tpb = fdb.ISOLATION_LEVEL_READ_COMMITED_RO
-            self.logger.info(f"Success connect to {CDS_HOST} {CDS_DB_PROJECTS_PATH}")
-        except Exception as general_error:
-            self.logger.error(general_error)
 
+class PooledConnection:
+    """Connection with the statements prepared on it"""
+
+    def __init__(self, database):
+        self.database = database
+        self.connection = connect(database=database, user=CDS_USER, password=CDS_PASS, charset='WIN1251')
+        self.connection.default_tpb = fdb.ISOLATION_LEVEL_READ_COMMITED_RO
+        self.statements: Dict[str, Statement] = {}
+
+    def transaction_manager(self):
+        return self.connection.transaction_manager()
+
+    def prepare(self, cur: Cursor, sql: str) -> Statement:
+        statement = self.statements.get(sql)
+        if statement is None:
+            statement = self.statements[sql] = cur.prepare(sql)
+        return statement
+
+    def close(self):
+        self.statements = {}
         try:
-            self.cds_db_data.close()
-            self.cds_db_data = connect(database=CDS_DB_DATA_PATH, user=CDS_USER,
-                                           password=CDS_PASS, charset='WIN1251')
-            self.cds_db_data.default_tpb = fdb.ISOLATION_LEVEL_READ_COMMITED_RO
-            self.logger.info(f"Success connect to {CDS_HOST} {CDS_DB_DATA_PATH}")
+            self.connection.close()
         except Exception as general_error:
-            self.logger.error(general_error)
-
-    def now(self) -> datetime:
-        return datetime.now()
+            logger.error(general_error)
 
-    def load_codd_route_names(self) -> Dict:
-        def unpack_data(r):
-            r = [CoddBus(**x) for x in r]
-            return {x.NAME_: x for x in r}
 
-        self.logger.debug('Execute fetch routes from DB')
-        start = time.time()
+class ConnectionPool:
+    """Small pool of connections to one database. A connection failing a query is dropped and reopened on demand,
+    a lazy pool opens its first connection on demand too"""
 
-        cached_result = load_data('codd_route')
-        if cached_result:
-            self.logger.info(f"Finish proccess. Elapsed: {time.time() - start:.2f}")
-            return unpack_data(cached_result)
+    def __init__(self, database, size=CDS_POOL_SIZE, lazy=False):
+        self.database = database
+        self.connections = queue.LifoQueue()
+        for _ in range(size - 1):
+            self.connections.put(None)
+        self.connections.put(None if lazy else PooledConnection(database))
 
+    @contextmanager
+    def connection(self) -> PooledConnection:
+        pooled = self.connections.get()
         try:
-            with transaction(self.cds_db_project.transaction_manager()) as tr:
-                cur = tr.cursor()
-                cur.execute('''select ID_, NAME_, ROUTE_ACTIVE_ from ROUTS
-                                order by NAME_''')
-                self.logger.debug('Finish execution')
-                result = fetch_cursor_map(cur)
-                # tr.commit()
-                # cur.close()
-                self.logger.info(f"Finish fetch data. Elapsed: {time.time() - start:.2f}")
-        except firebird.driver.DatabaseError as db_error:
-            self.logger.error(db_error)
-            self.try_reconnect()
-            return {}
+            if pooled is None:
+                pooled = PooledConnection(self.database)
+                logger.info(f"Success connect to {CDS_HOST} {self.database}")
+            yield pooled
+        except DB_ERRORS:
+            if pooled:
+                pooled.close()
+                pooled = None
+            raise
+        finally:
+            self.connections.put(pooled)
 
-        dump_data(result, 'codd_route')
-        self.logger.info(f"Finish proccess. Elapsed: {time.time() - start:.2f}")
-        return unpack_data(result)
 
-    def load_new_codd_route_names(self):
-        def unpack_data(r):
-            r = [CoddBus(**x) for x in r]
-            return {x.NAME_: x.ID_ for x in r}
-        self.logger.debug('Execute fetch routes from DB')
+class CdsDBDataProvider(CdsBaseDataProvider):
+    CACHE_TIMEOUT = 30
+
+    def __init__(self, logger, fetcher_process=CDS_FETCHER_PROCESS, static_only=False,
+                 static_cache: StaticCache = None):
+        self.logger = logger
+        self.fetcher = FetcherProcess(logger) if fetcher_process and not static_only else None
+        # When the fleet queries run elsewhere, this process only loads static data and connects on demand
+        lazy = fetcher_process or static_only
+        self.cds_db_project = ConnectionPool(CDS_DB_PROJECTS_PATH, lazy=lazy)
+        self.cds_db_data = None if lazy else ConnectionPool(CDS_DB_DATA_PATH)
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cds_fetch')
+        self.static_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cds_static')
+        self.static_cache = static_cache or StaticCache()
+        self.static_refreshed: Dict[str, float] = {}
+        self.load_obl_objects = False
+        self.delta = DeltaObjects()
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def load_static(self, resource: str, record_type: Type, fetch: Callable[[], List]) -> List:
+        """Static records from the binary cache, refreshed in the background. Fetched synchronously if not cached"""
+        records = self.static_cache.get(resource, record_type)
+        if records is None:
+            return self.fetch_static(resource, fetch)
+        if time.time() - self.static_refreshed.get(resource, 0) > STATIC_REFRESH_INTERVAL:
+            self.static_refreshed[resource] = time.time()
+            self.static_executor.submit(self.fetch_static, resource, fetch)
+        return records
+
+    def fetch_static(self, resource: str, fetch: Callable[[], List]) -> List:
         start = time.time()
-        cached_result = load_data('new_codd_route')
-        if cached_result:
-            self.logger.info(f"Finish proccess. Elapsed: {time.time() - start:.2f}")
-            return unpack_data(cached_result)
         try:
-            with transaction(self.cds_db_project.transaction_manager()) as tr:
-                cur = tr.cursor()
-                cur.execute('''select "Id" as ID_, "Name" as  NAME_ from "NewRoute"
-                                where "NewRouteStatusID" <> 3
-                                order by NAME_''')
-                self.logger.debug('Finish execution')
-                result = fetch_cursor_map(cur)
-                self.logger.info(f"Finish fetch data. Elapsed: {time.time() - start:.2f}")
-        except firebird.driver.DatabaseError as db_error:
+            records = fetch()
+        except DB_ERRORS as db_error:
             self.logger.error(db_error)
-            self.try_reconnect()
-            return {}
+            return []
+        self.static_refreshed[resource] = time.time()
+        try:
+            self.static_cache.put(resource, records)
+        except OSError as os_error:
+            self.logger.error(os_error)
+        self.logger.info(f"Finish fetch {resource}: {len(records)} rows. Elapsed: {time.time() - start:.2f}")
+        return records
+
+    def fetch_codd_route_names(self) -> List[CoddBus]:
+        with self.cds_db_project.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute('''select ID_, NAME_, ROUTE_ACTIVE_ from ROUTS
+                            order by NAME_''')
+            return decode_cursor(cur, CoddBus, interned=('NAME_',))
+
+    def fetch_new_codd_route_names(self) -> List[CoddBus]:
+        with self.cds_db_project.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute('''select "Id" as ID_, "Name" as  NAME_ from "NewRoute"
+                            where "NewRouteStatusID" <> 3
+                            order by NAME_''')
+            return decode_cursor(cur, CoddBus, interned=('NAME_',))
+
+    def fetch_bus_stations_routes(self) -> List[LongBusRouteStop]:
+        with self.cds_db_project.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute('''select bsr.NUM as NUMBER_, bs.NAME as NAME_, bs.LAT as LAT_, 
+                            bs.LON as LON_, bsr.ROUTE_ID as ROUT_, 0 as CONTROL_, bsr.BS_ID as ID
+                            from ROUTS r
+                            join BS_ROUTE bsr on bsr.ROUTE_ID = r.ID_
+                            left join BS on bsr.BS_ID = bs.ID''')
+            return decode_cursor(cur, LongBusRouteStop, interned=('NAME_',))
+
+    def fetch_new_bus_stations_routes(self) -> List[LongBusRouteStop]:
+        with self.cds_db_project.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute('''select bsr."Num" as NUMBER_, nbs."Name" as NAME_, nbs."Latitude" as LAT_,
+                                nbs."Longitude" as LON_,
+                                bsr."RouteId" as ROUT_, 0 as CONTROL_,
+                                bsr."BusStationId" as ID
+                                from  "NewRoute" r
+                                join "NewBusStationRoute" bsr on bsr."RouteId" = r."Id"
+                                left join "NewBusStation" nbs on bsr."BusStationId" = nbs."Id"
+                                ''')
+            return decode_cursor(cur, LongBusRouteStop, interned=('NAME_',))
+
+    def fetch_bus_stops(self) -> List[BusStop]:
+        with self.cds_db_project.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute('''select distinct  ID, NAME as NAME_, LAT as LAT_, LON as LON_, AZMTH
+                        from bs
+                        order by NAME_''')
+            return decode_cursor(cur, BusStop, interned=('NAME_',))
 
-        dump_data(result, 'new_codd_route')
-        self.logger.info(f"Finish proccess. Elapsed: {time.time() - start:.2f}")
-        return unpack_data(result)
+    def load_codd_route_names(self) -> Dict:
+        routes = self.load_static('codd_route', CoddBus, self.fetch_codd_route_names)
+        return {x.NAME_: x for x in routes}
+
+    def load_new_codd_route_names(self):
+        routes = self.load_static('new_codd_route', CoddBus, self.fetch_new_codd_route_names)
+        return {x.NAME_: x.ID_ for x in routes}
 
-    def convert_to_stations_dict(self, bus_routes, bus_stops_data):
+    def convert_to_stations_dict(self, bus_routes, long_bus_stops: List[LongBusRouteStop]):
         bus_routes_ids = {v: k for k, v in bus_routes.items()}
-        long_bus_stops = [LongBusRouteStop(**x) for x in bus_stops_data]
         bus_stations = {}
 
         for stop in long_bus_stops:
@@ -188,137 +291,79 @@ class CdsDBDataProvider(CdsBaseDataProvider):
         return bus_stations
 
     def load_bus_stations_routes(self) -> Dict:
-        def unpack_data(r):
-            routes_dict = {k: v.ID_ for k, v in self.load_codd_route_names().items()}
-            return self.convert_to_stations_dict(routes_dict, r)
-        start = time.time()
-
-        cached_result = load_data('bus_stations_routes')
-        if cached_result:
-            self.logger.info(f"Finish proccess. Elapsed: {time.time() - start:.2f}")
-            return unpack_data(cached_result)
-        try:
-            with transaction(self.cds_db_project.transaction_manager()) as tr:
-                cur = tr.cursor()
-                cur.execute('''select bsr.NUM as NUMBER_, bs.NAME as NAME_, bs.LAT as LAT_, 
-                                bs.LON as LON_, bsr.ROUTE_ID as ROUT_, 0 as CONTROL_, bsr.BS_ID as ID
-                                from ROUTS r
-                                join BS_ROUTE bsr on bsr.ROUTE_ID = r.ID_
-                                left join BS on bsr.BS_ID = bs.ID''')
-                bus_stops_data = fetch_cursor_map(cur)
-                self.logger.info(f"Finish fetch data. Elapsed: {time.time() - start:.2f}")
-        except firebird.driver.DatabaseError as db_error:
-            self.logger.error(db_error)
-            self.try_reconnect()
+        bus_stops_data = self.load_static('bus_stations_routes', LongBusRouteStop, self.fetch_bus_stations_routes)
+        if not bus_stops_data:
             return {}
-
-        dump_data(bus_stops_data, 'bus_stations_routes')
-        self.logger.info(f"Finish proccess. Elapsed: {time.time() - start:.2f}")
-        return unpack_data(bus_stops_data)
+        routes_dict = {k: v.ID_ for k, v in self.load_codd_route_names().items()}
+        return self.convert_to_stations_dict(routes_dict, bus_stops_data)
 
     def load_new_bus_stations_routes(self) -> Dict:
-        start = time.time()
-        try:
-            with transaction(self.cds_db_project.transaction_manager()) as tr:
-                cur = tr.cursor()
-                cur.execute('''select bsr."Num" as NUMBER_, nbs."Name" as NAME_, nbs."Latitude" as LAT_,
-                                    nbs."Longitude" as LON_,
-                                    bsr."RouteId" as ROUT_, 0 as CONTROL_,
-                                    bsr."BusStationId" as ID
-                                    from  "NewRoute" r
-                                    join "NewBusStationRoute" bsr on bsr."RouteId" = r."Id"
-                                    left join "NewBusStation" nbs on bsr."BusStationId" = nbs."Id"
-                                    ''')
-                bus_stops_data = fetch_cursor_map(cur)
-                end = time.time()
-                self.logger.info(f"Finish fetch data. Elapsed: {end - start:.2f}")
-        except firebird.driver.DatabaseError as db_error:
-            self.logger.error(db_error)
-            self.try_reconnect()
+        bus_stops_data = self.load_static('new_bus_stations_routes', LongBusRouteStop,
+                                          self.fetch_new_bus_stations_routes)
+        if not bus_stops_data:
             return {}
+        return self.convert_to_stations_dict(self.load_new_codd_route_names(), bus_stops_data)
 
-        result = self.convert_to_stations_dict(self.load_new_codd_route_names(), bus_stops_data)
-        return result
-
-    def load_all_cds_buses(self) -> List[CdsRouteBus]:
-        def make_names_lower(x):
-            return {k.lower(): v for (k, v) in x.items()}
-
+    def load_all_cds_buses(self) -> Optional[List[CdsRouteBus]]:
+        if self.fetcher:
+            return self.fetcher.fetch()
         self.logger.debug('Execute fetch all from DB')
         start = time.time()
+        sources = [self.executor.submit(self.fetch_objects)]
+        if self.load_obl_objects:
+            sources.append(self.executor.submit(self.fetch_obl_objects))
 
         try:
-            with transaction(self.cds_db_project.transaction_manager()) as tr:
-                cur = tr.cursor()
-                cur.execute('''SELECT bs.NAME_ AS BUS_STATION_, rt.NAME_ AS ROUTE_NAME_,  o.NAME_, o.OBJ_ID_, o.LAST_TIME_,
-                    o.LAST_LON_, o.LAST_LAT_, o.LAST_SPEED_, o.LAST_STATION_TIME_, o.PROJ_ID_,
-                     coalesce(o.lowfloor, 0) as low_floor, coalesce(o.VEHICLE_TYPE_, 0) as bus_type,
-                      coalesce(obj_output_, 0) as obj_output,
-                      coalesce(azmth_, 0) as azimuth,
-                      coalesce(o."BortName", '') as bort_name
-                    FROM OBJECTS O LEFT JOIN BUS_STATIONS bs
-                    ON o.LAST_ROUT_ = bs.ROUT_ AND o.LAST_STATION_ = bs.NUMBER_
-                    LEFT JOIN ROUTS rt ON o.LAST_ROUT_ = rt.ID_''')
-                self.logger.debug('Finish execution')
-                result = fetch_cursor_map(cur)
-                end = time.time()
-                self.logger.info(f"Finish fetch data. Elapsed: {end - start:.2f}")
-        except (AssertionError, firebird.driver.types.DatabaseError, firebird.driver.DatabaseError) as db_error:
+            result = sources[0].result()
+        except DB_ERRORS as db_error:
             self.logger.error(db_error)
-            self.try_reconnect()
-            return []
+            self.delta.watermark = None
+            return None
 
         obl_result = []
         try:
-            if self.load_obl_objects:
-                with transaction(self.cds_db_data.transaction_manager())as tr:
-                    cur = tr.cursor()
-                    cur.execute('''SELECT bs.NAME AS BUS_STATION_, rt.NAME_ AS ROUTE_NAME_,  o.block_number as OBJ_ID_,  
-                        CAST(o.block_number as VARCHAR(10)) as NAME_, o.LAST_TIME as LAST_TIME_,
-                        o.LON as LAST_LON_, o.LAT as LAST_LAT_, 0 as LAST_SPEED_, NULL as LAST_STATION_TIME_, NULL as PROJ_ID_,
-                         0 as low_floor,
-                            0 as bus_type,
-                          0 as obj_output,
-                          coalesce(o.azimuth, 0) as azimuth,
-                          coalesce(o."BortName", '') as bort_name
-                        FROM OBL_OBJECTS O LEFT JOIN BS
-                        ON o.bs_id = bs.ID
-                        LEFT JOIN ROUTS rt ON o.route_id = rt.ID_''')
-                    self.logger.debug('Finish execution')
-                    obl_result = fetch_cursor_map(cur)
-                    end = time.time()
-                    self.logger.info(f"Finish fetch data. Elapsed: {end - start:.2f}")
-        except firebird.driver.DatabaseError as db_error:
-            if self.load_obl_objects:
-                self.load_obl_objects = False
-                self.logger.error(db_error)
-                self.try_reconnect()
-
-        result = [CdsRouteBus(**make_names_lower(x)) for x in result + obl_result]
+            if len(sources) > 1:
+                obl_result = sources[1].result()
+        except DB_ERRORS as db_error:
+            self.load_obl_objects = False
+            self.logger.error(db_error)
+
+        result = merge_sources(result, obl_result)
         result.sort(key=lambda s: s.last_time_, reverse=True)
         end = time.time()
         self.logger.info(f"Finish proccess. Elapsed: {end - start:.2f}")
         return result
 
-    def load_bus_stops(self) -> List[BusStop]:
-        self.logger.debug('Execute load_bus_stops from DB')
+    def fetch_objects(self) -> List[CdsRouteBus]:
         start = time.time()
-        try:
-            with transaction(self.cds_db_project.transaction_manager()) as tr:
-                cur = tr.cursor()
-                cur.execute('''select distinct  ID, NAME as NAME_, LAT as LAT_, LON as LON_, AZMTH
-                            from bs
-                            order by NAME_''')
-                self.logger.debug('Finish execution')
-                result = fetch_cursor_map(cur)
-                end = time.time()
-                self.logger.info(f"Finish fetch data. Elapsed: {end - start:.2f}")
-        except firebird.driver.DatabaseError as db_error:
-            self.logger.error(db_error)
-            self.try_reconnect()
-            return []
+        full_sync = self.delta.is_full_sync()
+        with self.cds_db_project.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute(db.prepare(cur, DB_NOW_QUERY))
+            (query_now,) = cur.fetchone()
+            if full_sync:
+                cur.execute(db.prepare(cur, OBJECTS_QUERY))
+            else:
+                cur.execute(db.prepare(cur, OBJECTS_DELTA_QUERY), (self.delta.since(),))
+            self.logger.debug('Finish execution')
+            rows = decode_cursor(cur, CdsRouteBus, interned=BUS_INTERNED)
+            result = self.delta.merge(rows, full_sync, query_now)
+        self.logger.debug(f"{'Full' if full_sync else 'Delta'} fetch: {len(rows)} rows, {len(result)} objects")
+        self.logger.info(f"Finish fetch data. Elapsed: {time.time() - start:.2f}")
+        return result
+
+    def fetch_obl_objects(self) -> List[CdsRouteBus]:
+        start = time.time()
+        with self.cds_db_data.connection() as db, transaction(db.transaction_manager()) as tr:
+            cur = tr.cursor()
+            cur.execute(db.prepare(cur, OBL_OBJECTS_QUERY))
+            self.logger.debug('Finish execution')
+            result = decode_cursor(cur, CdsRouteBus, interned=BUS_INTERNED)
+        self.logger.info(f"Finish fetch OBL data. Elapsed: {time.time() - start:.2f}")
+        return result
 
-        return [BusStop(**x) for x in result]
+    def load_bus_stops(self) -> List[BusStop]:
+        return self.load_static('bus_stops', BusStop, self.fetch_bus_stops)
 
 
 class CdsTestDataProvider(CdsBaseDataProvider):
@@ -329,6 +374,8 @@ class CdsTestDataProvider(CdsBaseDataProvider):
         self.test_data_files = []
         self.test_data_index = 0
         self.mocked_now = datetime.now()
+        self.decoder = RowDecoder(CdsRouteBus, TEST_DATA_COLUMNS,
+                                  {'last_time_': parse_iso_time, 'last_station_time_': parse_iso_time}, BUS_INTERNED)
         self.load_test_data()
 
     def load_test_data(self):
@@ -358,7 +405,7 @@ class CdsTestDataProvider(CdsBaseDataProvider):
         path = self.test_data_files[self.test_data_index]
         self.mocked_now = datetime.strptime(path.name, "codd_data_db%y_%m_%d_%H_%M_%S.json")
         with open(path, 'rb') as f:
-            long_bus_stops = [CdsRouteBus.make(*i) for i in json.load(f)]
+            long_bus_stops = self.decoder.decode(json.load(f))
         self.test_data_index += 1
         self.logger.info(f'Loaded {path.name}; {self.mocked_now:%H:%M:%S}')
         return long_bus_stops
@@ -401,6 +448,77 @@ class StubDataProvider(CdsBaseDataProvider):
     def load_bus_stops(self) -> List[BusStop]:
         return []
 
+
+class CachedStaticDataProvider(CdsDBDataProvider):
+    """Static data from the binary cache kept up to date by the leader process, never connects to the DB.
+    The cache may still be empty when the worker starts, has_static_update tells when the leader filled it"""
+
+    def __init__(self, logger, static_cache: StaticCache = None):
+        super().__init__(logger, static_only=True, static_cache=static_cache)
+        self.static_modified = self.static_cache.mtime
+
+    def load_static(self, resource: str, record_type: Type, fetch: Callable[[], List]) -> List:
+        return self.static_cache.get(resource, record_type) or []
+
+    def has_static_update(self) -> bool:
+        modified = self.static_cache.modified()
+        if modified == self.static_modified:
+            return False
+        self.static_modified = modified
+        return True
+
+    def load_all_cds_buses(self) -> List[CdsRouteBus]:
+        return []
+
+
+class SharedFleetDataProvider(CdsBaseDataProvider):
+    """Worker process view: the fleet published by the leader, static data from the given provider"""
+
+    def __init__(self, logger, static_provider: CdsBaseDataProvider, fleet_file: SharedFleetFile):
+        self.logger = logger
+        self.static_provider = static_provider
+        self.fleet_file = fleet_file
+        self.started = time.time()
+        self.wait_logged = False
+
+    def now(self) -> datetime:
+        if not self.fleet_file.now:
+            return self.static_provider.now()
+        return self.fleet_file.now + timedelta(seconds=time.time() - self.fleet_file.published)
+
+    def has_update(self) -> bool:
+        if self.fleet_file.changed():
+            return True
+        if not self.fleet_file.generation and not self.wait_logged and \
+                time.time() - self.started > LEADER_WAIT_TIMEOUT:
+            self.logger.error(f'No fleet from the leader after {LEADER_WAIT_TIMEOUT} s')
+            self.wait_logged = True
+        return False
+
+    def load_all_cds_buses(self) -> List[CdsRouteBus]:
+        buses = self.fleet_file.read()
+        self.logger.debug(f'Fleet generation {self.fleet_file.generation} from the leader: {len(buses)} rows')
+        return buses
+
+    def load_codd_route_names(self) -> Dict:
+        return self.static_provider.load_codd_route_names()
+
+    def load_new_codd_route_names(self):
+        return self.static_provider.load_new_codd_route_names()
+
+    def load_bus_stations_routes(self) -> Dict:
+        return self.static_provider.load_bus_stations_routes()
+
+    def load_new_bus_stations_routes(self):
+        return self.static_provider.load_new_bus_stations_routes()
+
+    def load_bus_stops(self) -> List[BusStop]:
+        return self.static_provider.load_bus_stops()
+
+    def has_static_update(self) -> bool:
+        return self.static_provider.has_static_update()
+
+
 def get_data_provider(logger):
     try:
         return CdsTestDataProvider(logger) if LOAD_TEST_DATA else CdsDBDataProvider(logger)
@@ -408,3 +526,8 @@ def get_data_provider(logger):
         logger.exception(ex)
         return StubDataProvider()
 
+
+def get_follower_data_provider(logger, fleet_file: SharedFleetFile):
+    static_provider = CdsTestDataProvider(logger) if LOAD_TEST_DATA else CachedStaticDataProvider(logger)
+    return SharedFleetDataProvider(logger, static_provider, fleet_file)
+
@@ -1,6 +1,6 @@
 import datetime
 from enum import Enum
-from typing import NamedTuple, List, Dict, Union
+from typing import NamedTuple, List, Dict, Optional, Union
 
 from helpers import distance_km, distance, get_iso_time, QUICK_FIX_DIST
 
@@ -136,11 +136,15 @@ class CdsRouteBus(NamedTuple):
         except Exception as e:
             print(e)
         return CdsRouteBus(last_lat_, last_lon_, last_speed_, last_time_, name_, obj_id_, proj_id_,
-                           route_name_, type_proj, last_station_time_, bus_station_, low_floor, bus_type, avg_speed, azimuth, bort_name)
+                           route_name_, type_proj, last_station_time_, bus_station_, low_floor, bus_type,
+                           avg_speed=avg_speed, azimuth=azimuth, bort_name=bort_name)
 
     def get_bus_position(self) -> CdsBusPosition:
         return CdsBusPosition(self.last_lat_, self.last_lon_, self.last_time_)
 
+    def get_obj_key(self):
+        return self.obj_id_, self.proj_id_
+
     def filter_by_name(self, filter_query: str) -> bool:
         bus_filter = filter_query.lower().split(' ')
         name = self.name_.lower()
@@ -197,7 +201,8 @@ class CdsBaseDataProvider:
     def now(self) -> datetime.datetime:
         pass
 
-    def load_all_cds_buses(self) -> List[CdsRouteBus]:
+    def load_all_cds_buses(self) -> Optional[List[CdsRouteBus]]:
+        """Current fleet, None when it cannot be loaded"""
         pass
 
     def load_codd_route_names(self) -> Dict:
@@ -215,6 +220,10 @@ class CdsBaseDataProvider:
     def load_new_bus_stations_routes(self):
         pass
 
+    def has_static_update(self) -> bool:
+        """True when the static data changed since the last call"""
+        return False
+
 
 class AbuseRule(NamedTuple):
     event: Enum
@@ -23,8 +23,6 @@
     var cb_show_info = document.getElementById('cb_show_info')
     var btn_station_search = document.getElementById('btn_station_search')
 
-    var bus_stop_list = []
-    var bus_stop_names = []
     var bus_stop_auto_complete
 
     if (lastbus)
@@ -313,8 +311,9 @@
             })
     }
 
-    function get_bus_stop_list() {
-        return fetch('/bus_stops',
+    function get_bus_stop_suggest(term, suggest) {
+        var params = 'q=' + encodeURIComponent(term)
+        return fetch('/bus_stop_suggest?' + params,
             {
                 method: 'GET',
                 headers: {
@@ -325,26 +324,21 @@
                 return res.json()
             })
             .then(function (data) {
-                update_cookies()
-                bus_stop_list = data.result
-                bus_stop_names = bus_stop_list.map(function callback(bus_stop) {
+                suggest(data.result.map(function callback(bus_stop) {
                     return bus_stop.NAME_
-                })
-                if (station_name) {
-                    bus_stop_auto_complete = new autoComplete({
-                        selector: station_name,
-                        source: function (term, suggest) {
-                            term = term.toLowerCase();
-                            var matches = [];
-                            for (var i = 0; i < bus_stop_names.length; i++)
-                                if (~bus_stop_names[i].toLowerCase().indexOf(term)) matches.push(bus_stop_names[i]);
-                            suggest(matches);
-                        }
-                    })
-                }
+                }))
             })
     }
 
+    function init_bus_stop_autocomplete() {
+        bus_stop_auto_complete = new autoComplete({
+            selector: station_name,
+            minChars: 3,
+            delay: 300,
+            source: get_bus_stop_suggest
+        })
+    }
+
     function update_cookies() {
         var user_ip = getCookie("user_ip")
         if (user_ip) {
@@ -422,7 +416,7 @@
             setCookie("user_ip", ls_user_ip, {expires: 3600 * 24 * 7})
         }
         if (station_name) {
-            get_bus_stop_list()
+            init_bus_stop_autocomplete()
         }
         get_bus_list()
 
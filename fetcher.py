@@ -0,0 +1,174 @@
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from data_types import CdsRouteBus
+
+CDS_FETCHER_PROCESS = os.environ.get('CDS_FETCHER_PROCESS', '0') == '1'
+CDS_FETCH_DEADLINE = int(os.environ.get('CDS_FETCH_DEADLINE', 45))
+
+MAGIC = b'VRNBUSFL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+BLOCK = struct.Struct('<I')
+INT_NONE = np.iinfo(np.int32).min
+
+COLUMN_KINDS = {'last_lat_': 'f', 'last_lon_': 'f', 'last_speed_': 'f', 'last_time_': 't', 'name_': 's',
+                'obj_id_': 'i', 'proj_id_': 'i', 'route_name_': 's', 'type_proj': 'i', 'last_station_time_': 't',
+                'bus_station_': 's', 'low_floor': 'i', 'bus_type': 'i', 'obj_output': 'i', 'avg_speed': 'f',
+                'avg_last_speed': 'f', 'azimuth': 'i', 'bort_name': 's'}
+INTERNED_COLUMNS = ('route_name_', 'bus_station_', 'bort_name')
+
+
+def encode_column(kind: str, values: Sequence) -> List[bytes]:
+    if kind == 'f':
+        return [np.array(values, dtype=np.float64).tobytes()]
+    if kind == 'i':
+        return [np.array([INT_NONE if x is None else x for x in values], dtype=np.int32).tobytes()]
+    if kind == 't':
+        return [np.array(values, dtype='datetime64[us]').view(np.int64).tobytes()]
+    table = {}
+    codes = np.array([-1 if x is None else table.setdefault(x, len(table)) for x in values], dtype=np.int32)
+    return ['\0'.join(table).encode('utf-8'), codes.tobytes()]
+
+
+def encode_buses(buses: Sequence[CdsRouteBus]) -> bytes:
+    """Columnar binary fleet: times as int64, numbers as int32/float64 arrays, strings as a table with int32 codes"""
+    fields = CdsRouteBus._fields
+    columns = list(zip(*buses)) if buses else [()] * len(fields)
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, len(fields), len(buses))]
+    for (field, values) in zip(fields, columns):
+        for block in encode_column(COLUMN_KINDS[field], values):
+            parts += [BLOCK.pack(len(block)), block]
+    return b''.join(parts)
+
+
+def decode_buses(data: bytes) -> List[CdsRouteBus]:
+    (magic, version, field_count, size) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or field_count != len(CdsRouteBus._fields):
+        raise ValueError(f'Unknown fleet format {magic!r} v{version} with {field_count} fields')
+    offset = HEADER.size
+
+    def block():
+        nonlocal offset
+        (length,) = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size + length
+        return data[offset - length:offset]
+
+    columns = []
+    for field in CdsRouteBus._fields:
+        kind = COLUMN_KINDS[field]
+        if kind == 'f':
+            values = np.frombuffer(block(), dtype=np.float64)
+            column = values.tolist()
+            if np.isnan(values).any():
+                column = [None if x != x else x for x in column]
+        elif kind == 'i':
+            values = np.frombuffer(block(), dtype=np.int32)
+            column = values.tolist()
+            if (values == INT_NONE).any():
+                column = [None if x == INT_NONE else x for x in column]
+        elif kind == 't':
+            column = np.frombuffer(block(), dtype='datetime64[us]').tolist()
+        else:
+            text = str(block(), 'utf-8')
+            codes = np.frombuffer(block(), dtype=np.int32)
+            table = text.split('\0') if codes.size and codes.max() >= 0 else []
+            if field in INTERNED_COLUMNS:
+                table = [sys.intern(x) for x in table]
+            table.append(None)
+            column = [table[i] for i in codes.tolist()]
+        columns.append(column)
+    new = tuple.__new__
+    return [new(CdsRouteBus, x) for x in zip(*columns)] if size else []
+
+
+def fetcher_main(conn):
+    """Fetcher process: owns the Firebird connections and answers each request with an encoded fleet,
+    or with an empty message when the fleet cannot be loaded"""
+    from data_providers import CdsDBDataProvider
+
+    logging.basicConfig(format='%(asctime)s.%(msecs)03d - %(levelname)s [%(filename)s:%(lineno)s %(funcName)10s] '
+                               'fetcher %(process)d: %(message)s',
+                        datefmt="%H:%M:%S",
+                        level=logging.INFO,
+                        handlers=[logging.StreamHandler()])
+    logger = logging.getLogger('vrnbus.fetcher')
+    try:
+        provider = CdsDBDataProvider(logger, fetcher_process=False)
+    except Exception:
+        logger.exception('Cannot connect to the database')
+        return
+    logger.info('Fetcher process started')
+    while True:
+        try:
+            conn.recv_bytes()
+        except EOFError:
+            return
+        try:
+            buses = provider.load_all_cds_buses()
+        except Exception:
+            logger.exception('Fetch failed')
+            buses = None
+        conn.send_bytes(b'' if buses is None else encode_buses(buses))
+
+
+class FetcherProcess:
+    """Runs fleet queries in a child process, a query without an answer before the deadline kills the child"""
+
+    def __init__(self, logger, deadline=CDS_FETCH_DEADLINE):
+        self.logger = logger
+        self.deadline = deadline
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+
+    def start(self):
+        (self.conn, child_conn) = self.context.Pipe()
+        self.process = self.context.Process(target=fetcher_main, args=(child_conn,), name='cds_fetcher', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.logger.info(f'Fetcher process {self.process.pid} started')
+
+    def kill(self):
+        self.logger.error(f'Kill fetcher process {self.process.pid}')
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+        self.process = None
+        self.restarts += 1
+
+    def fetch(self) -> Optional[List[CdsRouteBus]]:
+        with self.lock:
+            if self.process and not self.process.is_alive():
+                self.kill()
+            if not self.process:
+                self.start()
+            start = time.time()
+            try:
+                self.conn.send_bytes(b'fetch')
+                if not self.conn.poll(self.deadline):
+                    self.logger.error(f'No fleet from the fetcher process after {self.deadline} s')
+                    self.kill()
+                    return None
+                data = self.conn.recv_bytes()
+            except (EOFError, OSError) as error:
+                self.logger.error(f'Fetcher process is gone: {error!r}')
+                self.kill()
+                return None
+        if not data:
+            self.logger.error('The fetcher process could not load the fleet')
+            return None
+        buses = decode_buses(data)
+        self.logger.info(f'Fleet from the fetcher process: {len(buses)} rows, {len(data)} bytes. '
+                         f'Elapsed: {time.time() - start:.2f}')
+        return buses
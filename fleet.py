@@ -0,0 +1,217 @@
+import datetime
+import heapq
+from collections import deque, defaultdict
+from types import MappingProxyType
+from typing import List, Iterable, Tuple, Optional, Collection, Mapping, Dict, NamedTuple, Hashable
+
+import numpy as np
+
+from data_types import CdsRouteBus, ArrivalBusStopInfo
+from helpers import distances_km, natural_sort_key
+from map_matching import RouteMatch
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_seconds(value: Optional[datetime.datetime]) -> float:
+    if not value:
+        return np.nan
+    return (value - EPOCH).total_seconds()
+
+
+def encode_names(values: Iterable[str]) -> Tuple[List[str], np.ndarray]:
+    names = []
+    codes = {}
+    result = []
+    for value in values:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        result.append(code)
+    return names, np.array(result, dtype=np.int32)
+
+
+class FleetColumns:
+    """Columnar view of the fleet, rebuilt once per refresh"""
+
+    def __init__(self, buses: List[CdsRouteBus]):
+        size = len(buses)
+        self.buses = buses
+        self.lat = np.fromiter((x.last_lat_ or 0.0 for x in buses), dtype=np.float64, count=size)
+        self.lon = np.fromiter((x.last_lon_ or 0.0 for x in buses), dtype=np.float64, count=size)
+        self.speed = np.fromiter((x.last_speed_ or 0.0 for x in buses), dtype=np.float64, count=size)
+        self.avg_speed = np.fromiter((x.avg_speed for x in buses), dtype=np.float64, count=size)
+        self.last_time = np.fromiter((to_seconds(x.last_time_) for x in buses), dtype=np.float64, count=size)
+        self.last_station_time = np.fromiter((to_seconds(x.last_station_time_) for x in buses),
+                                             dtype=np.float64, count=size)
+        self.obj_id = np.fromiter((x.obj_id_ for x in buses), dtype=np.int64, count=size)
+        self.obj_output = np.fromiter((x.obj_output == 1 for x in buses), dtype=bool, count=size)
+        self.has_name = np.fromiter((bool(x.name_) for x in buses), dtype=bool, count=size)
+        self.route_names, self.route_id = encode_names(x.route_name_ for x in buses)
+        self.station_names, self.station_id = encode_names(x.bus_station_ for x in buses)
+        self.route_codes = {v: i for i, v in enumerate(self.route_names)}
+
+    def __len__(self):
+        return len(self.buses)
+
+    def select(self, mask: np.ndarray) -> List[CdsRouteBus]:
+        buses = self.buses
+        return [buses[i] for i in np.flatnonzero(mask)]
+
+    def all(self) -> np.ndarray:
+        return np.ones(len(self.buses), dtype=bool)
+
+    def routes_mask(self, route_names: Collection[str]) -> np.ndarray:
+        codes = [self.route_codes[x] for x in route_names if x in self.route_codes]
+        return np.isin(self.route_id, codes)
+
+    def time_mask(self, since: datetime.datetime, strict=False) -> np.ndarray:
+        if strict:
+            return self.last_time > to_seconds(since)
+        return self.last_time >= to_seconds(since)
+
+    def station_time_mask(self, since: datetime.datetime, allow_empty=False) -> np.ndarray:
+        result = self.last_station_time >= to_seconds(since)
+        if allow_empty:
+            result |= np.isnan(self.last_station_time)
+        return result
+
+    def distance_km(self, lat, lon) -> np.ndarray:
+        return distances_km(lat, lon, self.lat, self.lon)
+
+    def route_counts(self, mask: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+        return np.bincount(self.route_id[mask], weights=None if weights is None else weights[mask],
+                           minlength=len(self.route_names))
+
+
+class FleetStats:
+    """Sorted last-seen times, counts since any moment are binary searches instead of fleet scans"""
+
+    def __init__(self, columns: FleetColumns):
+        last_time = columns.last_time
+        self.last_seen = np.sort(last_time[~columns.obj_output & ~np.isnan(last_time)])
+        groups = defaultdict(list)
+        for (bus, value) in zip(columns.buses, last_time):
+            if not np.isnan(value):
+                groups[(bus.route_name_ or '', bus.proj_id_ or 0)].append(value)
+        self.route_groups = [(f'{route_name:5s} ({proj_id:3d})', np.sort(groups[(route_name, proj_id)]))
+                             for (route_name, proj_id) in sorted(groups, key=lambda x: (natural_sort_key(x[0]), x[1]))]
+
+    @staticmethod
+    def count_since(values: np.ndarray, since: datetime.datetime) -> int:
+        return len(values) - int(np.searchsorted(values, to_seconds(since), side='left'))
+
+    def active_since(self, since: datetime.datetime) -> int:
+        """Vehicles seen since the given moment, excluding the ones taken off the line"""
+        return self.count_since(self.last_seen, since)
+
+    def route_counts_since(self, since: datetime.datetime) -> List[Tuple[str, int]]:
+        result = ((label, self.count_since(values, since)) for (label, values) in self.route_groups)
+        return [x for x in result if x[1]]
+
+
+class RouteSpeedEntry(NamedTuple):
+    route_name: str
+    last_speed: float
+    avg_speed: float
+    since: float
+
+
+class RouteSpeedWindow:
+    """Running per-route speed sums over buses seen at a station within the window"""
+
+    def __init__(self, window=datetime.timedelta(minutes=15), smoothing=10):
+        self.window = window
+        self.entries: Dict[Hashable, RouteSpeedEntry] = {}
+        self.expiry: List[Tuple[float, Hashable]] = []
+        self.route_counts: Dict[str, int] = {}
+        self.route_speed_sums: Dict[str, float] = {}
+        self.speed_sum = 0.0
+        self.speed_deque = deque(maxlen=smoothing)
+        self.avg_speed = 18.0
+
+    def copy(self) -> 'RouteSpeedWindow':
+        result = RouteSpeedWindow.__new__(RouteSpeedWindow)
+        result.__dict__.update(self.__dict__)
+        result.entries, result.expiry = dict(self.entries), list(self.expiry)
+        result.route_counts, result.route_speed_sums = dict(self.route_counts), dict(self.route_speed_sums)
+        result.speed_deque = self.speed_deque.copy()
+        return result
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if not entry:
+            return
+        self.speed_sum -= entry.last_speed
+        count = self.route_counts[entry.route_name] - 1
+        if count:
+            self.route_counts[entry.route_name] = count
+            self.route_speed_sums[entry.route_name] -= entry.avg_speed
+        else:
+            del self.route_counts[entry.route_name]
+            del self.route_speed_sums[entry.route_name]
+        if not self.entries:
+            self.speed_sum = 0.0
+
+    @staticmethod
+    def get_since(bus: CdsRouteBus) -> float:
+        if not bus.last_time_ or not bus.last_station_time_:
+            return np.nan
+        return min(to_seconds(bus.last_time_), to_seconds(bus.last_station_time_))
+
+    def add(self, key, bus: CdsRouteBus):
+        since = self.get_since(bus)
+        entry = RouteSpeedEntry(bus.route_name_, bus.last_speed_ or 0.0, bus.avg_speed if bus.avg_speed > 1 else 0.0,
+                                since)
+        self.entries[key] = entry
+        self.speed_sum += entry.last_speed
+        self.route_counts[entry.route_name] = self.route_counts.get(entry.route_name, 0) + 1
+        self.route_speed_sums[entry.route_name] = self.route_speed_sums.get(entry.route_name, 0.0) + entry.avg_speed
+        heapq.heappush(self.expiry, (since, key))
+
+    def update(self, changed: Iterable[CdsRouteBus], removed_keys: Iterable[Hashable], now: datetime.datetime):
+        cutoff = to_seconds(now - self.window)
+        for key in removed_keys:
+            self.remove(key)
+        for bus in changed:
+            key = bus.get_obj_key()
+            self.remove(key)
+            if self.get_since(bus) >= cutoff:
+                self.add(key, bus)
+        while self.expiry and self.expiry[0][0] < cutoff:
+            (since, key) = heapq.heappop(self.expiry)
+            entry = self.entries.get(key)
+            if entry and entry.since == since:
+                self.remove(key)
+        if self.entries:
+            self.speed_deque.append(self.speed_sum / len(self.entries))
+            self.avg_speed = sum(self.speed_deque) / len(self.speed_deque)
+
+    def speed_dict(self) -> Dict[str, float]:
+        return {k: self.route_speed_sums[k] / v for (k, v) in self.route_counts.items()}
+
+
+class FleetSnapshot:
+    """Per-refresh fleet state. Built off to the side, never mutated after publishing"""
+
+    def __init__(self, generation: int = 0, created: datetime.datetime = None, columns: FleetColumns = None,
+                 bus_speed: Mapping[str, float] = None, bus_last_speed: Mapping[str, float] = None,
+                 bus_onroute: Mapping[str, bool] = None, bus_matches: Mapping[str, RouteMatch] = None,
+                 arrival_boards: Mapping[int, Tuple[ArrivalBusStopInfo, ...]] = None,
+                 speed_dict: Mapping[str, float] = None, avg_speed: float = 18.0):
+        self.generation = generation
+        self.created = created
+        self.columns = columns if columns is not None else FleetColumns([])
+        self.stats = FleetStats(self.columns)
+        self.bus_speed = MappingProxyType(bus_speed or {})
+        self.bus_last_speed = MappingProxyType(bus_last_speed or {})
+        self.bus_onroute = MappingProxyType(bus_onroute or {})
+        self.bus_matches = MappingProxyType(bus_matches or {})
+        self.arrival_boards = MappingProxyType(arrival_boards or {})
+        self.speed_dict = MappingProxyType(speed_dict or {})
+        self.avg_speed = avg_speed
+
+    @property
+    def buses(self) -> List[CdsRouteBus]:
+        return self.columns.buses
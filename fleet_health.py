@@ -0,0 +1,99 @@
+import datetime
+import threading
+from collections import deque, Counter
+from typing import NamedTuple, Dict, List, Optional, Deque
+
+from fleet import to_seconds
+
+RESOLUTIONS = {
+    'raw': (None, datetime.timedelta(hours=1)),
+    '1m': (datetime.timedelta(minutes=1), datetime.timedelta(days=1)),
+    '15m': (datetime.timedelta(minutes=15), datetime.timedelta(days=30)),
+}
+MAX_RAW_SAMPLES = 3600
+
+
+class HealthSample(NamedTuple):
+    time: datetime.datetime
+    active: float
+    fetch_seconds: float
+    rows: float
+    route_counts: Dict[str, float]
+
+    def as_dict(self) -> Dict:
+        return {'time': self.time.isoformat(), 'active': round(self.active, 2),
+                'fetch_seconds': round(self.fetch_seconds, 3), 'rows': round(self.rows, 2),
+                'route_counts': {k: round(v, 2) for (k, v) in self.route_counts.items()}}
+
+
+class HealthBucket:
+    """Running sums of the samples falling into one time bucket"""
+
+    def __init__(self, start: datetime.datetime):
+        self.start = start
+        self.count = 0
+        self.active = 0
+        self.fetch_seconds = 0.0
+        self.rows = 0
+        self.route_counts = Counter()
+
+    def add(self, sample: HealthSample):
+        self.count += 1
+        self.active += sample.active
+        self.fetch_seconds += sample.fetch_seconds
+        self.rows += sample.rows
+        self.route_counts.update(sample.route_counts)
+
+    def mean(self) -> HealthSample:
+        return HealthSample(self.start, self.active / self.count, self.fetch_seconds / self.count,
+                            self.rows / self.count, {k: v / self.count for (k, v) in self.route_counts.items()})
+
+
+class FleetHealthSeries:
+    """Fixed-memory fleet health history: raw samples for an hour, averaged buckets for a day and a month"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.raw: Deque[HealthSample] = deque(maxlen=MAX_RAW_SAMPLES)
+        self.series: Dict[str, Deque[HealthSample]] = {}
+        self.open_buckets: Dict[str, Optional[HealthBucket]] = {}
+        for (name, (step, retention)) in RESOLUTIONS.items():
+            if step:
+                self.series[name] = deque(maxlen=retention // step)
+                self.open_buckets[name] = None
+
+    @staticmethod
+    def bucket_start(value: datetime.datetime, step: datetime.timedelta) -> datetime.datetime:
+        seconds = to_seconds(value)
+        return value - datetime.timedelta(seconds=seconds % step.total_seconds())
+
+    def add(self, sample: HealthSample):
+        with self.lock:
+            self.raw.append(sample)
+            while self.raw and self.raw[0].time < sample.time - RESOLUTIONS['raw'][1]:
+                self.raw.popleft()
+            for (name, bucket) in self.open_buckets.items():
+                start = self.bucket_start(sample.time, RESOLUTIONS[name][0])
+                if bucket and bucket.start != start:
+                    self.series[name].append(bucket.mean())
+                    bucket = None
+                if not bucket:
+                    bucket = self.open_buckets[name] = HealthBucket(start)
+                bucket.add(sample)
+
+    def last(self) -> Optional[HealthSample]:
+        with self.lock:
+            return self.raw[-1] if self.raw else None
+
+    def query(self, resolution='raw', since: datetime.datetime = None) -> List[HealthSample]:
+        """Samples of the given resolution, the open bucket included as the latest value"""
+        with self.lock:
+            if resolution == 'raw':
+                result = list(self.raw)
+            else:
+                result = list(self.series[resolution])
+                if self.open_buckets[resolution]:
+                    result.append(self.open_buckets[resolution].mean())
+        if since:
+            result = [x for x in result if x.time >= since]
+        return result
@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from tornado.ioloop import IOLoop
+
+HANDLER_WORKERS = int(os.environ.get('HANDLER_WORKERS', 4))
+HANDLER_MAX_QUEUE = int(os.environ.get('HANDLER_MAX_QUEUE', 64))
+
+
+class HandlerPool:
+    """Bounded thread pool for request computations, with queue depth and wait time metrics"""
+
+    def __init__(self, max_workers=HANDLER_WORKERS, max_queue=HANDLER_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='handler')
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def is_full(self) -> bool:
+        return self.waiting >= self.max_queue
+
+    def reject(self):
+        with self.lock:
+            self.rejected += 1
+
+    async def run(self, func: Callable, *args):
+        submitted = time.monotonic()
+
+        def task():
+            wait = time.monotonic() - submitted
+            with self.lock:
+                self.waiting -= 1
+                self.running += 1
+                self.last_wait = wait
+                self.max_wait = max(self.max_wait, wait)
+                self.total_wait += wait
+            try:
+                return func(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        with self.lock:
+            self.waiting += 1
+        return await IOLoop.current().run_in_executor(self.executor, task)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'workers': self.max_workers, 'max_queue': self.max_queue, 'waiting': self.waiting,
+                    'running': self.running, 'completed': self.completed, 'rejected': self.rejected,
+                    'last_wait': round(self.last_wait, 4), 'max_wait': round(self.max_wait, 4),
+                    'avg_wait': round(self.total_wait / self.completed, 4) if self.completed else 0.0}
@@ -8,6 +8,7 @@ from itertools import zip_longest, filterfalse
 from typing import NamedTuple
 
 import math
+import numpy as np
 import pytz
 
 QUICK_FIX_DIST = 10000
@@ -136,6 +137,19 @@ def distance_km(glat1, glon1, glat2, glon2):
     return result
 
 
+def distances_km(glat1, glon1, glat2, glon2) -> np.ndarray:
+    coords = [np.nan_to_num(np.asarray(x, dtype=np.float64)) for x in (glat1, glon1, glat2, glon2)]
+    invalid = (coords[0] == 0) | (coords[1] == 0) | (coords[2] == 0) | (coords[3] == 0)
+    r = 6373.0
+
+    (lat1, lon1, lat2, lon2) = (np.radians(x) for x in coords)
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return np.where(invalid, QUICK_FIX_DIST, r * c)
+
+
 def get_iso_time(s) -> datetime.datetime:
     if isinstance(s, datetime.datetime):
         return s
@@ -5,6 +5,9 @@ import os
 from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
 import tornado.web
 from dotenv import load_dotenv
 env_path = Path('.') / '.env'
@@ -13,8 +16,10 @@ load_dotenv(dotenv_path=env_path)
 from abuse_checker import AbuseChecker
 from cds import CdsRequest
 from data_processors import WebDataProcessor
-from data_providers import get_data_provider
+from data_providers import get_data_provider, get_follower_data_provider
 from data_types import AbuseRule
+from scheduler import AsyncScheduler
+from shared_fleet import SharedFleetFile
 from tgbot import BusBot
 from tracking import EventTracker, WebEvent
 from website import BusSite
@@ -37,8 +42,17 @@ logger = logging.getLogger("vrnbus")
 logger.info([{k: os.environ[k]} for (k) in os.environ if 'PATH' not in k])
 
 user_settings = {}
+WEB_PROCESSES = int(os.environ.get('WEB_PROCESSES', 1))
 
 if __name__ == "__main__":
+    sockets = tornado.netutil.bind_sockets(int(os.environ.get('PORT', 8088)))
+    fleet_file = SharedFleetFile()
+    if WEB_PROCESSES > 1 and fleet_file.path.exists():
+        fleet_file.path.unlink()
+    # The first process fetches the fleet and runs the Telegram bot, the others serve HTTP from its snapshots
+    task_id = tornado.process.fork_processes(WEB_PROCESSES) if WEB_PROCESSES > 1 else None
+    is_leader = not task_id
+
     log_ignore_events = [
         WebEvent.ABUSE,
         # WebEvent.FRAUD,
@@ -58,11 +72,25 @@ if __name__ == "__main__":
     ]
 
     anti_abuser = AbuseChecker(logger, abuse_rules)
-    data_provider = get_data_provider(logger)
-    cds = CdsRequest(logger, data_provider)
+    scheduler = AsyncScheduler(logger)
+    if is_leader:
+        data_provider = get_data_provider(logger)
+        cds = CdsRequest(logger, data_provider)
+        cds.schedule(scheduler)
+        if task_id is not None:
+            cds.fleet_call_back = fleet_file.publish
+    else:
+        logger.info(f'Worker {task_id} serves the fleet of the leader')
+        data_provider = get_follower_data_provider(logger, fleet_file)
+        cds = CdsRequest(logger, data_provider)
+        cds.schedule_follower(scheduler)
     data_processor = WebDataProcessor(cds, logger, tracker)
-    bot = BusBot(cds, user_settings, logger, tracker)
-    cds.wd_call_back = bot.broadcast_message
+    data_processor.schedule(scheduler)
+    if is_leader:
+        bot = BusBot(cds, user_settings, logger, tracker, scheduler)
+        cds.wd_call_back = bot.broadcast_message
     application = BusSite(data_processor, logger, tracker, anti_abuser)
-    application.listen(os.environ.get('PORT', 8088))
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets(sockets)
+    scheduler.start()
     tornado.ioloop.IOLoop.current().start()
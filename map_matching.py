@@ -0,0 +1,145 @@
+import datetime
+import math
+from typing import NamedTuple, List, Dict, Tuple, Optional, Sequence
+
+import numpy as np
+
+from data_types import LongBusRouteStop, CdsBusPosition
+
+KM_PER_DEGREE = 6373 * math.pi / 180
+MAX_MATCH_KM = 0.3
+MAX_SPEED_KMH = 90
+BACKWARD_KM = 0.3
+
+EdgePoints = Dict[Tuple[int, int], List[Tuple[float, float]]]
+
+
+class RouteMatch(NamedTuple):
+    route_name: str
+    offset: float
+    distance: float
+    direction: int
+    stop_index: int
+    last_time: datetime.datetime
+
+
+class RouteGeometry:
+    """Route polyline in local km coordinates with stop offsets along it"""
+
+    def __init__(self, route: Sequence[LongBusRouteStop], edges: EdgePoints):
+        points = []
+        stop_vertices = []
+        prev_stop = None
+        for bus_stop in route:
+            if prev_stop:
+                points.extend(edges.get((prev_stop.ID, bus_stop.ID), ()))
+            if bus_stop.LAT_ and bus_stop.LON_:
+                points.append((bus_stop.LAT_, bus_stop.LON_))
+            stop_vertices.append(max(len(points) - 1, 0))
+            prev_stop = bus_stop
+
+        coords = np.array(points, dtype=np.float64).reshape(-1, 2)
+        self.lat0 = coords[:, 0].mean() if len(coords) else 0.0
+        self.xy = self.to_xy(coords[:, 0], coords[:, 1])
+        self.seg_start = self.xy[:-1]
+        self.seg_vector = self.xy[1:] - self.xy[:-1]
+        self.seg_length = np.hypot(self.seg_vector[:, 0], self.seg_vector[:, 1])
+        self.vertex_offsets = np.concatenate(([0.0], np.cumsum(self.seg_length)))
+        self.length = self.vertex_offsets[-1]
+        self.stop_offsets = self.vertex_offsets[stop_vertices] if len(coords) else np.zeros(len(route))
+
+    def __len__(self):
+        return len(self.seg_length)
+
+    def to_xy(self, lats, lons) -> np.ndarray:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return np.stack((lons * KM_PER_DEGREE * math.cos(math.radians(self.lat0)), lats * KM_PER_DEGREE), axis=-1)
+
+    def project(self, lats, lons) -> Tuple[np.ndarray, np.ndarray]:
+        """Offsets and distances of every point projected on every segment, shape (points, segments)"""
+        xy = self.to_xy(lats, lons)[:, None, :] - self.seg_start[None, :, :]
+        seg_length2 = np.maximum(self.seg_length ** 2, 1e-12)
+        t = np.clip((xy * self.seg_vector[None, :, :]).sum(axis=2) / seg_length2, 0, 1)
+        diff = xy - t[:, :, None] * self.seg_vector[None, :, :]
+        return self.vertex_offsets[None, :-1] + t * self.seg_length[None, :], np.hypot(diff[:, :, 0], diff[:, :, 1])
+
+    def stop_index(self, offset: float, direction: int = 1) -> int:
+        """Next stop in the direction of travel: the first one at or ahead of the offset, or behind it when moving back"""
+        if direction < 0:
+            return max(int(np.searchsorted(self.stop_offsets, offset, side='right')) - 1, 0)
+        return min(int(np.searchsorted(self.stop_offsets, offset, side='left')), len(self.stop_offsets) - 1)
+
+    def segment_index(self, offset: float) -> int:
+        i = int(np.searchsorted(self.stop_offsets, offset, side='right')) - 1
+        return min(max(i, 0), len(self.stop_offsets) - 2)
+
+
+class MapMatcher:
+    """Projects bus fixes on route geometry, advancing from the previous match of the bus"""
+
+    def __init__(self, bus_routes: Dict[str, Sequence[LongBusRouteStop]], edges: EdgePoints = None):
+        edges = edges or {}
+        self.geometries = {k: RouteGeometry(v, edges) for (k, v) in bus_routes.items() if len(v) >= 2}
+        self.geometries = {k: v for (k, v) in self.geometries.items() if len(v) > 0}
+
+    def match(self, route_name: str, positions: Sequence[CdsBusPosition],
+              prev_matches: Sequence[Optional[RouteMatch]]) -> List[Optional[RouteMatch]]:
+        geometry = self.geometries.get(route_name)
+        valid = [i for (i, x) in enumerate(positions) if x.is_valid_coords()]
+        result: List[Optional[RouteMatch]] = [None] * len(positions)
+        if not geometry or not valid:
+            return result
+
+        offsets, distances = geometry.project([positions[i].lat for i in valid], [positions[i].lon for i in valid])
+        best = distances.argmin(axis=1)
+        for (row, i) in enumerate(valid):
+            position, prev = positions[i], prev_matches[i]
+            if prev and prev.route_name == route_name and geometry.length > 0:
+                hours = max((position.last_time - prev.last_time).total_seconds(), 0) / 3600
+                forward = (offsets[row] - prev.offset) % geometry.length
+                allowed = (forward <= hours * MAX_SPEED_KMH + MAX_MATCH_KM) | \
+                          (forward >= geometry.length - BACKWARD_KM)
+                if allowed.any():
+                    candidate = np.flatnonzero(allowed)[distances[row, allowed].argmin()]
+                    if distances[row, candidate] <= MAX_MATCH_KM:
+                        best[row] = candidate
+
+            offset = float(offsets[row, best[row]])
+            direction = 0
+            if prev and prev.route_name == route_name:
+                delta = offset - prev.offset
+                if abs(delta) > geometry.length / 2:
+                    delta -= math.copysign(geometry.length, delta)
+                direction = 1 if delta > 0.02 else -1 if delta < -0.02 else prev.direction
+            result[i] = RouteMatch(route_name, offset, float(distances[row, best[row]]), direction,
+                                   geometry.stop_index(offset, direction), position.last_time)
+        return result
+
+    def remaining_km(self, match: RouteMatch) -> Optional[float]:
+        """Distance along the line from the match to its next stop"""
+        geometry = self.geometries.get(match.route_name)
+        if not geometry:
+            return None
+        km = float(geometry.stop_offsets[match.stop_index] - match.offset)
+        km = -km if match.direction < 0 else km
+        return km if km >= 0 else None
+
+    def travelled_segments(self, prev: Optional[RouteMatch], curr: Optional[RouteMatch]) -> range:
+        """Stop-to-stop segments passed between two matches, empty unless the bus moved forward on the line"""
+        if not prev or not curr or prev.route_name != curr.route_name or curr.offset <= prev.offset:
+            return range(0)
+        if max(prev.distance, curr.distance) > MAX_MATCH_KM:
+            return range(0)
+        geometry = self.geometries.get(curr.route_name)
+        if not geometry:
+            return range(0)
+        return range(geometry.segment_index(prev.offset), geometry.segment_index(curr.offset) + 1)
+
+
+def parse_route_edges(edges: List[Dict]) -> EdgePoints:
+    result = {}
+    for edge in edges or ():
+        (from_id, to_id) = edge['edge_key']
+        result[(from_id, to_id)] = [(x['lat'], x['lng']) for x in edge['points']]
+    return result
@@ -0,0 +1,145 @@
+from typing import Dict, List, Iterable, Tuple
+
+import numpy as np
+
+from data_types import CdsBusPosition
+from fleet import EPOCH, to_seconds
+from helpers import distances_km
+
+MICRO = 1_000_000
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class PositionStore:
+    """Ring buffers of the last positions per vehicle in int32 microdegrees and epoch seconds"""
+
+    def __init__(self, depth=20, capacity=256, idle_seconds=2 * 60 * 60):
+        self.depth = depth
+        self.idle_seconds = idle_seconds
+        self.slots: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.lat = np.zeros((capacity, depth), dtype=np.int32)
+        self.lon = np.zeros((capacity, depth), dtype=np.int32)
+        self.time = np.zeros((capacity, depth), dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int32)
+        self.head = np.zeros(capacity, dtype=np.int32)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def copy(self) -> 'PositionStore':
+        result = PositionStore.__new__(PositionStore)
+        result.__dict__.update(self.__dict__)
+        result.slots, result.free = dict(self.slots), list(self.free)
+        for name in ('lat', 'lon', 'time', 'count', 'head', 'last_seen'):
+            setattr(result, name, getattr(self, name).copy())
+        return result
+
+    def get_slot(self, name) -> int:
+        slot = self.slots.get(name)
+        if slot is not None:
+            return slot
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.slots)
+            if slot >= len(self.count):
+                self.grow()
+        self.slots[name] = slot
+        self.count[slot] = self.head[slot] = self.last_seen[slot] = 0
+        return slot
+
+    def grow(self):
+        for name in ('lat', 'lon', 'time', 'count', 'head', 'last_seen'):
+            value = getattr(self, name)
+            grown = np.zeros((len(value) * 2,) + value.shape[1:], dtype=value.dtype)
+            grown[:len(value)] = value
+            setattr(self, name, grown)
+
+    def add(self, name, position: CdsBusPosition):
+        slot = self.get_slot(name)
+        lat, lon = int(round(position.lat * MICRO)), int(round(position.lon * MICRO))
+        seconds = int(to_seconds(position.last_time))
+        count = self.count[slot]
+        if count and ((self.lat[slot, :count] == lat) & (self.lon[slot, :count] == lon) &
+                      (self.time[slot, :count] == seconds)).any():
+            return
+        head = self.head[slot]
+        self.lat[slot, head], self.lon[slot, head], self.time[slot, head] = lat, lon, seconds
+        self.head[slot] = (head + 1) % self.depth
+        self.count[slot] = min(count + 1, self.depth)
+        self.last_seen[slot] = max(self.last_seen[slot], seconds)
+
+    def positions(self, name) -> List[CdsBusPosition]:
+        slot = self.slots.get(name)
+        if slot is None:
+            return []
+        count, head = self.count[slot], self.head[slot]
+        order = [(head - count + i) % self.depth for i in range(count)]
+        return [CdsBusPosition(self.lat[slot, i] / MICRO, self.lon[slot, i] / MICRO,
+                               EPOCH + np.timedelta64(self.time[slot, i], 's').item()) for i in order]
+
+    def rewrite(self, slot, lat: np.ndarray, lon: np.ndarray, time: np.ndarray):
+        size = len(lat)
+        self.lat[slot, :size], self.lon[slot, :size], self.time[slot, :size] = lat, lon, time
+        self.count[slot] = size
+        self.head[slot] = size % self.depth
+
+    def update_speeds(self, names: Iterable[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Average and last speeds for vehicles with at least two positions.
+
+        Positions are sorted by time and invalid ones dropped. The window is cut to the last 3 positions
+        when a stopped vehicle starts moving and to the last 10 when it speeds up twice.
+        """
+        names = [x for x in names if x in self.slots and self.count[self.slots[x]] >= 2]
+        if not names:
+            return [], np.zeros(0), np.zeros(0)
+        slots = np.array([self.slots[x] for x in names])
+        depth = self.depth
+        count = self.count[slots]
+        inserted = (self.head[slots, None] - count[:, None] + np.arange(depth)[None, :]) % depth
+        (lat, lon, time) = (np.take_along_axis(x[slots], inserted, axis=1) for x in (self.lat, self.lon, self.time))
+        filled = np.arange(depth)[None, :] < count[:, None]
+        valid = filled & (lat != 0) & (lon != 0)
+        order = np.argsort(np.where(valid, time, np.iinfo(np.int64).max), axis=1, kind='stable')
+        (lat, lon, time) = (np.take_along_axis(x, order, axis=1) for x in (lat, lon, time))
+        size = valid.sum(axis=1)
+
+        steps = distances_km(lat[:, :-1] / MICRO, lon[:, :-1] / MICRO, lat[:, 1:] / MICRO, lon[:, 1:] / MICRO)
+        steps = np.where(np.arange(1, depth)[None, :] < size[:, None], steps, 0)
+        cumulative = np.concatenate((np.zeros((len(slots), 1)), np.cumsum(steps, axis=1)), axis=1)
+        rows = np.arange(len(slots))
+        last = np.maximum(size - 1, 0)
+
+        def speed(window):
+            first = np.maximum(size - window, 0)
+            seconds = (time[rows, last] - time[rows, first]) % SECONDS_PER_DAY
+            dist = cumulative[rows, last] - cumulative[rows, first]
+            return np.where(seconds == 0, 0.00001, dist * 3600 / np.maximum(seconds, 1))
+
+        last_speed = speed(3)
+        avg_speed = speed(depth)
+        started = (avg_speed < 5) & (last_speed > 5)
+        speed_up = ~started & (last_speed > avg_speed * 2)
+        avg_speed = np.where(started, last_speed, avg_speed)
+        last_speed = np.where(speed_up, speed(10), last_speed)
+        avg_speed = np.where(speed_up, last_speed, avg_speed)
+
+        for (i, window) in [(i, 3) for i in np.flatnonzero(started & (size > 0))] + \
+                           [(i, 10) for i in np.flatnonzero(speed_up & (size > 0))]:
+            part = slice(max(size[i] - window, 0), size[i])
+            self.rewrite(slots[i], lat[i, part], lon[i, part], time[i, part])
+
+        keep = size > 0
+        return [x for (x, k) in zip(names, keep) if k], avg_speed[keep], last_speed[keep]
+
+    def evict(self, now_seconds) -> List[str]:
+        """Free slots of vehicles without new positions for idle_seconds"""
+        idle = [k for (k, v) in self.slots.items() if self.last_seen[v] < now_seconds - self.idle_seconds]
+        for name in idle:
+            self.free.append(self.slots.pop(name))
+        return idle
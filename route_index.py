@@ -0,0 +1,55 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_types import LongBusRouteStop
+
+
+class RouteIndex:
+    """Stop positions, cumulative distances and routes on every stop"""
+
+    def __init__(self, bus_routes: Dict[str, List[LongBusRouteStop]]):
+        self.bus_routes = bus_routes
+        self.positions: Dict[str, Dict[str, int]] = {}
+        self.distances: Dict[str, np.ndarray] = {}
+        stop_routes: Dict[int, List[str]] = {}
+        for (route_name, route) in bus_routes.items():
+            for bus_stop_id in dict.fromkeys(x.ID for x in route):
+                stop_routes.setdefault(bus_stop_id, []).append(route_name)
+            positions = {}
+            for (i, bus_stop) in enumerate(route):
+                positions.setdefault(bus_stop.NAME_, i)
+            self.positions[route_name] = positions
+            steps = [0.0] + [prev.distance_km(curr) for (prev, curr) in zip(route, route[1:])]
+            self.distances[route_name] = np.cumsum(steps)
+        self.stop_routes: Dict[int, Tuple[str, ...]] = {k: tuple(v) for (k, v) in stop_routes.items()}
+
+    def get_routes_on_bus_stop(self, bus_stop_id) -> Tuple[str, ...]:
+        return self.stop_routes.get(bus_stop_id, ())
+
+    def get_position(self, route_name, bus_stop_name) -> Optional[int]:
+        return self.positions.get(route_name, {}).get(bus_stop_name)
+
+    def get_dist(self, route_name, bus_stop_start, bus_stop_stop) -> float:
+        positions = self.positions.get(route_name)
+        if not positions:
+            return 0
+        start = positions.get(bus_stop_start)
+        if start is None:
+            return 0
+        distances = self.distances[route_name]
+        stop = positions.get(bus_stop_stop)
+        if stop is None:
+            return float(distances[-1] - distances[start])
+        if stop <= start:
+            return 0
+        return float(distances[stop] - distances[start])
+
+    def get_next_bus_stop(self, route_name, bus_stop_name) -> Optional[LongBusRouteStop]:
+        position = self.get_position(route_name, bus_stop_name)
+        if position is None:
+            return None
+        route = self.bus_routes[route_name]
+        if position + 2 < len(route):
+            return route[position + 1]
+        return route[position]
@@ -0,0 +1,80 @@
+import threading
+from logging import Logger
+from typing import Dict, List, NamedTuple
+
+from data_types import LongBusRouteStop, CdsBaseDataProvider
+from helpers import sort_routes
+from map_matching import MapMatcher, EdgePoints
+from route_index import RouteIndex
+from spatial_index import SpatialIndex, build_spatial_index
+
+ROUTES_REFRESH_INTERVAL = 600
+
+
+class RouteSet:
+    """Routes with the stop, spatial and map matching indexes built over them"""
+
+    def __init__(self, bus_routes: Dict[str, List[LongBusRouteStop]], edges: EdgePoints = None):
+        self.bus_routes = bus_routes
+        self.index = RouteIndex(bus_routes)
+        self.spatial_indexes: Dict[str, SpatialIndex] = {k: build_spatial_index(v) for (k, v) in bus_routes.items()}
+        self.map_matcher = MapMatcher(bus_routes, edges)
+
+
+class RouteRegistryState(NamedTuple):
+    version: int
+    routes: RouteSet
+    new_routes: RouteSet
+    new_route_names: Dict[str, int]
+    new_route_list: List[str]
+
+
+class RouteRegistry:
+    """Legacy and new routes, rebuilt in the background and published atomically with a version"""
+
+    def __init__(self, logger: Logger, data_provider: CdsBaseDataProvider):
+        self.logger = logger
+        self.data_provider = data_provider
+        self.lock = threading.Lock()
+        self.edges: EdgePoints = {}
+        new_route_names = data_provider.load_new_codd_route_names() or {}
+        self.state = RouteRegistryState(0, RouteSet(data_provider.load_bus_stations_routes() or {}), RouteSet({}),
+                                        new_route_names, sort_routes(new_route_names.keys()))
+
+    @property
+    def version(self) -> int:
+        return self.state.version
+
+    def publish(self, **changes) -> RouteRegistryState:
+        state = self.state._replace(version=self.state.version + 1, **changes)
+        self.state = state
+        self.logger.info(f'Routes version {state.version}: {len(state.routes.bus_routes)} routes, '
+                         f'{len(state.new_routes.bus_routes)} new routes')
+        return state
+
+    def refresh(self):
+        """Reloads routes from the data provider, indexes are rebuilt only for the changed route sets"""
+        bus_routes = self.data_provider.load_bus_stations_routes()
+        new_routes = self.data_provider.load_new_bus_stations_routes()
+        new_route_names = self.data_provider.load_new_codd_route_names()
+        with self.lock:
+            state = self.state
+            changes = {}
+            if bus_routes and bus_routes != state.routes.bus_routes:
+                changes['routes'] = RouteSet(bus_routes, self.edges)
+            if new_routes and new_routes != state.new_routes.bus_routes:
+                changes['new_routes'] = RouteSet(new_routes)
+            if new_route_names and new_route_names != state.new_route_names:
+                changes['new_route_names'] = new_route_names
+                changes['new_route_list'] = sort_routes(new_route_names.keys())
+            if changes:
+                self.publish(**changes)
+
+    def set_route_edges(self, edges: EdgePoints) -> bool:
+        """Rebuilds map matching over the new edges, returns False when the edges did not change"""
+        with self.lock:
+            if edges == self.edges:
+                return False
+            self.edges = edges
+            self.publish(routes=RouteSet(self.state.routes.bus_routes, edges))
+        return True
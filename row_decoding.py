@@ -0,0 +1,99 @@
+import datetime
+import json
+import sys
+import time
+from operator import itemgetter
+from pathlib import Path
+from typing import Sequence, Dict, Callable, List, Type, Iterable, Collection
+
+from helpers import get_iso_time
+
+TEST_DATA_COLUMNS = ('last_lat_', 'last_lon_', 'last_speed_', 'last_time_', 'name_', 'obj_id_', 'proj_id_',
+                     'route_name_', 'type_proj', 'last_station_time_', 'bus_station_', 'low_floor')
+
+
+def intern_string(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def parse_iso_time(value):
+    if not value or isinstance(value, datetime.datetime):
+        return value or None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return get_iso_time(value)
+
+
+class RowDecoder:
+    """Builds NamedTuple records straight from row tuples, columns are mapped to fields once per query"""
+
+    def __init__(self, record_type: Type, columns: Sequence[str], converters: Dict[str, Callable] = None,
+                 interned: Collection[str] = ()):
+        positions = {x.lower(): i for (i, x) in enumerate(columns)}
+        defaults = record_type._field_defaults
+        missing = [x for x in record_type._fields if x.lower() not in positions]
+        required = [x for x in missing if x not in defaults]
+        if required:
+            raise ValueError(f'No columns for {record_type.__name__} fields {required}')
+
+        self.record_type = record_type
+        self.tail = tuple(defaults[x] for x in missing)
+        tail_positions = {x: len(columns) + i for (i, x) in enumerate(missing)}
+        indices = [positions.get(x.lower(), tail_positions.get(x)) for x in record_type._fields]
+        self.getter = itemgetter(*indices)
+        converters = dict(converters or {})
+        converters.update((x, intern_string) for x in interned)
+        self.conversions = [(positions[x.lower()], f) for (x, f) in converters.items() if x.lower() in positions]
+
+    def decode(self, rows: Iterable[Sequence]) -> List:
+        new, record_type, getter, tail, conversions = tuple.__new__, self.record_type, self.getter, self.tail, \
+                                                      self.conversions
+        if not conversions:
+            return [new(record_type, getter(tuple(row) + tail)) for row in rows]
+        result = []
+        for row in rows:
+            row = list(row)
+            for (i, convert) in conversions:
+                row[i] = convert(row[i])
+            result.append(new(record_type, getter(tuple(row) + tail)))
+        return result
+
+
+def decode_cursor(cur, record_type: Type, converters: Dict[str, Callable] = None,
+                  interned: Collection[str] = ()) -> List:
+    decoder = RowDecoder(record_type, [x[0] for x in cur.description], converters, interned)
+    return decoder.decode(cur.fetchall())
+
+
+if __name__ == '__main__':
+    from data_types import CdsRouteBus
+
+    path = sorted(Path('test_data').glob('codd_data_db*.json'))[0]
+    with open(path, 'rb') as f:
+        json_rows = json.load(f)
+    repeat = 20
+    interned = ('route_name_', 'bus_station_', 'bort_name')
+
+    start = time.time()
+    for _ in range(repeat):
+        [CdsRouteBus.make(*x) for x in json_rows]
+    print(f'{len(json_rows)} recorded rows, make: {(time.time() - start) * 1000 / repeat:.2f} ms')
+    start = time.time()
+    for _ in range(repeat):
+        RowDecoder(CdsRouteBus, TEST_DATA_COLUMNS, {'last_time_': parse_iso_time, 'last_station_time_': parse_iso_time},
+                   interned).decode(json_rows)
+    print(f'{len(json_rows)} recorded rows, RowDecoder: {(time.time() - start) * 1000 / repeat:.2f} ms')
+
+    columns = [x.upper() for x in TEST_DATA_COLUMNS]
+    cursor_rows = [tuple(parse_iso_time(v) if k in ('last_time_', 'last_station_time_') else v
+                         for (k, v) in zip(TEST_DATA_COLUMNS, x)) for x in json_rows]
+    start = time.time()
+    for _ in range(repeat):
+        dicts = [{k: v for k, v in zip(columns, row)} for row in cursor_rows]
+        [CdsRouteBus(**{k.lower(): v for (k, v) in x.items()}) for x in dicts]
+    print(f'{len(cursor_rows)} cursor rows, dict path: {(time.time() - start) * 1000 / repeat:.2f} ms')
+    start = time.time()
+    for _ in range(repeat):
+        RowDecoder(CdsRouteBus, columns, interned=interned).decode(cursor_rows)
+    print(f'{len(cursor_rows)} cursor rows, RowDecoder: {(time.time() - start) * 1000 / repeat:.2f} ms')
@@ -0,0 +1,119 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Callable, Dict, Optional, List
+
+MAX_BACKOFF = 300
+BACKOFF_JITTER = 0.2
+
+
+class PeriodicJob:
+    """Blocking function run every interval seconds, with timing statistics"""
+
+    def __init__(self, name: str, func: Callable, interval: float, timeout: float = None, run_now=True,
+                 on_timeout: Callable[[str, float], None] = None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.timeout = timeout
+        self.run_now = run_now
+        self.on_timeout = on_timeout
+        self.pending: Optional[asyncio.Future] = None
+        self.failures = 0
+        self.runs = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_run: Optional[float] = None
+
+    def backoff(self) -> float:
+        delay = min(self.interval * 2 ** self.failures, MAX_BACKOFF)
+        return delay * random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER)
+
+    def stats(self) -> Dict:
+        return {'interval': self.interval, 'runs': self.runs, 'errors': self.errors, 'timeouts': self.timeouts,
+                'skipped': self.skipped, 'failures_in_row': self.failures,
+                'last_duration': round(self.last_duration, 3), 'max_duration': round(self.max_duration, 3),
+                'last_lag': round(self.last_lag, 3), 'max_lag': round(self.max_lag, 3),
+                'running': bool(self.pending and not self.pending.done())}
+
+
+class AsyncScheduler:
+    """Periodic jobs on the asyncio loop of Tornado's IOLoop. Blocking work goes to a dedicated executor,
+    a job that times out or fails is retried with jittered exponential backoff"""
+
+    def __init__(self, logger: Logger, max_workers=4):
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler')
+        self.jobs: Dict[str, PeriodicJob] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.running = False
+
+    def add_job(self, name: str, func: Callable, interval: float, timeout: float = None, run_now=True,
+                on_timeout: Callable[[str, float], None] = None) -> PeriodicJob:
+        job = self.jobs[name] = PeriodicJob(name, func, interval, timeout, run_now, on_timeout)
+        if self.running:
+            self.tasks.append(asyncio.ensure_future(self.run_job(job)))
+        return job
+
+    def start(self):
+        self.running = True
+        for job in self.jobs.values():
+            self.tasks.append(asyncio.ensure_future(self.run_job(job)))
+
+    def stop(self):
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def run_job(self, job: PeriodicJob):
+        loop = asyncio.get_event_loop()
+        next_time = loop.time() + (0 if job.run_now else job.interval)
+        while self.running:
+            await asyncio.sleep(max(next_time - loop.time(), 0))
+            job.last_lag = loop.time() - next_time
+            job.max_lag = max(job.max_lag, job.last_lag)
+            if job.pending and not job.pending.done():
+                job.skipped += 1
+                self.logger.warning(f'{job.name}: previous run is still in progress, skipped')
+                next_time = loop.time() + job.backoff()
+                continue
+
+            start = time.monotonic()
+            job.pending = loop.run_in_executor(self.executor, job.func)
+            try:
+                await asyncio.wait_for(asyncio.shield(job.pending), job.timeout)
+                job.failures = 0
+            except asyncio.TimeoutError:
+                job.timeouts += 1
+                job.failures += 1
+                self.logger.error(f'{job.name}: no result after {job.timeout} s')
+                if job.on_timeout:
+                    loop.run_in_executor(self.executor, job.on_timeout, job.name, time.monotonic() - start)
+            except Exception:
+                job.errors += 1
+                job.failures += 1
+                self.logger.exception(f'{job.name} failed')
+            finally:
+                job.runs += 1
+                job.last_run = time.time()
+                job.last_duration = time.monotonic() - start
+                job.max_duration = max(job.max_duration, job.last_duration)
+
+            if job.failures:
+                next_time = loop.time() + job.backoff()
+            else:
+                next_time += job.interval
+                if next_time < loop.time():
+                    next_time = loop.time() + job.interval
+            self.logger.debug(f'{job.name}: {job.last_duration:.2f} s, lag {job.last_lag:.2f} s')
+
+    def stats(self) -> Dict[str, Dict]:
+        return {k: v.stats() for (k, v) in self.jobs.items()}
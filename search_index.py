@@ -0,0 +1,91 @@
+from typing import List, Dict, Iterator
+
+from data_types import BusStop
+from helpers import fuzzy_search_advanced
+
+SKIP_CHARS = (' ', ',', '(', ')', '.')
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+class BusStopSearchIndex:
+    """Candidate filter over bus stop names, verified with fuzzy_search_advanced.
+
+    Every posting list is a bitmask of positions in bus_stops. fuzzy_search_advanced can only match
+    a name that contains all query chars and either contains the query as a substring (so all of its
+    bigrams) or has the first query char at the start of a word.
+    """
+
+    def __init__(self, bus_stops: List[BusStop]):
+        self.bus_stops = bus_stops
+        self.names = [x.NAME_ or '' for x in bus_stops]
+        self.lower_names = [x.lower() for x in self.names]
+        self.chars: Dict[str, int] = {}
+        self.word_starts: Dict[str, int] = {}
+        self.bigrams: Dict[str, int] = {}
+        for (i, name) in enumerate(self.lower_names):
+            bit = 1 << i
+            for ch in set(name):
+                self.chars[ch] = self.chars.get(ch, 0) | bit
+            for ch in {ch for (j, ch) in enumerate(name) if j == 0 or name[j - 1] in SKIP_CHARS}:
+                self.word_starts[ch] = self.word_starts.get(ch, 0) | bit
+            for bigram in {name[j:j + 2] for j in range(len(name) - 1)}:
+                self.bigrams[bigram] = self.bigrams.get(bigram, 0) | bit
+
+    def candidates(self, query: str) -> int:
+        query = query.lower()
+        mask = (1 << len(self.names)) - 1
+        for ch in set(query):
+            mask &= self.chars.get(ch, 0)
+            if not mask:
+                return 0
+
+        substring_mask = mask
+        for bigram in {query[j:j + 2] for j in range(len(query) - 1)}:
+            substring_mask &= self.bigrams.get(bigram, 0)
+        first_char = query[0]
+        if first_char in SKIP_CHARS:
+            return mask
+        return mask & (substring_mask | self.word_starts.get(first_char, 0))
+
+    def substring_candidates(self, query: str) -> int:
+        """Names that have every char and bigram of the query"""
+        mask = (1 << len(self.names)) - 1
+        for ch in set(query):
+            mask &= self.chars.get(ch, 0)
+        for bigram in {query[j:j + 2] for j in range(len(query) - 1)}:
+            mask &= self.bigrams.get(bigram, 0)
+        return mask
+
+    def substring_search(self, query: str) -> List[BusStop]:
+        """Stops whose name contains the query, case-insensitive, in the order of bus_stops"""
+        if not query:
+            return []
+        lower_query = query.lower()
+        return [self.bus_stops[i] for i in iter_bits(self.substring_candidates(lower_query))
+                if lower_query in self.lower_names[i]]
+
+    def iter_matches(self, query: str) -> Iterator[BusStop]:
+        if not query:
+            return
+        lower_query = query.lower()
+        for i in iter_bits(self.candidates(query)):
+            name = self.names[i]
+            if lower_query in self.lower_names[i] and len(query) <= len(name) or fuzzy_search_advanced(query, name):
+                yield self.bus_stops[i]
+
+    def search(self, query: str, limit: int = None) -> List[BusStop]:
+        result = []
+        for bus_stop in self.iter_matches(query):
+            result.append(bus_stop)
+            if limit and len(result) >= limit:
+                break
+        return result
+
+    def has_matches(self, query: str) -> bool:
+        return next(self.iter_matches(query), None) is not None
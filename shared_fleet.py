@@ -0,0 +1,75 @@
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from data_types import CdsRouteBus
+from fetcher import encode_buses, decode_buses
+
+SHARED_FLEET_PATH = os.environ.get('SHARED_FLEET_PATH', 'dumps/shared_fleet.bin')
+
+MAGIC = b'VRNBUSSF'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHQddQ')
+
+
+class SharedFleetFile:
+    """Fleet published by the leader process into a file, mapped read-only by the worker processes.
+    A new fleet replaces the file atomically, so readers never see a partial write.
+    Generations only grow: a restarted leader continues from the file it replaces"""
+
+    def __init__(self, path=SHARED_FLEET_PATH):
+        self.path = Path(path)
+        self.generation = 0
+        self.now: Optional[datetime] = None
+        self.published = 0.0
+        self.file_id: Optional[Tuple[int, int]] = None
+
+    def header(self) -> Optional[Tuple]:
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        header = HEADER.unpack(data)
+        return header if header[:2] == (MAGIC, FORMAT_VERSION) else None
+
+    def publish(self, buses: List[CdsRouteBus], now: datetime):
+        payload = encode_buses(buses)
+        if not self.generation:
+            header = self.header()
+            self.generation = header[2] if header else 0
+        self.generation += 1
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.generation, now.timestamp(), time.time(), len(payload)))
+            f.write(payload)
+        tmp_path.replace(self.path)
+
+    def changed(self) -> bool:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        if (stat.st_ino, stat.st_mtime_ns) == self.file_id:
+            return False
+        header = self.header()
+        return header is not None and header[2] > self.generation
+
+    def read(self) -> List[CdsRouteBus]:
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                (magic, version, generation, now, published, size) = HEADER.unpack_from(view)
+                if magic != MAGIC or version != FORMAT_VERSION:
+                    raise ValueError(f'Unknown shared fleet format {magic!r} v{version}')
+                with view[HEADER.size:HEADER.size + size] as payload:
+                    buses = decode_buses(payload)
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+        (self.generation, self.now, self.published) = (generation, datetime.fromtimestamp(now), published)
+        return buses
@@ -0,0 +1,82 @@
+import functools
+import threading
+from typing import Callable, Dict
+
+import cachetools
+from cachetools.keys import hashkey
+
+CACHE_TYPES = {
+    'lru': cachetools.LRUCache,
+    'lfu': cachetools.LFUCache,
+}
+
+
+class GenerationCache:
+    """Bounded cache whose entries are dropped as soon as a newer owner generation shows up"""
+
+    def __init__(self, name, maxsize=1024, policy='lru', stripes=8):
+        self.name = name
+        self.maxsize = maxsize
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.caches = [CACHE_TYPES[policy](max(maxsize // stripes, 1)) for _ in range(stripes)]
+        self.generations = [None] * stripes
+        self.hits = [0] * stripes
+        self.misses = [0] * stripes
+
+    def get(self, key, generation, func: Callable):
+        stripe = hash(key) % len(self.caches)
+        with self.locks[stripe]:
+            cache = self.caches[stripe]
+            if self.generations[stripe] is None or generation > self.generations[stripe]:
+                cache.clear()
+                self.generations[stripe] = generation
+            if generation == self.generations[stripe]:
+                try:
+                    value = cache[key]
+                    self.hits[stripe] += 1
+                    return value
+                except KeyError:
+                    pass
+            self.misses[stripe] += 1
+
+        value = func()
+        with self.locks[stripe]:
+            if self.generations[stripe] == generation:
+                try:
+                    self.caches[stripe][key] = value
+                except ValueError:
+                    pass
+        return value
+
+    def clear(self):
+        for (lock, cache) in zip(self.locks, self.caches):
+            with lock:
+                cache.clear()
+
+    def info(self) -> Dict:
+        return {'hits': sum(self.hits), 'misses': sum(self.misses), 'maxsize': self.maxsize,
+                'currsize': sum(len(x) for x in self.caches)}
+
+
+CACHES: Dict[str, GenerationCache] = {}
+
+
+def generation_cache(maxsize=1024, policy='lru', stripes=8, key=hashkey):
+    """Method decorator, the owner provides a generation attribute"""
+
+    def decorator(func):
+        cache = GenerationCache(func.__qualname__, maxsize, policy, stripes)
+        CACHES[cache.name] = cache
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            return cache.get((id(self), key(*args, **kwargs)), self.generation, lambda: func(self, *args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def cache_stats() -> Dict[str, Dict]:
+    return {k: v.info() for (k, v) in CACHES.items()}
@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from typing import Sequence, List, Any
+
+import numpy as np
+
+try:
+    from rtree import index
+except (ImportError, OSError):
+    index = None
+
+SPATIAL_INDEX = os.environ.get('SPATIAL_INDEX', 'numpy')
+
+
+def coords_array(values) -> np.ndarray:
+    return np.array([np.nan if x is None else x for x in values], dtype=np.float64)
+
+
+class SpatialIndex:
+    """Immutable index of items with LAT_ and LON_ attributes"""
+
+    def __init__(self, items: Sequence[Any]):
+        self.items = list(items)
+        self.lats = coords_array(x.LAT_ for x in self.items)
+        self.lons = coords_array(x.LON_ for x in self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def nearest_positions(self, lats: np.ndarray, lons: np.ndarray, k: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def nearest(self, lat, lon, k=1) -> List[Any]:
+        if not self.items:
+            return []
+        positions = self.nearest_positions(np.array([lat], dtype=np.float64), np.array([lon], dtype=np.float64), k)
+        return [self.items[i] for i in positions[0]]
+
+    def nearest_batch(self, lats, lons, k=1) -> List[List[Any]]:
+        if not self.items:
+            return [[] for _ in lats]
+        positions = self.nearest_positions(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), k)
+        return [[self.items[i] for i in row] for row in positions]
+
+
+class NumpySpatialIndex(SpatialIndex):
+    CHUNK_SIZE = 256
+
+    def nearest_positions(self, lats: np.ndarray, lons: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, len(self.items))
+        result = []
+        for start in range(0, len(lats), self.CHUNK_SIZE):
+            chunk = slice(start, start + self.CHUNK_SIZE)
+            dist = (lats[chunk, None] - self.lats[None, :]) ** 2 + (lons[chunk, None] - self.lons[None, :]) ** 2
+            dist[np.isnan(dist)] = np.inf
+            if k < len(self.items):
+                positions = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            else:
+                positions = np.broadcast_to(np.arange(len(self.items)), dist.shape)
+            order = np.argsort(np.take_along_axis(dist, positions, axis=1), axis=1, kind='stable')
+            result.append(np.take_along_axis(positions, order, axis=1))
+        return np.concatenate(result) if result else np.empty((0, k), dtype=np.int64)
+
+
+class RtreeSpatialIndex(SpatialIndex):
+    def __init__(self, items: Sequence[Any]):
+        super().__init__(items)
+        valid = ~(np.isnan(self.lats) | np.isnan(self.lons))
+        stream = ((int(i), (self.lats[i], self.lons[i], self.lats[i], self.lons[i]), None)
+                  for i in np.flatnonzero(valid))
+        self.index = index.Index(stream) if valid.any() else index.Index()
+
+    def nearest_positions(self, lats: np.ndarray, lons: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, len(self.items))
+        return np.array([list(self.index.nearest((lat, lon), k))[:k] for (lat, lon) in zip(lats, lons)],
+                        dtype=np.int64).reshape(len(lats), -1)
+
+
+SPATIAL_INDEX_BACKENDS = {
+    'numpy': NumpySpatialIndex,
+    'rtree': RtreeSpatialIndex,
+}
+
+
+def build_spatial_index(items: Sequence[Any], backend: str = None) -> SpatialIndex:
+    backend = backend or SPATIAL_INDEX
+    if backend == 'rtree' and index is None:
+        backend = 'numpy'
+    return SPATIAL_INDEX_BACKENDS[backend](items)
+
+
+if __name__ == '__main__':
+    from data_types import BusStop
+
+    with open('bus_stops.json', 'rb') as f:
+        bus_stops = [BusStop(**i) for i in json.load(f) if i['LAT_'] and i['LON_']]
+    points = np.random.default_rng(42).uniform((51.6, 39.1), (51.75, 39.3), (1000, 2))
+
+    for name in SPATIAL_INDEX_BACKENDS:
+        start = time.time()
+        spatial_index = build_spatial_index(bus_stops, name)
+        print(f'{name:6} build: {(time.time() - start) * 1000:.2f} ms')
+        start = time.time()
+        for (lat, lon) in points:
+            spatial_index.nearest(lat, lon, 3)
+        print(f'{name:6} 1000 x nearest: {(time.time() - start) * 1000:.2f} ms')
+        start = time.time()
+        spatial_index.nearest_batch(points[:, 0], points[:, 1], 3)
+        print(f'{name:6} nearest_batch(1000): {(time.time() - start) * 1000:.2f} ms')
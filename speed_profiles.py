@@ -0,0 +1,112 @@
+import datetime
+import logging
+from pathlib import Path
+from typing import Dict, Tuple, Optional, Sequence
+
+import numpy as np
+
+from data_types import LongBusRouteStop
+from map_matching import RouteGeometry
+
+logger = logging.getLogger(__name__)
+
+BUCKET_MINUTES = 30
+BUCKETS = 24 * 60 // BUCKET_MINUTES
+MIN_SAMPLES = 3
+MAX_SAMPLES = 500
+MAX_SPEED = 100
+MIN_SPEED = 1
+MIN_SAMPLE_SECONDS = 20
+MAX_SAMPLE_SECONDS = 600
+
+SegmentKey = Tuple[int, int]
+
+
+def time_bucket(value: datetime.datetime) -> int:
+    return (value.hour * 60 + value.minute) // BUCKET_MINUTES
+
+
+class SpeedProfiles:
+    """Observed speeds per stop-to-stop segment and time-of-day bucket"""
+
+    def __init__(self, path='dumps/speed_profiles.npz'):
+        self.path = Path(path)
+        self.rows: Dict[SegmentKey, int] = {}
+        self.keys = np.zeros((0, 2), dtype=np.int64)
+        self.sums = np.zeros((0, BUCKETS), dtype=np.float64)
+        self.counts = np.zeros((0, BUCKETS), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_rows(self, keys: Sequence[SegmentKey]) -> np.ndarray:
+        new_keys = [k for k in dict.fromkeys(keys) if k not in self.rows]
+        if new_keys:
+            size = len(self.rows) + len(new_keys)
+            if size > len(self.keys):
+                capacity = max(size, len(self.keys) * 2, 64)
+                for name in ('keys', 'sums', 'counts'):
+                    value = getattr(self, name)
+                    grown = np.zeros((capacity, value.shape[1]), dtype=value.dtype)
+                    grown[:len(value)] = value
+                    setattr(self, name, grown)
+            for key in new_keys:
+                self.keys[len(self.rows)] = key
+                self.rows[key] = len(self.rows)
+        return np.array([self.rows[k] for k in keys], dtype=np.int64)
+
+    def add(self, keys: Sequence[SegmentKey], buckets: Sequence[int], speeds: Sequence[float]):
+        if not keys:
+            return
+        speeds = np.asarray(speeds, dtype=np.float64)
+        valid = (speeds >= MIN_SPEED) & (speeds < MAX_SPEED)
+        rows = self.get_rows(keys)[valid]
+        buckets = np.asarray(buckets, dtype=np.int64)[valid]
+        np.add.at(self.sums, (rows, buckets), speeds[valid])
+        np.add.at(self.counts, (rows, buckets), 1)
+        saturated = self.counts[rows, buckets] > MAX_SAMPLES
+        if saturated.any():
+            self.sums[rows[saturated], buckets[saturated]] /= 2
+            self.counts[rows[saturated], buckets[saturated]] /= 2
+
+    def speeds(self, keys: Sequence[SegmentKey], bucket: int) -> np.ndarray:
+        """Average speeds, NaN where there are not enough samples"""
+        rows = np.array([self.rows.get(k, -1) for k in keys], dtype=np.int64)
+        known = rows >= 0
+        result = np.full(len(keys), np.nan)
+        counts = self.counts[rows[known], bucket]
+        result[known] = np.where(counts >= MIN_SAMPLES, self.sums[rows[known], bucket] / np.maximum(counts, 1), np.nan)
+        return result
+
+    def route_travel_times(self, route: Sequence[LongBusRouteStop], distances: np.ndarray,
+                           geometry: Optional[RouteGeometry], bucket: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Cumulative minutes over profiled segments and cumulative km over the rest, by stop position.
+        Minutes use segment lengths along the route geometry, the same ones the speeds were sampled on"""
+        if not route or len(route) < 2 or not geometry or len(geometry.stop_offsets) != len(route):
+            return
+        lengths = np.diff(distances)
+        speeds = self.speeds([(a.ID, b.ID) for (a, b) in zip(route, route[1:])], bucket)
+        profiled = ~np.isnan(speeds)
+        minutes = np.where(profiled, np.diff(geometry.stop_offsets) * 60 / np.where(profiled, speeds, 1), 0)
+        return (np.concatenate(([0.0], np.cumsum(minutes))),
+                np.concatenate(([0.0], np.cumsum(np.where(profiled, 0, lengths)))))
+
+    def save(self):
+        size = len(self.rows)
+        tmp_path = self.path.with_suffix('.tmp.npz')
+        np.savez(tmp_path, keys=self.keys[:size], sums=self.sums[:size], counts=self.counts[:size])
+        tmp_path.replace(self.path)
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path) as data:
+                if data['sums'].shape[1] != BUCKETS:
+                    return
+                self.keys, self.sums, self.counts = data['keys'], data['sums'], data['counts']
+        except Exception:
+            logger.exception(f'Cannot load speed profiles from {self.path}')
+            return
+        self.rows = {(int(a), int(b)): i for (i, (a, b)) in enumerate(self.keys)}
+        logger.info(f'Loaded speed profiles for {len(self.rows)} segments')
@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Type, Tuple, Sequence, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VRNBUSSC'
+SCHEMA_VERSION = 1
+HEADER = struct.Struct('<8sHQ32s')
+
+
+class CacheEntry(NamedTuple):
+    fields: Tuple[str, ...]
+    rows: List[tuple]
+    updated: float
+
+
+class StaticCache:
+    """Versioned binary cache of static reference data: magic, schema version, payload size and SHA-256 checksum"""
+
+    def __init__(self, path='dumps/static_cache.bin'):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.entries: Dict[str, CacheEntry] = self.read()
+
+    def modified(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read(self) -> Dict[str, CacheEntry]:
+        self.mtime = self.modified()
+        if self.mtime is None:
+            return {}
+        try:
+            data = self.path.read_bytes()
+            (magic, version, size, checksum) = HEADER.unpack_from(data)
+            payload = data[HEADER.size:]
+            if magic != MAGIC or version != SCHEMA_VERSION:
+                logger.info(f'Skip static cache {self.path}: schema {magic!r} v{version}')
+                return {}
+            if len(payload) != size or hashlib.sha256(payload).digest() != checksum:
+                logger.error(f'Skip static cache {self.path}: checksum mismatch')
+                return {}
+            return {k: CacheEntry(*v) for (k, v) in pickle.loads(payload).items()}
+        except Exception:
+            logger.exception(f'Cannot read static cache {self.path}')
+            return {}
+
+    def write(self):
+        payload = pickle.dumps({k: tuple(v) for (k, v) in self.entries.items()}, protocol=4)
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, SCHEMA_VERSION, len(payload), hashlib.sha256(payload).digest()))
+            f.write(payload)
+        tmp_path.replace(self.path)
+        self.mtime = self.modified()
+
+    def get(self, resource: str, record_type: Type) -> Optional[List]:
+        """Cached records, None if missing or stored with other fields. Reread if another process replaced the file"""
+        with self.lock:
+            if self.modified() != self.mtime:
+                self.entries = self.read()
+            entry = self.entries.get(resource)
+        if not entry or entry.fields != record_type._fields:
+            return None
+        return [record_type._make(x) for x in entry.rows]
+
+    def put(self, resource: str, records: Sequence[NamedTuple]):
+        if not records:
+            return
+        with self.lock:
+            self.entries[resource] = CacheEntry(tuple(records[0]._fields), [tuple(x) for x in records], time.time())
+            self.write()
@@ -0,0 +1,47 @@
+import gzip
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, Iterable, NamedTuple, Tuple
+
+
+class PreparedPayload(NamedTuple):
+    body: bytes
+    gzipped: bytes
+    etag: str
+    version: int
+    empty: bool
+
+
+def prepare_payload(data, version: int, **dumps_kwargs) -> PreparedPayload:
+    body = json.dumps(data, **dumps_kwargs).encode('utf-8')
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    return PreparedPayload(body, gzip.compress(body, mtime=0), etag, version, not data)
+
+
+def content_version(payloads: Iterable[PreparedPayload]) -> str:
+    """Version of a set of payloads taken from their content, the same in every process serving it"""
+    return hashlib.sha256(''.join(x.etag for x in payloads).encode('utf-8')).hexdigest()[:16]
+
+
+class PayloadCache:
+    """Serialized and compressed responses, built once per dataset version"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.payloads: Dict[str, PreparedPayload] = {}
+        self.building: Dict[Tuple[str, int], threading.Lock] = {}
+
+    def get(self, name: str, version: int, build: Callable[[], PreparedPayload]) -> PreparedPayload:
+        payload = self.payloads.get(name)
+        if payload and payload.version == version:
+            return payload
+        with self.lock:
+            build_lock = self.building.setdefault((name, version), threading.Lock())
+        with build_lock:
+            payload = self.payloads.get(name)
+            if not payload or payload.version != version:
+                payload = self.payloads[name] = build()
+        with self.lock:
+            self.building.pop((name, version), None)
+        return payload
@@ -41,32 +41,47 @@ class CdsRouteTestCase(unittest.TestCase):
             result = self.cds.get_dist(route_name, stop_2, stop_1)
             self.assertFalse(result)
 
+    def closest_stops_on_route(self, route_name, coords):
+        """Closest stop after each fix of a bus reporting once a minute"""
+        map_matcher = self.cds.route_registry.state.routes.map_matcher
+        route_match = None
+        result = []
+        for (i, (lat, lon)) in enumerate(coords):
+            position = CdsBusPosition(lat, lon, self.date_time + datetime.timedelta(minutes=i))
+            route_match = map_matcher.match(route_name, [position], [route_match])[0]
+            result.append(self.cds.get_closest_bus_stop_on_route(route_name, route_match))
+        return result
+
     def test_closest_bus_stop_checked(self):
         route_name = '5А'
-        pos_1 = CdsBusPosition(51.705497, 39.149543, self.date_time)  # у-м Молодёжный
-        pos_2 = CdsBusPosition(51.705763, 39.155278, self.date_time)  # 60 лет ВЛКСМ
+        pos_0 = (51.706679, 39.173402)  # ул. Лизюкова
+        pos_1 = (51.705497, 39.149543)  # у-м Молодёжный
+        pos_2 = (51.705763, 39.155278)  # 60 лет ВЛКСМ
 
         with self.subTest('From city center '):
-            result = self.cds.get_closest_bus_stop_checked(route_name, (pos_2, pos_1))
-            self.assertTrue(result.NAME_ == 'у-м Молодежный (ул. Лизюкова из центра)')
-            self.assertEqual(result.NUMBER_, 62)
+            result = self.closest_stops_on_route(route_name, (pos_0, pos_2, pos_1))[-1]
+            self.assertEqual(result.NAME_, 'у-м Молодежный (ул. Лизюкова в центр)')
+            self.assertEqual(result.NUMBER_, 13)
 
         with self.subTest('To city center '):
-            result = self.cds.get_closest_bus_stop_checked(route_name, (pos_1, pos_2))
-            self.assertEqual(result.NUMBER_, 5)
+            result = self.closest_stops_on_route(route_name, (pos_1, pos_2))[-1]
+            self.assertEqual(result.NAME_, 'Институт Искусств (в центр)')
+            self.assertEqual(result.NUMBER_, 14)
 
     def test_closest_bus_stop_same_stations(self):
-        positions = [CdsBusPosition(51.667033, 39.193648, self.date_time),
-                     CdsBusPosition(51.672135, 39.187541, self.date_time),
-                     CdsBusPosition(51.675065, 39.185286, self.date_time),
-                     CdsBusPosition(51.677922, 39.184953, self.date_time),
-                     CdsBusPosition(51.677922, 39.184953, self.date_time),
-                     CdsBusPosition(51.680843, 39.184798, self.date_time)]
-
-        result = self.cds.get_closest_bus_stop_checked("90", positions)
-
-        self.assertTrue(result.NUMBER_ == 40)
-        self.assertTrue(result.NAME_ == 'Проспект Труда (Московский проспект из центра)')
+        coords = [(51.667033, 39.193648),
+                  (51.672135, 39.187541),
+                  (51.675065, 39.185286),
+                  (51.677922, 39.184953),
+                  (51.677922, 39.184953),
+                  (51.680843, 39.184798)]
+
+        result = self.closest_stops_on_route('5А', coords)
+
+        self.assertEqual(result[3], result[4])
+        self.assertEqual(result[4].NUMBER_, 6)
+        self.assertEqual(result[4].NAME_, 'Проспект Труда (Московский проспект из центра)')
+        self.assertEqual(result[5].NAME_, 'Рабочий проспект (из центра)')
 
     def test_closest_bus_stop(self):
         route_bus = CdsRouteBus.make(*[
@@ -0,0 +1,69 @@
+import datetime
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+from cds import CdsRequest
+from data_providers import CachedStaticDataProvider, CdsDBDataProvider, DeltaObjects, SharedFleetDataProvider, \
+    merge_sources
+from data_types import BusStop, CoddBus
+from shared_fleet import SharedFleetFile
+from static_cache import StaticCache
+from test_fixtures import NOW, make_bus, make_route
+
+
+class TestDeltaObjects(unittest.TestCase):
+    def test_merge_by_vehicle_key(self):
+        delta = DeltaObjects()
+        merged = delta.merge([make_bus(1, 2, last_time=NOW - datetime.timedelta(minutes=1)), make_bus(1, 3),
+                              make_bus(2, 2, last_time=NOW + datetime.timedelta(hours=1))], True, NOW)
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(delta.watermark, NOW)
+
+        updated = make_bus(1, 3, last_time=NOW + datetime.timedelta(seconds=30))
+        merged = delta.merge([updated], False, NOW + datetime.timedelta(minutes=1))
+        self.assertEqual(len(merged), 3)
+        self.assertIn(updated, merged)
+        self.assertEqual(delta.watermark, updated.last_time_)
+
+    def test_merge_sources(self):
+        objects = [make_bus(1, 2), make_bus(2, 3, '90')]
+        obl_objects = [make_bus(3, None, '125', speed=0), make_bus(1, None, speed=0)]
+        self.assertListEqual(merge_sources(objects, obl_objects), objects + obl_objects[:1])
+
+
+class TestCdsDBDataProvider(unittest.TestCase):
+    def test_fetcher_process_opens_no_connection(self):
+        provider = CdsDBDataProvider(logging.getLogger('vrnbus'), fetcher_process=True)
+        self.assertIsNone(provider.cds_db_data)
+        self.assertTrue(all(x is None for x in provider.cds_db_project.connections.queue))
+
+
+class TestCachedStaticDataProvider(unittest.TestCase):
+    def test_follower_started_without_cache(self):
+        logger = logging.getLogger('vrnbus')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'static_cache.bin'
+            static_provider = CachedStaticDataProvider(logger, StaticCache(path))
+            provider = SharedFleetDataProvider(logger, static_provider, SharedFleetFile(Path(tmp_dir) / 'fleet.bin'))
+            cds = CdsRequest(logger, provider)
+            self.assertListEqual(cds.bus_stops, [])
+            self.assertFalse(provider.has_static_update())
+
+            route = make_route(3)
+            leader_cache = StaticCache(path)
+            leader_cache.put('codd_route', [CoddBus('5А', 0)])
+            leader_cache.put('bus_stations_routes', route)
+            leader_cache.put('bus_stops', [BusStop(x.NAME_, x.LAT_, x.LON_, x.ID) for x in route])
+            cds.update_static_from_leader()
+
+            self.assertEqual(len(cds.bus_stops), 3)
+            self.assertListEqual(cds.codd_buses, ['5А'])
+            self.assertListEqual(cds.route_registry.state.routes.bus_routes['5А'], route)
+            self.assertEqual(cds.suggest_bus_stops('stop 1')[0].ID, 1)
+            self.assertFalse(provider.has_static_update())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import datetime
+import unittest
+
+from data_types import CdsRouteBus
+from fetcher import encode_buses, decode_buses
+
+
+class TestFleetEncoding(unittest.TestCase):
+    def test_round_trip(self):
+        buses = [CdsRouteBus(51.67, 39.2, 20, datetime.datetime(2026, 1, 1, 12, 0, 1, 500000), 'bus 1', 1, 2, '5А',
+                             bus_station_='Цирк', obj_output=1, bort_name=''),
+                 CdsRouteBus(51.68, 39.3, 0, datetime.datetime(2026, 1, 1, 12), '2001', 3, None, None,
+                             last_station_time_=None, bus_station_=None, azimuth=270)]
+        decoded = decode_buses(encode_buses(buses))
+        self.assertListEqual(decoded, buses)
+        self.assertIsNone(decoded[1].proj_id_)
+        self.assertListEqual(decode_buses(encode_buses([])), [])
+
+        with self.assertRaises(ValueError):
+            decode_buses(b'X' * 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,15 @@
+import datetime
+from typing import List
+
+from data_types import CdsRouteBus, LongBusRouteStop
+
+NOW = datetime.datetime(2026, 1, 1, 12)
+
+
+def make_bus(obj_id=1, proj_id=1, route_name='5А', last_time=NOW, speed=20, **kwargs) -> CdsRouteBus:
+    return CdsRouteBus(51.67, 39.2, speed, last_time, f'bus {obj_id}', obj_id, proj_id, route_name, **kwargs)
+
+
+def make_route(size: int) -> List[LongBusRouteStop]:
+    """Stops along one parallel, about 0.69 km apart"""
+    return [LongBusRouteStop(i, f'stop {i}', 51.67, 39.20 + i * 0.01, 0, ID=i) for i in range(size)]
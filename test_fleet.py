@@ -0,0 +1,46 @@
+import datetime
+import unittest
+
+from fleet import RouteSpeedWindow, FleetColumns, FleetStats
+from test_fixtures import NOW, make_bus
+
+
+class TestRouteSpeedWindow(unittest.TestCase):
+    def test_running_sums(self):
+        def bus(obj_id, route_name, minutes_ago, speed, avg_speed):
+            last_time = NOW - datetime.timedelta(minutes=minutes_ago)
+            return make_bus(obj_id, 1, route_name, last_time, speed, last_station_time_=last_time, bus_station_='',
+                            avg_speed=avg_speed)
+
+        window = RouteSpeedWindow(smoothing=1)
+        window.update([bus(1, '5А', 1, 20, 30), bus(2, '5А', 10, 10, 0.5), bus(3, '90', 20, 40, 40)], [], NOW)
+        self.assertDictEqual(window.speed_dict(), {'5А': 15})
+        self.assertEqual(window.avg_speed, 15)
+
+        window.update([bus(2, '90', 0, 30, 20)], [(1, 1)], NOW + datetime.timedelta(minutes=6))
+        self.assertDictEqual(window.speed_dict(), {'90': 20})
+        self.assertEqual(window.avg_speed, 30)
+
+        copied = window.copy()
+        copied.update([bus(4, '5А', 0, 10, 10)], [(2, 1)], NOW + datetime.timedelta(minutes=6))
+        self.assertDictEqual(copied.speed_dict(), {'5А': 10})
+        self.assertDictEqual(window.speed_dict(), {'90': 20})
+        self.assertEqual(window.avg_speed, 30)
+
+
+class TestFleetStats(unittest.TestCase):
+    def test_counts_since(self):
+        def bus(obj_id, route_name, proj_id, minutes_ago, obj_output=0):
+            return make_bus(obj_id, proj_id, route_name, NOW - datetime.timedelta(minutes=minutes_ago),
+                            obj_output=obj_output)
+
+        stats = FleetStats(FleetColumns([bus(1, '10А', 1, 0), bus(2, '5', 2, 5), bus(3, '10А', 3, 5),
+                                         bus(4, '10А', 1, 20), bus(5, '5', 2, 0, obj_output=1)]))
+        self.assertEqual(stats.active_since(NOW - datetime.timedelta(minutes=5)), 3)
+        self.assertEqual(stats.active_since(NOW - datetime.timedelta(minutes=30)), 4)
+        self.assertListEqual(stats.route_counts_since(NOW - datetime.timedelta(minutes=10)),
+                             [('5     (  2)', 2), ('10А   (  1)', 1), ('10А   (  3)', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import datetime
+import unittest
+
+from fleet_health import FleetHealthSeries, HealthSample
+
+
+class TestFleetHealthSeries(unittest.TestCase):
+    def test_downsampling(self):
+        series = FleetHealthSeries()
+        start = datetime.datetime(2026, 1, 1, 12)
+        for i in range(10):
+            series.add(HealthSample(start + datetime.timedelta(seconds=15 * i), i, 0.5, 100, {'5А': i}))
+
+        self.assertEqual(series.last().active, 9)
+        self.assertEqual(len(series.query('raw')), 10)
+        minutes = series.query('1m')
+        self.assertListEqual([x.active for x in minutes], [1.5, 5.5, 8.5])
+        self.assertDictEqual(minutes[0].route_counts, {'5А': 1.5})
+        self.assertEqual(len(series.query('15m')), 1)
+        self.assertEqual(len(series.query('raw', start + datetime.timedelta(minutes=2))), 2)
+
+        series.add(HealthSample(start + datetime.timedelta(hours=2), 1, 0.5, 100, {}))
+        self.assertEqual(len(series.query('raw')), 1)
+        self.assertEqual(len(series.query('1m')), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
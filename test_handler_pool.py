@@ -0,0 +1,29 @@
+import asyncio
+import time
+import unittest
+
+from handler_pool import HandlerPool
+
+
+class TestHandlerPool(unittest.TestCase):
+    def test_queue_metrics(self):
+        pool = HandlerPool(max_workers=1, max_queue=2)
+
+        async def run_all():
+            tasks = [asyncio.ensure_future(pool.run(time.sleep, 0.05)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            self.assertTrue(pool.is_full())
+            await asyncio.gather(*tasks)
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(run_all())
+        loop.close()
+
+        stats = pool.stats()
+        self.assertFalse(pool.is_full())
+        self.assertEqual((stats['waiting'], stats['running'], stats['completed']), (0, 0, 3))
+        self.assertGreaterEqual(stats['max_wait'], 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
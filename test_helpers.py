@@ -36,6 +36,14 @@ class TestGeoFunction(unittest.TestCase):
             with self.subTest(f'{params}, {result}'):
                 self.assertEqual(f(*params), result)
 
+    def test_distances_km(self):
+        lats = [51.652228, 0.0, 51.697372]
+        lons = [39.169720, 39.182616, 39.182616]
+        result = helpers.distances_km(51.67, 39.18, lats, lons)
+        for (lat, lon, value) in zip(lats, lons, result):
+            with self.subTest(f'{lat}, {lon}'):
+                self.assertAlmostEqual(value, helpers.distance_km(51.67, 39.18, lat, lon))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,40 @@
+import datetime
+import unittest
+
+from data_types import CdsBusPosition
+from map_matching import MapMatcher
+from test_fixtures import NOW, make_route
+
+
+class TestMapMatcher(unittest.TestCase):
+    def test_advance_along_route(self):
+        route = make_route(4)
+        edges = {(1, 2): [(51.68, 39.21), (51.68, 39.22)]}
+        matcher = MapMatcher({'1': route}, edges)
+
+        (first,) = matcher.match('1', [CdsBusPosition(51.6701, 39.2005, NOW)], [None])
+        self.assertEqual(first.stop_index, 1)
+        self.assertEqual(first.direction, 0)
+        (second,) = matcher.match('1', [CdsBusPosition(51.6801, 39.2120, NOW + datetime.timedelta(minutes=3))],
+                                  [first])
+        self.assertEqual(second.stop_index, 2)
+        self.assertEqual(second.direction, 1)
+        self.assertLess(second.distance, 0.05)
+        self.assertGreater(second.offset, first.offset + 1.5)
+
+    def test_next_stop_ahead(self):
+        route = make_route(4)
+        matcher = MapMatcher({'1': route})
+        geometry = matcher.geometries['1']
+
+        (first,) = matcher.match('1', [CdsBusPosition(51.67, 39.2095, NOW)], [None])
+        (second,) = matcher.match('1', [CdsBusPosition(51.67, 39.2105, NOW + datetime.timedelta(seconds=20))],
+                                  [first])
+        self.assertEqual(second.direction, 1)
+        self.assertEqual(second.stop_index, 2)
+        self.assertAlmostEqual(matcher.remaining_km(second), geometry.stop_offsets[2] - second.offset)
+        self.assertEqual(geometry.stop_index(second.offset, -1), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
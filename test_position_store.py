@@ -0,0 +1,47 @@
+import datetime
+import unittest
+
+import helpers
+from data_types import CdsBusPosition
+from fleet import to_seconds
+from position_store import PositionStore
+
+
+class TestPositionStore(unittest.TestCase):
+    def test_ring_buffer_and_speeds(self):
+        store = PositionStore(depth=4, capacity=1)
+        start = datetime.datetime(2019, 1, 1, 10)
+        for i in range(6):
+            store.add('bus', CdsBusPosition(51.67 + i * 0.001, 39.18, start + datetime.timedelta(minutes=i)))
+        store.add('bus', CdsBusPosition(51.675, 39.18, start + datetime.timedelta(minutes=5)))
+        store.add('other', CdsBusPosition(51.67, 39.18, start))
+
+        positions = store.positions('bus')
+        self.assertEqual(len(positions), 4)
+        self.assertEqual(positions[0].last_time, start + datetime.timedelta(minutes=2))
+        self.assertAlmostEqual(positions[-1].lat, 51.675)
+
+        (names, avg_speeds, last_speeds) = store.update_speeds(['bus', 'other'])
+        self.assertListEqual(names, ['bus'])
+        expected = helpers.distance_km(51.672, 39.18, 51.675, 39.18) * 20
+        self.assertAlmostEqual(avg_speeds[0], expected, places=3)
+
+        self.assertListEqual(store.evict(to_seconds(start) + 3 * 60 * 60), ['bus', 'other'])
+        self.assertListEqual(store.positions('bus'), [])
+
+    def test_copy(self):
+        store = PositionStore(depth=4, capacity=1)
+        start = datetime.datetime(2019, 1, 1, 10)
+        store.add('bus', CdsBusPosition(51.67, 39.18, start))
+        copied = store.copy()
+        copied.add('bus', CdsBusPosition(51.68, 39.18, start + datetime.timedelta(minutes=1)))
+        copied.add('other', CdsBusPosition(51.67, 39.18, start))
+        copied.evict(to_seconds(start) + 3 * 60 * 60)
+
+        self.assertEqual(len(store.positions('bus')), 1)
+        self.assertNotIn('other', store)
+        self.assertEqual(len(copied), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
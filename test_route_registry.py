@@ -0,0 +1,47 @@
+import logging
+import unittest
+
+from data_types import LongBusRouteStop, CdsBaseDataProvider
+from route_registry import RouteRegistry
+
+
+class TestRouteRegistry(unittest.TestCase):
+    def test_refresh(self):
+        class Provider(CdsBaseDataProvider):
+            new_routes = {}
+
+            def load_bus_stations_routes(self):
+                return {'5А': [LongBusRouteStop(1, 'Цирк', 51.68, 39.21, 5, ID=1),
+                               LongBusRouteStop(2, 'ул. Кирова', 51.67, 39.2, 5, ID=2)]}
+
+            def load_new_bus_stations_routes(self):
+                return self.new_routes
+
+            def load_new_codd_route_names(self):
+                return {'10': 10, '2': 2}
+
+        provider = Provider()
+        registry = RouteRegistry(logging.getLogger(), provider)
+        state = registry.state
+        self.assertEqual(state.version, 0)
+        self.assertListEqual(state.new_route_list, ['2', '10'])
+        self.assertEqual(state.routes.spatial_indexes['5А'].nearest(51.671, 39.2)[0].ID, 2)
+
+        registry.refresh()
+        self.assertIs(registry.state, state)
+
+        provider.new_routes = {'10': [LongBusRouteStop(1, 'Цирк', 51.68, 39.21, 10, ID=1)]}
+        registry.refresh()
+        self.assertEqual(registry.version, 1)
+        self.assertIs(registry.state.routes, state.routes)
+        self.assertTupleEqual(registry.state.new_routes.index.get_routes_on_bus_stop(1), ('10',))
+
+        edges = {(1, 2): [(51.675, 39.205)]}
+        self.assertTrue(registry.set_route_edges(edges))
+        self.assertEqual(registry.version, 2)
+        self.assertFalse(registry.set_route_edges(dict(edges)))
+        self.assertEqual(registry.version, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import datetime
+import unittest
+
+from data_types import BusStop, CdsRouteBus
+from row_decoding import RowDecoder, parse_iso_time
+
+
+class TestRowDecoder(unittest.TestCase):
+    def test_decode(self):
+        decoder = RowDecoder(CdsRouteBus, ['LAST_LAT_', 'LAST_LON_', 'LAST_SPEED_', 'LAST_TIME_', 'NAME_', 'OBJ_ID_',
+                                           'PROJ_ID_', 'ROUTE_NAME_', 'UNUSED', 'OBJ_OUTPUT'],
+                             {'LAST_TIME_': parse_iso_time}, interned=('route_name_',))
+        rows = [(51.67, 39.2, 20, '2026-01-01T12:00:00', 'bus 1', 1, 2, ''.join(['5', 'А']), None, 1),
+                (51.68, 39.3, 30, '2026-01-01T12:00:01.500000', 'bus 2', 3, 4, '5А', None, 0)]
+        (first, second) = decoder.decode(rows)
+        self.assertEqual(first, CdsRouteBus(51.67, 39.2, 20, datetime.datetime(2026, 1, 1, 12), 'bus 1', 1, 2, '5А',
+                                            obj_output=1))
+        self.assertEqual(second.last_time_, datetime.datetime(2026, 1, 1, 12, 0, 1, 500000))
+        self.assertIs(first.route_name_, second.route_name_)
+
+        with self.assertRaises(ValueError):
+            RowDecoder(BusStop, ['NAME_', 'LAT_'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+import time
+import unittest
+
+from scheduler import AsyncScheduler
+
+
+class TestAsyncScheduler(unittest.TestCase):
+    def test_runs_and_timeouts(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        scheduler = AsyncScheduler(logging.getLogger())
+        counter = []
+        scheduler.add_job('fast', lambda: counter.append(1), 0.05)
+        scheduler.add_job('slow', lambda: time.sleep(0.3), 10, timeout=0.05, on_timeout=lambda *_: counter.append(0))
+        scheduler.start()
+        loop.run_until_complete(asyncio.sleep(0.27))
+        scheduler.stop()
+        scheduler.executor.shutdown()
+        loop.close()
+
+        stats = scheduler.stats()
+        self.assertGreaterEqual(stats['fast']['runs'], 4)
+        self.assertEqual(stats['fast']['errors'], 0)
+        self.assertEqual(stats['slow']['timeouts'], 1)
+        self.assertIn(0, counter)
+
+
+if __name__ == '__main__':
+    unittest.main()
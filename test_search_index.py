@@ -0,0 +1,34 @@
+import json
+import unittest
+
+import helpers
+from data_types import BusStop
+from search_index import BusStopSearchIndex
+
+
+class TestBusStopSearchIndex(unittest.TestCase):
+    def test_same_matches_as_fuzzy_search(self):
+        with open('bus_stops.json', 'rb') as f:
+            bus_stops = [BusStop(**i) for i in json.load(f)]
+        search_index = BusStopSearchIndex(bus_stops)
+        queries = ['кирова в центр', 'кирова', 'дк кир лен', 'автовокзал в', 'брно', 'пл', ' ', '(в', 'zz', '']
+
+        for query in queries:
+            with self.subTest(query):
+                expected = [x for x in bus_stops if helpers.fuzzy_search_advanced(query, x.NAME_)]
+                self.assertListEqual(search_index.search(query), expected)
+                self.assertEqual(search_index.has_matches(query), bool(expected))
+
+    def test_substring_search(self):
+        with open('bus_stops.json', 'rb') as f:
+            bus_stops = [BusStop(**i) for i in json.load(f)]
+        search_index = BusStopSearchIndex(bus_stops)
+
+        for query in ['Кирова', 'ул. к', 'в центр)', 'а', 'zz', '']:
+            with self.subTest(query):
+                expected = [x for x in bus_stops if query and query.lower() in x.NAME_.lower()]
+                self.assertListEqual(search_index.substring_search(query), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from shared_fleet import SharedFleetFile
+from test_fixtures import NOW, make_bus
+
+
+class TestSharedFleetFile(unittest.TestCase):
+    def test_publish_and_read(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'shared_fleet.bin'
+            leader = SharedFleetFile(path)
+            worker = SharedFleetFile(path)
+            self.assertFalse(worker.changed())
+
+            buses = [make_bus(1, 2)]
+            leader.publish(buses, NOW)
+            self.assertTrue(worker.changed())
+            self.assertListEqual(worker.read(), buses)
+            self.assertEqual(worker.now, NOW)
+            self.assertFalse(worker.changed())
+
+            leader.publish([], NOW)
+            self.assertListEqual(worker.read(), [])
+            self.assertEqual(worker.generation, 2)
+
+            restarted = SharedFleetFile(path)
+            restarted.publish(buses, NOW)
+            self.assertEqual(restarted.generation, 3)
+            self.assertTrue(worker.changed())
+            worker.read()
+
+            stale = SharedFleetFile(path)
+            stale.generation = 1
+            stale.publish([], NOW)
+            self.assertFalse(worker.changed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from snapshot_cache import generation_cache
+
+
+class TestGenerationCache(unittest.TestCase):
+    def test_invalidate_on_generation(self):
+        class Owner:
+            generation = 0
+            calls = 0
+
+            @generation_cache(maxsize=4)
+            def square(self, x):
+                self.calls += 1
+                return x * x
+
+        owner = Owner()
+        self.assertEqual([owner.square(2), owner.square(2), owner.square(3)], [4, 4, 9])
+        self.assertEqual(owner.calls, 2)
+        owner.generation = 1
+        self.assertEqual(owner.square(2), 4)
+        self.assertEqual(owner.calls, 3)
+        self.assertEqual(Owner.square.cache.info()['hits'], 1)
+
+    def test_older_generation_bypasses_cache(self):
+        class Owner:
+            generation = 2
+            calls = 0
+
+            @generation_cache(maxsize=4, stripes=1)
+            def square(self, x):
+                self.calls += 1
+                return x * x
+
+        owner = Owner()
+        self.assertEqual(owner.square(2), 4)
+        owner.generation = 1
+        self.assertEqual([owner.square(2), owner.square(2)], [4, 4])
+        self.assertEqual(owner.calls, 3)
+        owner.generation = 2
+        self.assertEqual(owner.square(2), 4)
+        self.assertEqual(owner.calls, 3)
+        self.assertEqual(Owner.square.cache.info()['currsize'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import json
+import unittest
+
+from data_types import BusStop
+from spatial_index import SPATIAL_INDEX_BACKENDS, build_spatial_index
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def test_backends_nearest(self):
+        with open('bus_stops.json', 'rb') as f:
+            bus_stops = [BusStop(**i) for i in json.load(f) if i['LAT_'] and i['LON_']]
+        points = [(51.6725, 39.2110), (51.7113, 39.1549), (51.6302, 39.1017)]
+
+        for backend in SPATIAL_INDEX_BACKENDS:
+            with self.subTest(backend):
+                spatial_index = build_spatial_index(bus_stops, backend)
+                for (lat, lon) in points:
+                    expected = sorted(bus_stops, key=lambda x: (x.LAT_ - lat) ** 2 + (x.LON_ - lon) ** 2)[:3]
+                    self.assertListEqual(spatial_index.nearest(lat, lon, 3), expected)
+                batch = spatial_index.nearest_batch([x[0] for x in points], [x[1] for x in points], 3)
+                self.assertListEqual(batch, [spatial_index.nearest(lat, lon, 3) for (lat, lon) in points])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import math
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from map_matching import MapMatcher
+from speed_profiles import SpeedProfiles
+from test_fixtures import make_route
+
+
+class TestSpeedProfiles(unittest.TestCase):
+    def test_add_and_persist(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiles = SpeedProfiles(Path(tmp_dir) / 'speed_profiles.npz')
+            profiles.add([(1, 2)] * 2 + [(2, 3)], [10, 10, 10], [20, 30, 150])
+            self.assertTrue(math.isnan(profiles.speeds([(1, 2)], 10)[0]))
+            profiles.add([(1, 2)], [10], [40])
+            profiles.save()
+
+            loaded = SpeedProfiles(profiles.path)
+            loaded.load()
+            self.assertListEqual(loaded.speeds([(1, 2), (2, 3), (3, 4)], 10)[:1].tolist(), [30.0])
+            self.assertTrue(all(math.isnan(x) for x in loaded.speeds([(2, 3), (3, 4)], 10)))
+
+    def test_travel_times_along_bent_segment(self):
+        route = make_route(3)
+        geometry = MapMatcher({'1': route}, {(0, 1): [(51.68, 39.20), (51.68, 39.21)]}).geometries['1']
+        distances = np.array([0.0, 0.69, 1.38])
+        profiles = SpeedProfiles()
+        profiles.add([(0, 1)] * 3, [10] * 3, [30] * 3)
+
+        (minutes, fallback_km) = profiles.route_travel_times(route, distances, geometry, 10)
+        bent_km = geometry.stop_offsets[1] - geometry.stop_offsets[0]
+        self.assertGreater(bent_km, 2.5)
+        self.assertAlmostEqual(minutes[1], bent_km * 2)
+        self.assertAlmostEqual(minutes[2], minutes[1])
+        self.assertListEqual(fallback_km.tolist(), [0.0, 0.0, 0.69])
+
+
+if __name__ == '__main__':
+    unittest.main()
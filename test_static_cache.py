@@ -0,0 +1,28 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from data_types import BusStop, LongBusRouteStop
+from static_cache import StaticCache
+
+
+class TestStaticCache(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'static_cache.bin'
+            bus_stops = [BusStop('ул. Кирова', 51.67, 39.2, 1), BusStop('Цирк', 51.68, 39.21, 2, 90)]
+            StaticCache(path).put('bus_stops', bus_stops)
+
+            cache = StaticCache(path)
+            self.assertListEqual(cache.get('bus_stops', BusStop), bus_stops)
+            self.assertIsNone(cache.get('bus_stops', LongBusRouteStop))
+            self.assertIsNone(cache.get('codd_route', BusStop))
+
+            data = bytearray(path.read_bytes())
+            data[-1] ^= 1
+            path.write_bytes(bytes(data))
+            self.assertIsNone(StaticCache(path).get('bus_stops', BusStop))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import gzip
+import json
+import unittest
+
+from static_payloads import PayloadCache, content_version, prepare_payload
+
+
+class TestPayloadCache(unittest.TestCase):
+    def test_built_once_per_version(self):
+        cache = PayloadCache()
+        builds = []
+
+        def build(version):
+            builds.append(version)
+            return prepare_payload({'result': ['5А']}, version, ensure_ascii=False)
+
+        payload = cache.get('buslist', 1, lambda: build(1))
+        self.assertIs(cache.get('buslist', 1, lambda: build(1)), payload)
+        self.assertEqual(gzip.decompress(payload.gzipped), payload.body)
+        self.assertEqual(json.loads(payload.body), {'result': ['5А']})
+        self.assertFalse(payload.empty)
+
+        self.assertEqual(cache.get('buslist', 2, lambda: build(2)).etag, payload.etag)
+        self.assertListEqual(builds, [1, 2])
+        self.assertTrue(prepare_payload({}, 1).empty)
+
+        self.assertEqual(content_version([payload]), content_version([prepare_payload({'result': ['5А']}, 7,
+                                                                                      ensure_ascii=False)]))
+        self.assertNotEqual(content_version([payload]), content_version([prepare_payload({'result': []}, 1)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
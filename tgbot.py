@@ -4,7 +4,6 @@ import os
 import re
 import textwrap
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from telegram import ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, \
     KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import CommandHandler, CallbackQueryHandler, Filters, MessageHandler, Updater, run_async
@@ -12,6 +11,7 @@ from telegram.ext import CommandHandler, CallbackQueryHandler, Filters, MessageH
 from data_types import UserLoc, ArrivalInfo, StatsData, BusStop
 from fotobus_scrapper import fb_links
 from helpers import parse_routes, natural_sort_key, grouper, SearchResult, parse_int
+from scheduler import AsyncScheduler
 from tracking import EventTracker, TgEvent, get_event_by_name
 
 try:
@@ -28,7 +28,7 @@ except ImportError:
 
 
 class BusBot:
-    def __init__(self, cds, user_settings, logger, tracker: EventTracker):
+    def __init__(self, cds, user_settings, logger, tracker: EventTracker, scheduler: AsyncScheduler = None):
         """Start the bot."""
         self.cds = cds
         self.user_settings = user_settings
@@ -73,12 +73,10 @@ class BusBot:
         # # log all errors
         self.dp.add_error_handler(self.error)
 
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
-        self.scheduler.add_job(self.stats_checking, 'interval', minutes=1)
+        if scheduler:
+            scheduler.add_job('stats_checking', self.stats_checking, 60)
         # Start the Bot
         self.updater.start_polling(timeout=30)
-        self.stats_checking()
 
         # Run the bot until you press Ctrl-C or the process receives SIGINT,
         # SIGTERM or SIGABRT. This should be used most of the time, since
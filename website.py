@@ -1,13 +1,15 @@
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable
 
 import tornado.web
 
 import helpers
 from abuse_checker import AbuseChecker
 from data_processors import WebDataProcessor
+from fleet_health import RESOLUTIONS
+from handler_pool import HandlerPool
 from tracking import WebEvent, EventTracker
 
 if 'DYNO' in os.environ:
@@ -16,6 +18,12 @@ else:
     debug = True
 
 FULL_ACCESS_KEY = os.environ.get('FULL_ACCESS_KEY', '')
+STATIC_PAYLOAD_URLS = {
+    '/buslist': 'buslist',
+    '/bus_stops': 'bus_stops',
+    '/bus_stops_routes': 'bus_stops_routes',
+    '/bus_stations.json': 'bus_stations',
+}
 
 try:
     import settings
@@ -32,11 +40,27 @@ class NoCacheStaticFileHandler(tornado.web.StaticFileHandler):
 
 
 class BaseHandler(tornado.web.RequestHandler):
-    executor = ThreadPoolExecutor()
+    executor = HandlerPool()
+    needs_fleet = False
+
+    async def offload(self, func: Callable, *args):
+        """Runs func in the handler pool, answers 503 if too many requests are already waiting"""
+        if self.executor.is_full():
+            self.executor.reject()
+            self.logger.warning(f'Handler queue is full, reject {self.request.uri}')
+            raise tornado.web.HTTPError(503)
+        return await self.executor.run(func, *args)
+
+    def write_error(self, status_code, **kwargs):
+        if status_code == 503:
+            self.set_header('Retry-After', 15)
+        super().write_error(status_code, **kwargs)
 
     def prepare(self):
         if not self.get_cookie("user_ip"):
             self.set_cookie("user_ip", self.remote_ip, expires_days=30)
+        if self.needs_fleet and not self.processor.cds.is_ready:
+            raise tornado.web.HTTPError(503, reason='Data not ready')
 
     def track(self, event: WebEvent, *params):
         if 'CFNetwork' in self.user_agent:
@@ -114,19 +138,22 @@ class BusSite(tornado.web.Application):
             (r"/codd_arrival_by_id", ArrivalByIdHandler),
             (r"/busmap", BusInfoHandler),
             (r"/businfolist", BusInfoHandler),
-            (r"/buslist", BusListHandler),
+            (r"/buslist", StaticPayloadHandler, {"dataset": "buslist"}),
             (r"/new_routes", NewRoutesHandler),
             (r"/bus_stop_search", BusStopSearchHandler),
-            (r"/bus_stops_routes", BusStopsRoutesHandler),
+            (r"/bus_stop_suggest", BusStopSuggestHandler),
+            (r"/bus_stops_routes", StaticPayloadHandler, {"dataset": "bus_stops_routes"}),
             (r"/bus_stops_new_routes", BusStopsNewRoutesHandler),
-            (r"/bus_stations.json", BusStopsRoutesForAppsHandler),
-            (r"/bus_stops", BusStopsHandler),
+            (r"/bus_stations.json", StaticPayloadHandler, {"dataset": "bus_stations"}),
+            (r"/bus_stops", StaticPayloadHandler, {"dataset": "bus_stops"}),
+            (r"/static_version", StaticVersionHandler),
             (r"/fotobus_info", FotoBusHandler),
             (r"/complains", EmailFromBusHandler),
             (r"/bus_route_edges", BusRouteEdgesHandler),
             (r"/ping", PingHandler),
             (r"/(.*.json)", static_handler, {"path": Path("./")}),
             (r"/stats.html", StatsHandler),
+            (r"/stats_history", StatsHistoryHandler),
             (r"/(.*)", static_handler, {"path": Path("./fe"), "default_filename": "index.html"}),
         ]
         tornado.web.Application.__init__(self, handlers, compress_response=True)
@@ -144,7 +171,9 @@ class PingHandler(BaseHandler):
 
 
 class BusInfoHandler(BaseHandler):
-    def bus_info_response(self, src, query, lat, lon, parent_url, hide_text):
+    needs_fleet = True
+
+    async def bus_info_response(self, src, query, lat, lon, parent_url, hide_text):
         is_map = src == 'map'
         if self.referer and 'vrnbus.herokuapp.com' not in self.referer:
             self.track(WebEvent.FRAUD, self.referer, query, lat, lon)
@@ -159,11 +188,16 @@ class BusInfoHandler(BaseHandler):
             self.track(WebEvent.ABUSE, query, lat, lon)
             return self.send_error(500)
         self.track(event, src, query, lat, lon)
-        response = self.processor.get_bus_info(query, lat, lon, self.full_access, hide_text)
-        self.write(json.dumps(response, cls=helpers.CustomJsonEncoder))
+        full_access = self.full_access
+
+        def bus_info():
+            response = self.processor.get_bus_info(query, lat, lon, full_access, hide_text)
+            return json.dumps(response, cls=helpers.CustomJsonEncoder)
+
+        self.write(await self.offload(bus_info))
         self.caching()
 
-    def get(self):
+    async def get(self):
         q = self.get_argument('q')
         src = self.get_argument('src', None)
         lat = self.get_argument('lat', None)
@@ -171,44 +205,43 @@ class BusInfoHandler(BaseHandler):
         parent_url = self.get_argument('parentUrl', None)
         hide_text = self.get_argument('hide_text', None) is not None
 
-        self.bus_info_response(src, q, lat, lon, parent_url, hide_text)
+        await self.bus_info_response(src, q, lat, lon, parent_url, hide_text)
 
 
 class ArrivalHandler(BaseHandler):
-    def arrival_response(self):
+    needs_fleet = True
+
+    async def arrival_response(self):
         (lat, lon) = (float(self.get_argument(x)) for x in ('lat', 'lon'))
         query = self.get_argument('q')
         self.track(WebEvent.ARRIVAL, query, lat, lon)
-        response = self.processor.get_arrival(query, lat, lon)
-        self.write(json.dumps(response, cls=helpers.CustomJsonEncoder))
+
+        def arrival():
+            return json.dumps(self.processor.get_arrival(query, lat, lon), cls=helpers.CustomJsonEncoder)
+
+        self.write(await self.offload(arrival))
         self.caching()
 
-    def get(self):
-        self.arrival_response()
+    async def get(self):
+        await self.arrival_response()
 
 
 class ArrivalByIdHandler(BaseHandler):
-    def arrival_response(self):
+    needs_fleet = True
+
+    async def arrival_response(self):
         busstop_id = int(self.get_argument('id'))
         query = self.get_argument('q', "")
         self.track(WebEvent.ARRIVAL, query, busstop_id)
-        response = self.processor.get_arrival_by_id(query, busstop_id)
-        self.write(json.dumps(response, cls=helpers.CustomJsonEncoder))
-        self.caching()
-
-    def get(self):
-        self.arrival_response()
 
+        def arrival():
+            return json.dumps(self.processor.get_arrival_by_id(query, busstop_id), cls=helpers.CustomJsonEncoder)
 
-class BusListHandler(BaseHandler):
-    def _response(self):
-        response = self.processor.get_bus_list()
-        self.write(json.dumps(response))
-        if response:
-            self.caching(max_age=24 * 60 * 60)
+        self.write(await self.offload(arrival))
+        self.caching()
 
-    def get(self):
-        self._response()
+    async def get(self):
+        await self.arrival_response()
 
 
 class NewRoutesHandler(BaseHandler):
@@ -222,35 +255,39 @@ class NewRoutesHandler(BaseHandler):
         self._response()
 
 
-class BusStopsHandler(BaseHandler):
-    def _response(self):
-        response = self.processor.get_bus_stops()
-        self.write(json.dumps(response, ensure_ascii=False))
-        if response:
-            self.caching(max_age=24 * 60 * 60)
+class StaticPayloadHandler(BaseHandler):
+    """Dataset serialized and compressed once per version, answered with 304 if the client has it"""
 
-    def get(self):
-        self._response()
+    def initialize(self, dataset):
+        self.dataset = dataset
 
-class BusStopsRoutesForAppsHandler(BaseHandler):
-    def _response(self):
-        response = self.processor.get_bus_stops_for_routes_for_apps()
-        self.write(json.dumps(response, ensure_ascii=False, indent=1, cls=helpers.CustomJsonEncoder))
-        if response:
+    async def get(self):
+        payload = await self.offload(self.processor.get_static_payload, self.dataset)
+        self.set_header('Etag', payload.etag)
+        self.set_header('Vary', 'Accept-Encoding')
+        if not payload.empty:
             self.caching(max_age=24 * 60 * 60)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.set_header('Content-Encoding', 'gzip')
+            self.write(payload.gzipped)
+        else:
+            self.write(payload.body)
 
-    def get(self):
-        self._response()
 
-class BusStopsRoutesHandler(BaseHandler):
-    def _response(self):
-        response = self.processor.get_bus_stops_for_routes()
-        self.write(json.dumps(response, ensure_ascii=False))
-        if response:
-            self.caching(max_age=24 * 60 * 60)
+class StaticVersionHandler(BaseHandler):
+    def manifest(self):
+        datasets = {url: self.processor.get_static_payload(name) for (url, name) in STATIC_PAYLOAD_URLS.items()}
+        return {'version': self.processor.static_version,
+                'datasets': {url: {'etag': x.etag, 'size': len(x.body), 'gzip_size': len(x.gzipped)}
+                             for (url, x) in datasets.items()}}
 
-    def get(self):
-        self._response()
+    async def get(self):
+        response = await self.offload(self.manifest)
+        self.write(json.dumps(response))
+        self.caching()
 
 
 class BusStopsNewRoutesHandler(BaseHandler):
@@ -265,15 +302,32 @@ class BusStopsNewRoutesHandler(BaseHandler):
 
 
 class BusStopSearchHandler(BaseHandler):
-    def _response(self):
+    needs_fleet = True
+
+    async def _response(self):
         query = self.get_argument('q')
         station_query = self.get_argument('station')
         self.track(WebEvent.BUSSTOP, query, station_query)
-        response = self.processor.get_arrival_by_name(query, station_query)
-        self.logger.info(response)
-        self.write(json.dumps(response, cls=helpers.CustomJsonEncoder))
+
+        def arrival():
+            response = self.processor.get_arrival_by_name(query, station_query)
+            self.logger.info(response)
+            return json.dumps(response, cls=helpers.CustomJsonEncoder)
+
+        self.write(await self.offload(arrival))
         self.caching()
 
+    async def get(self):
+        await self._response()
+
+
+class BusStopSuggestHandler(BaseHandler):
+    def _response(self):
+        query = self.get_argument('q')
+        response = self.processor.get_bus_stop_suggest(query)
+        self.write(json.dumps(response, ensure_ascii=False))
+        self.caching(max_age=24 * 60 * 60)
+
     def get(self):
         self._response()
 
@@ -303,20 +357,35 @@ class StatsHandler(BaseHandler):
         self.arrival_response()
 
 
+class StatsHistoryHandler(BaseHandler):
+    def arrival_response(self):
+        resolution = self.get_argument('resolution', 'raw')
+        (hours, _) = helpers.parse_int(self.get_argument('hours', None))
+        if resolution not in RESOLUTIONS:
+            self.send_error(400)
+            return
+        response = {**self.processor.get_stats_history(resolution, hours), 'handlers': self.executor.stats()}
+        self.write(json.dumps(response))
+        self.caching()
+
+    def get(self):
+        self.arrival_response()
+
+
 class BusRouteEdgesHandler(BaseHandler):
     def arrival_response(self):
         data = tornado.escape.json_decode(self.request.body)
         self.write(data)
         self.caching()
 
-    def post(self):
+    async def post(self):
         if not self.full_access:
             self.send_error(401, reason="Wrong the page URL")
             return
         data = tornado.escape.json_decode(self.request.body)
         edge_key = json.dumps(data.get("edge_key"))
         points = json.dumps(data.get("points"))
-        self.processor.add_route_edges(edge_key, points)
+        await self.offload(self.processor.add_route_edges, edge_key, points)
 
     def get(self):
         result = self.processor.get_route_edges()